@@ -0,0 +1,167 @@
+"""
+Benchmarks of the stages of the parser on the `json` directory of the millésimes and on M source files.
+
+For each M file, the parsing by `m_to_ast` is timed. For each millésime, `simplify_ast` and `lighten_ast` are run on
+its 1_ast_by_file directory, then `dependencies_visitors` visits it, and the light AST is compiled by `compile_ast`
+and evaluated with both backends. Each benchmark is timed several times, keeping the best time, then run once more
+with `tracemalloc` to measure its peak memory.
+
+The results are dicts which can be saved as JSON, and compared with the results of a previous run to detect the
+benchmarks whose time or peak memory grew more than a threshold.
+"""
+
+
+import collections
+import contextlib
+import datetime
+import functools
+import gc
+import io
+import os
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+
+from calculette_impots_m_language_parser import compile_ast, dependencies_visitors, lighten_ast, m_to_ast, \
+    simplify_ast
+
+
+# Globals
+
+Benchmark = collections.namedtuple('Benchmark', ['name', 'function', 'measure_memory'])
+# `tracemalloc` looks up the line of each allocation, which is slow in the huge functions generated by `compile_ast`:
+# the memory of the evaluations is not measured.
+Benchmark.__new__.__defaults__ = (True,)
+
+default_repeat = 3
+default_threshold = 0.2
+default_nb_households = 1000
+
+
+# Public functions
+
+def iter_benchmarks(json_dir, millesime_names, m_file_paths, work_dir, nb_households=default_nb_households):
+    """
+    Yield the benchmarks in the order they must be run: the benchmarks of a millésime use the files written by the
+    previous ones in `work_dir`.
+    """
+    for m_file_path in m_file_paths:
+        with open(m_file_path) as m_file:
+            source_code = m_file.read()
+        yield Benchmark('parse/{}'.format(os.path.basename(m_file_path)),
+                        functools.partial(m_to_ast.parse_m_file, source_code))
+
+    for millesime_name in millesime_names:
+        ast_dir = os.path.join(json_dir, millesime_name, '1_ast_by_file')
+        simplified_ast_dir = os.path.join(work_dir, millesime_name, '2_simplified_ast')
+        light_ast_dir = os.path.join(work_dir, millesime_name, '3_light_ast')
+        os.makedirs(simplified_ast_dir, exist_ok=True)
+        os.makedirs(light_ast_dir, exist_ok=True)
+
+        yield Benchmark('{}/simplify_ast'.format(millesime_name),
+                        functools.partial(quiet(simplify_ast.simplify_ast), ast_dir, simplified_ast_dir))
+        yield Benchmark('{}/lighten_ast'.format(millesime_name),
+                        functools.partial(quiet(lighten_ast.lighten_ast), simplified_ast_dir, light_ast_dir))
+        yield Benchmark('{}/dependencies_visitors'.format(millesime_name),
+                        lambda: collections.deque(dependencies_visitors.iter_formulas_dependencies(ast_dir), maxlen=0))
+
+        light_ast = compile_ast.load_light_ast(light_ast_dir)
+        for backend in sorted(compile_ast.code_generator_class_by_backend):
+            yield Benchmark('{}/compile_ast/{}'.format(millesime_name, backend),
+                            functools.partial(compile_ast.compile_light_ast, light_ast, backend=backend))
+        evaluate = compile_ast.compile_light_ast(light_ast).evaluate
+        yield Benchmark('{}/evaluate/python'.format(millesime_name), lambda: evaluate({}), measure_memory=False)
+        evaluate_batch = compile_ast.compile_light_ast(light_ast, backend='numpy').evaluate_batch
+        inputs = np.zeros((nb_households, len(light_ast['inputs_light'])))
+        yield Benchmark('{}/evaluate/numpy'.format(millesime_name), lambda: evaluate_batch(inputs),
+                        measure_memory=False)
+
+
+def run_benchmark(benchmark, repeat=default_repeat, measure_memory=True):
+    """
+    Return the result of a benchmark: its best time in seconds and its peak memory in bytes, or None when
+    `measure_memory` or `benchmark.measure_memory` is False. Tracing the memory allocations is slow, so the peak
+    memory is measured in another run.
+    """
+    durations = []
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            benchmark.function()
+            durations.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+
+    peak_memory = None
+    if measure_memory and benchmark.measure_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            benchmark.function()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return collections.OrderedDict([
+        ('seconds', min(durations)),
+        ('peak_memory', peak_memory),
+        ])
+
+
+def run_benchmarks(benchmarks, repeat=default_repeat, name_filter=None, measure_memory=True):
+    """
+    Run the benchmarks whose name contains `name_filter`, and return the results of the run. The other benchmarks
+    are run once without being measured, because the next ones may need the files they write.
+    """
+    results = collections.OrderedDict()
+    for benchmark in benchmarks:
+        if name_filter is not None and name_filter not in benchmark.name:
+            benchmark.function()
+            continue
+        result = results[benchmark.name] = run_benchmark(benchmark, repeat, measure_memory)
+        print('{:<50} {:>9.1f}ms {:>10}'.format(
+            benchmark.name, result['seconds'] * 1000,
+            '' if result['peak_memory'] is None else '{:.1f}MB'.format(result['peak_memory'] / (1024 * 1024))))
+    return collections.OrderedDict([
+        ('date', datetime.datetime.now().isoformat(timespec='seconds')),
+        ('python', platform.python_version()),
+        ('repeat', repeat),
+        ('benchmarks', results),
+        ])
+
+
+def find_regressions(previous_run, run, threshold=default_threshold, memory_threshold=None):
+    """
+    Return the `(name, measure, previous_value, value)` tuples of the benchmarks of both runs whose measure grew by
+    more than a threshold since the previous run. `measure` is "seconds", compared with `threshold` (0.2 for 20%), or
+    "peak_memory", compared with `memory_threshold`, which is `threshold` by default. The peak memory is only compared
+    when both runs measured it.
+    """
+    if memory_threshold is None:
+        memory_threshold = threshold
+    regressions = []
+    previous_results = previous_run['benchmarks']
+    for name, result in run['benchmarks'].items():
+        previous_result = previous_results.get(name)
+        if previous_result is None:
+            continue
+        for measure, measure_threshold in (('seconds', threshold), ('peak_memory', memory_threshold)):
+            previous_value = previous_result.get(measure)
+            value = result.get(measure)
+            if previous_value is not None and value is not None and value > previous_value * (1 + measure_threshold):
+                regressions.append((name, measure, previous_value, value))
+    return regressions
+
+
+# Helpers
+
+def quiet(function):
+    """Wrap a stage function to drop the messages it prints."""
+    @functools.wraps(function)
+    def quiet_function(*args, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return function(*args, **kwargs)
+    return quiet_function
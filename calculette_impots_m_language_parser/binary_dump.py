@@ -0,0 +1,89 @@
+"""
+Compact binary format for the AST files, an alternative to the indented JSON of `json_dump`.
+
+Strings (node types, symbol names...) are interned and identical subtrees are stored once, then the tree is written
+with `marshal`, which keeps these shared references. Loading a file is therefore much faster than `json.load` and
+gives an object equal to the one loaded from the JSON form, with the same key order.
+
+The format of `marshal` may change between Python versions, so the header records the Python version and the marshal
+version of the writer, and a file written by another version is rejected: it must be generated again. `marshal` is
+not safe against malicious data: only load the files generated by this project, never files from an untrusted source.
+
+`loads` returns a tree without shared subtrees, which may be modified. `loads_shared` skips this copy and returns the
+shared subtrees as stored: its result must be treated as read-only.
+"""
+
+
+import marshal
+import sys
+
+
+extension = '.mast'
+is_binary = True
+
+magic = b'MAST\x02'
+marshal_version = 4
+header = magic + bytes([sys.version_info[0], sys.version_info[1], marshal_version])
+
+
+def dumps(obj):
+    return header + marshal.dumps(shared_tree(obj, {}), marshal_version)
+
+
+def loads(data):
+    """Return the tree stored in `data`, without shared subtrees."""
+    return unshared_tree(loads_shared(data))
+
+
+def loads_shared(data):
+    """Return the tree stored in `data`. Its equal subtrees are the same objects: it must not be modified."""
+    if data[:len(magic)] != magic:
+        raise ValueError('Not a binary AST file (header is {!r})'.format(data[:len(magic)]))
+    if data[:len(header)] != header:
+        python_major, python_minor, file_marshal_version = data[len(magic):len(header)]
+        raise ValueError(
+            'Binary AST file written by Python {}.{} with marshal version {}, which cannot be read by Python {}.{} '
+            'with marshal version {}: generate it again'.format(
+                python_major, python_minor, file_marshal_version, sys.version_info[0], sys.version_info[1],
+                marshal_version))
+    return marshal.loads(data[len(header):])
+
+
+def shared_tree(obj, memo):
+    """
+    Return a copy of `obj` where equal subtrees are the same objects. Dicts are rebuilt with sorted keys and tuples
+    become lists, like in the JSON form.
+    """
+    if isinstance(obj, dict):
+        items = [(sys.intern(key), shared_tree(obj[key], memo)) for key in sorted(obj)]
+        memo_key = ('dict',) + tuple((key, id(value)) for key, value in items)
+        result = memo.get(memo_key)
+        if result is None:
+            result = memo[memo_key] = dict(items)
+        return result
+    if isinstance(obj, (list, tuple)):
+        items = [shared_tree(item, memo) for item in obj]
+        memo_key = ('list',) + tuple(id(item) for item in items)
+        result = memo.get(memo_key)
+        if result is None:
+            result = memo[memo_key] = items
+        return result
+    if isinstance(obj, str):
+        return sys.intern(obj)
+    if obj is None or isinstance(obj, bool):
+        return obj
+    if isinstance(obj, int):
+        return memo.setdefault(('int', obj), obj)
+    if isinstance(obj, float):
+        # repr distinguishes 0.0 from -0.0, which are equal.
+        return memo.setdefault(('float', repr(obj)), obj)
+    raise TypeError('Object of type {} is not serializable in the binary format'.format(type(obj).__name__))
+
+
+def unshared_tree(obj):
+    """Return a copy of `obj` where no dict or list is used twice."""
+    if isinstance(obj, dict):
+        return {key: unshared_tree(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [unshared_tree(item) for item in obj]
+    return obj
@@ -0,0 +1,153 @@
+"""
+Eliminate the common subexpressions of the simplified AST (see `simplify_ast`).
+
+The formulas are hash-consed into a DAG where identical subtrees are the same node. Each function call which would
+still be evaluated several times is hoisted into a synthetic formula, named with `temporary_prefix`, and replaced by a
+symbol referencing it. A subexpression only used inside an expression which is itself hoisted is evaluated once, so it
+is not hoisted. Small subexpressions are not hoisted either: reading a variable costs about as much as computing them.
+
+The result has the format of `simplify_ast`: `lighten_ast` orders the synthetic formulas before their users, and
+evaluators compute each of them once.
+"""
+
+
+import collections
+
+from calculette_impots_m_language_parser import serialization, simplify_ast
+
+
+# Globals
+
+default_temporary_prefix = 'CSE_TMP_'
+default_min_tree_size = 5
+
+
+# Hash-consed AST
+
+class HashConsedAst(object):
+    """
+    DAG of the distinct nodes of formulas. Node IDs are given in post-order, so the arguments of a call have smaller IDs
+    than the call.
+    """
+
+    def __init__(self):
+        self.keys = []  # ('symbol', name), ('float', value) or ('call', name, argument IDs)
+        self.id_by_key = {}
+        self.root_id_by_formula_name = collections.OrderedDict()
+
+    def add_formula(self, name, expression):
+        self.root_id_by_formula_name[name] = self.add_node(expression)
+
+    def add_node(self, node):
+        nodetype = node['nodetype']
+        if nodetype == 'symbol':
+            key = ('symbol', node['name'])
+        elif nodetype == 'float':
+            # repr distinguishes 0.0 from -0.0, which are equal.
+            key = ('float', repr(node['value']), node['value'])
+        elif nodetype == 'call':
+            key = ('call', node['name'], tuple(self.add_node(arg) for arg in node['args']))
+        else:
+            raise ValueError('Unknown type : %s' % nodetype)
+        node_id = self.id_by_key.get(key)
+        if node_id is None:
+            node_id = self.id_by_key[key] = len(self.keys)
+            self.keys.append(key)
+        return node_id
+
+    def tree_sizes(self):
+        """Return the number of nodes of the tree of each node."""
+        sizes = []
+        for key in self.keys:
+            sizes.append(1 + sum(sizes[arg_id] for arg_id in key[2]) if key[0] == 'call' else 1)
+        return sizes
+
+
+# Public functions
+
+def eliminate_common_subexpressions(formulas, temporary_prefix=default_temporary_prefix,
+                                    min_tree_size=default_min_tree_size):
+    """
+    Return the formulas with their common subexpressions hoisted into synthetic formulas, and a dict of statistics.
+
+    Only the subexpressions of at least `min_tree_size` nodes are hoisted.
+    """
+    for name in formulas:
+        if name.startswith(temporary_prefix):
+            raise ValueError('Formula {} conflicts with the prefix of the synthetic formulas {}'.format(
+                name, temporary_prefix))
+
+    hash_consed_ast = HashConsedAst()
+    for name in sorted(formulas):
+        hash_consed_ast.add_formula(name, formulas[name])
+    keys = hash_consed_ast.keys
+    sizes = hash_consed_ast.tree_sizes()
+
+    # Decide which calls are hoisted, parents first: hoisting a parent evaluates its arguments once.
+    is_hoisted = [False] * len(keys)
+    nb_evaluations = [0] * len(keys)
+    for root_id in hash_consed_ast.root_id_by_formula_name.values():
+        nb_evaluations[root_id] += 1
+    for node_id in reversed(range(len(keys))):
+        key = keys[node_id]
+        if key[0] != 'call':
+            continue
+        is_hoisted[node_id] = nb_evaluations[node_id] >= 2 and sizes[node_id] >= min_tree_size
+        parent_evaluations = 1 if is_hoisted[node_id] else nb_evaluations[node_id]
+        for arg_id in key[2]:
+            nb_evaluations[arg_id] += parent_evaluations
+
+    temporary_name_by_id = {}
+    for node_id, hoisted in enumerate(is_hoisted):
+        if hoisted:
+            temporary_name_by_id[node_id] = '{}{}'.format(temporary_prefix, len(temporary_name_by_id) + 1)
+
+    def to_dict(node_id, is_top=False):
+        if not is_top and node_id in temporary_name_by_id:
+            return {'nodetype': 'symbol', 'name': temporary_name_by_id[node_id]}
+        key = keys[node_id]
+        if key[0] == 'symbol':
+            return {'nodetype': 'symbol', 'name': key[1]}
+        if key[0] == 'float':
+            return {'nodetype': 'float', 'value': key[2]}
+        return {'nodetype': 'call', 'name': key[1], 'args': [to_dict(arg_id) for arg_id in key[2]]}
+
+    new_formulas = {
+        name: to_dict(root_id)
+        for name, root_id in hash_consed_ast.root_id_by_formula_name.items()
+        }
+    for node_id, temporary_name in temporary_name_by_id.items():
+        new_formulas[temporary_name] = to_dict(node_id, is_top=True)
+
+    hoisted_sizes = list(sizes)
+    for node_id, key in enumerate(keys):
+        if key[0] == 'call':
+            hoisted_sizes[node_id] = 1 + sum(
+                1 if arg_id in temporary_name_by_id else hoisted_sizes[arg_id]
+                for arg_id in key[2]
+                )
+    stats = collections.OrderedDict([
+        ('formulas', len(formulas)),
+        ('tree_nodes', sum(sizes[root_id] for root_id in hash_consed_ast.root_id_by_formula_name.values())),
+        ('dag_nodes', len(keys)),
+        ('temporaries', len(temporary_name_by_id)),
+        ('nodes_after', sum(
+            1 if root_id in temporary_name_by_id else hoisted_sizes[root_id]
+            for root_id in hash_consed_ast.root_id_by_formula_name.values()
+            ) + sum(hoisted_sizes[node_id] for node_id in temporary_name_by_id)),
+        ])
+    return new_formulas, stats
+
+
+def eliminate_common_subexpressions_in_dir(source_dir, target_dir, format_name='json',
+                                           temporary_prefix=default_temporary_prefix,
+                                           min_tree_size=default_min_tree_size):
+    """Write a 2_simplified_ast directory whose formulas have their common subexpressions hoisted."""
+    formulas = simplify_ast.expand_formulas(serialization.load(source_dir, 'formulas'))
+    new_formulas, stats = eliminate_common_subexpressions(formulas, temporary_prefix, min_tree_size)
+    serialization.dump(new_formulas, target_dir, 'formulas', format_name)
+    for name in ('constants', 'input_variables'):
+        serialization.dump(serialization.load(source_dir, name), target_dir, name, format_name)
+    print('Hoisted {temporaries} common subexpressions: {tree_nodes} nodes in the formulas, '
+          '{nodes_after} after.'.format(**stats))
+    return stats
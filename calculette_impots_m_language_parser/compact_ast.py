@@ -0,0 +1,227 @@
+"""
+Compact in-memory form of the simplified AST (see `simplify_ast`).
+
+Every symbol (formula, constant, input or undefined name) gets a dense integer ID from a `SymbolTable`, and the
+expressions of all the formulas are stored in one flat array of integers where symbols are referenced by their ID.
+Dependency analysis then works on integers and arrays instead of nested dicts and strings.
+
+`lighten_ast` finds the useful formulas and their computing levels on this form. The children of the formulas are
+collected while it is built, so building it costs about as much as collecting them on the dicts. The `reduce` nodes of
+lazy loops are expanded into calls (see `simplify_ast.expand_loops`).
+
+The expression of a formula is stored in prefix order, one record per node:
+* SYMBOL, symbol ID
+* FLOAT, index of the value in `values`
+* CALL, index of the function name in `function_names`, number of arguments, then the records of the arguments
+"""
+
+
+from array import array
+
+from calculette_impots_m_language_parser import serialization, simplify_ast
+
+
+# Globals
+
+# Symbol kinds, in the order of their IDs: formulas first, then constants, inputs and undefined names.
+FORMULA, CONSTANT, INPUT, UNKNOWN = range(4)
+kind_names = ['formula', 'constant', 'input', 'unknown']
+
+# Node records
+SYMBOL, FLOAT, CALL = range(3)
+
+
+# Symbol table
+
+class SymbolTable(object):
+    """Dense integer IDs of the symbol names, with their kind."""
+
+    def __init__(self):
+        self.names = []
+        self.kinds = bytearray()
+        self.id_by_name = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.id_by_name
+
+    def add(self, name, kind):
+        """Return the ID of `name`, adding it with `kind` if it is not in the table yet."""
+        symbol_id = self.id_by_name.get(name)
+        if symbol_id is None:
+            symbol_id = self.id_by_name[name] = len(self.names)
+            self.names.append(name)
+            self.kinds.append(kind)
+        return symbol_id
+
+    def get_id(self, name):
+        return self.id_by_name[name]
+
+    def ids_of_kind(self, kind):
+        return [symbol_id for symbol_id, symbol_kind in enumerate(self.kinds) if symbol_kind == kind]
+
+
+# Compact AST
+
+class CompactAst(object):
+    """
+    Formulas, constants and inputs of a simplified AST. The formula of the symbol `i` (with `i < nb_formulas`) is
+    stored in `nodes[formula_starts[i]:formula_starts[i + 1]]`.
+    """
+
+    def __init__(self):
+        self.symbols = SymbolTable()
+        self.nb_formulas = 0
+        self.formula_starts = array('l', [0])
+        self.nodes = array('l')
+        self.values = array('d')
+        self.function_names = []
+        self.function_id_by_name = {}
+        self.constant_values = array('d')  # indexed by `symbol_id - nb_formulas`
+        self.shadowed_constants = {}  # constants hidden by a formula of the same name, by name
+        self.input_variables = []  # (name ID, alias ID)
+        self.formula_children = []  # sorted IDs of the symbols referenced by each formula
+
+    def children(self, formula_id):
+        """Return the sorted IDs of the symbols referenced by a formula."""
+        return self.formula_children[formula_id]
+
+    def get_useful_ids(self, root_ids):
+        """Return the sorted IDs of the symbols needed to compute the given formulas, including themselves."""
+        is_useful = bytearray(len(self.symbols))
+        to_inspect = []
+        for root_id in root_ids:
+            if not is_useful[root_id]:
+                is_useful[root_id] = 1
+                to_inspect.append(root_id)
+        while to_inspect:
+            symbol_id = to_inspect.pop()
+            if symbol_id >= self.nb_formulas:
+                continue
+            for child_id in self.children(symbol_id):
+                if not is_useful[child_id]:
+                    is_useful[child_id] = 1
+                    to_inspect.append(child_id)
+        return [symbol_id for symbol_id, useful in enumerate(is_useful) if useful]
+
+    def expression(self, formula_id):
+        """Return the expression of a formula in the dict form of `simplify_ast`."""
+        expression, end = self.node_to_dict(self.formula_starts[formula_id])
+        assert end == self.formula_starts[formula_id + 1]
+        return expression
+
+    def node_to_dict(self, position):
+        """Return the node stored at `position` and the position of the next record."""
+        nodes = self.nodes
+        record = nodes[position]
+        if record == SYMBOL:
+            return {'nodetype': 'symbol', 'name': self.symbols.names[nodes[position + 1]]}, position + 2
+        if record == FLOAT:
+            return {'nodetype': 'float', 'value': self.values[nodes[position + 1]]}, position + 2
+        if record == CALL:
+            args = []
+            next_position = position + 3
+            for _ in range(nodes[position + 2]):
+                arg, next_position = self.node_to_dict(next_position)
+                args.append(arg)
+            return {'nodetype': 'call', 'name': self.function_names[nodes[position + 1]], 'args': args}, next_position
+        raise ValueError('Unknown record %d at position %d' % (record, position))
+
+    def to_simplified_ast(self):
+        """
+        Return the (formulas, constants, input_variables) of `simplify_ast`, including the constants hidden by a formula
+        of the same name.
+        """
+        names = self.symbols.names
+        formulas = {
+            names[formula_id]: self.expression(formula_id)
+            for formula_id in range(self.nb_formulas)
+            }
+        constants = {
+            names[self.nb_formulas + index]: value
+            for index, value in enumerate(self.constant_values)
+            }
+        constants.update(self.shadowed_constants)
+        input_variables = [
+            {'name': names[name_id], 'alias': names[alias_id]}
+            for name_id, alias_id in self.input_variables
+            ]
+        return formulas, constants, input_variables
+
+    def add_formula(self, expression):
+        children = set()
+        self.add_node(expression, children)
+        self.formula_starts.append(len(self.nodes))
+        self.formula_children.append(array('l', sorted(children)))
+
+    def add_node(self, node, children):
+        """Append the records of `node` to `nodes`, and the IDs of its symbols to the set `children`."""
+        nodetype = node['nodetype']
+        if nodetype == 'symbol':
+            symbol_id = self.symbols.add(node['name'], UNKNOWN)
+            self.nodes.extend((SYMBOL, symbol_id))
+            children.add(symbol_id)
+        elif nodetype == 'float':
+            self.nodes.extend((FLOAT, len(self.values)))
+            self.values.append(node['value'])
+        elif nodetype == 'call':
+            name = node['name']
+            function_id = self.function_id_by_name.get(name)
+            if function_id is None:
+                function_id = self.function_id_by_name[name] = len(self.function_names)
+                self.function_names.append(name)
+            args = node['args']
+            self.nodes.extend((CALL, function_id, len(args)))
+            for arg in args:
+                self.add_node(arg, children)
+        elif nodetype == 'reduce':
+            self.add_node(simplify_ast.expand_loops(node), children)
+        else:
+            raise ValueError('Unknown type : %s' % nodetype)
+
+
+# Public functions
+
+def from_simplified_ast(formulas, constants, input_variables):
+    """
+    Build the compact form of the files of `simplify_ast`. The formulas get the first IDs, in the order of their names,
+    followed by the constants, the inputs (names and aliases) and the undefined names, as categorized by `lighten_ast`.
+    """
+    compact_ast = CompactAst()
+    symbols = compact_ast.symbols
+
+    formula_names = sorted(formulas)
+    for name in formula_names:
+        symbols.add(name, FORMULA)
+    compact_ast.nb_formulas = len(formula_names)
+
+    for name in sorted(constants):
+        # Like in `lighten_ast`, a formula hides a constant of the same name. The constant is kept aside for
+        # `to_simplified_ast`.
+        if name in symbols:
+            compact_ast.shadowed_constants[name] = constants[name]
+        else:
+            symbols.add(name, CONSTANT)
+            compact_ast.constant_values.append(constants[name])
+
+    for input_variable in input_variables:
+        name_id = symbols.add(input_variable['name'], INPUT)
+        alias_id = symbols.add(input_variable['alias'], INPUT)
+        compact_ast.input_variables.append((name_id, alias_id))
+
+    # Symbols added from here on are undefined names.
+    for name in formula_names:
+        compact_ast.add_formula(formulas[name])
+
+    return compact_ast
+
+
+def load(source_dir):
+    """Build the compact form of a 2_simplified_ast directory."""
+    return from_simplified_ast(
+        simplify_ast.expand_formulas(serialization.load(source_dir, 'formulas')),
+        serialization.load(source_dir, 'constants'),
+        serialization.load(source_dir, 'input_variables'),
+        )
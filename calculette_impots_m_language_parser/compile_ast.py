@@ -0,0 +1,289 @@
+"""
+Compile the light AST of a millésime (see `lighten_ast`) into a Python module.
+
+With the "python" backend, the generated module defines `evaluate(inputs)`, a straight-line function computing every
+formula of `computing_order` with the constants inlined. `inputs` maps the names of the input variables to their
+values: missing inputs, undefined symbols and formulas used before being computed are 0. It returns the values of the
+formulas by name.
+
+With the "numpy" backend, the generated module defines `evaluate_batch(inputs, roots=None)` which computes many
+households at once. `inputs` is a 2-D array with one row per household and one column per input variable, in the order
+of `inputs_light`. Each formula is computed for all the households with NumPy operations. It returns a column per
+formula of `roots` (all the formulas by default).
+
+The generated modules are cached on disk, named after the hash of the light AST.
+"""
+
+
+import hashlib
+import importlib
+import importlib.util
+import inspect
+import json
+import os
+import sys
+import tempfile
+import types
+
+from calculette_impots_m_language_parser import serialization, simplify_ast
+
+
+# Globals
+
+light_ast_names = ['computing_order', 'formulas_light', 'constants_light', 'inputs_light', 'unknowns_light']
+
+# Longer sums and products are generated as calls, to keep the expressions shallow for the Python compiler.
+max_chained_operands = 100
+
+comparison_operators = {
+    'operator:<': '<',
+    'operator:<=': '<=',
+    'operator:=': '==',
+    'operator:!=': '!=',
+    'operator:>': '>',
+    'operator:>=': '>=',
+    }
+boolean_operators = {
+    'boolean:et': 'and',
+    'boolean:ou': 'or',
+    }
+m_function_names = ['arr', 'inf', 'invert', 'null', 'positif', 'positif_ou_nul', 'present']
+
+
+# Code generators
+
+class PythonCodeGenerator(object):
+    """Generate the source code of the module computing a light AST with Python floats."""
+
+    functions_module_name = 'calculette_impots_m_language_parser.m_functions'
+    function_code_by_name = dict(
+        [(name, name) for name in m_function_names],
+        abs='abs',
+        max='max',
+        min='min',
+        )
+
+    def __init__(self, light_ast):
+        self.light_ast = light_ast
+        self.constants = light_ast['constants_light']
+        self.inputs = set(light_ast['inputs_light'])
+        self.computed_formulas = set()
+
+    def module_source(self, light_ast_hash):
+        lines = [
+            '# Generated by calculette_impots_m_language_parser.compile_ast from the light AST {}.'.format(
+                light_ast_hash),
+            '',
+            ]
+        lines.extend(self.import_lines())
+        lines.extend([
+            '',
+            '',
+            '',
+            'computing_order = {!r}'.format(self.light_ast['computing_order']),
+            'inputs = {!r}'.format(self.light_ast['inputs_light']),
+            '',
+            '',
+            ])
+        lines.extend(self.function_lines())
+        return '\n'.join(lines) + '\n'
+
+    def import_lines(self):
+        return [
+            'import math',
+            '',
+            'from {} import {}'.format(self.functions_module_name, ', '.join(m_function_names)),
+            ]
+
+    def function_lines(self):
+        lines = [
+            'def evaluate(inputs):',
+            '    get = inputs.get',
+            ]
+        for name in self.light_ast['inputs_light']:
+            lines.append('    v_{} = get({!r}, 0.0)'.format(name, name))
+        lines.extend(self.formula_lines())
+        lines.append('    return {')
+        for name in self.light_ast['computing_order']:
+            lines.append('        {!r}: v_{},'.format(name, name))
+        lines.append('        }')
+        return lines
+
+    def formula_lines(self):
+        lines = []
+        for name in self.light_ast['computing_order']:
+            lines.append('    v_{} = {}'.format(name, self.expression(self.light_ast['formulas_light'][name])))
+            self.computed_formulas.add(name)
+        return lines
+
+    def expression(self, node):
+        nodetype = node['nodetype']
+        if nodetype == 'symbol':
+            return self.symbol(node['name'])
+        if nodetype == 'float':
+            return self.literal(node['value'])
+        if nodetype == 'call':
+            return self.call(node['name'], [self.expression(arg) for arg in node['args']])
+        if nodetype == 'reduce':
+            # The generated code is straight-line: the loop is unrolled.
+            return self.expression(simplify_ast.expand_loops(node))
+        raise ValueError('Unknown type : %s' % nodetype)
+
+    def symbol(self, name):
+        if name in self.computed_formulas or name in self.inputs:
+            return 'v_{}'.format(name)
+        if name in self.constants:
+            return self.literal(self.constants[name])
+        return self.literal(0.0)
+
+    def literal(self, value):
+        return repr(float(value))
+
+    def call(self, name, args):
+        if name == 'sum':
+            return self.chain('+', 'sum', args)
+        if name == 'product':
+            return self.chain('*', 'math.prod', args)
+        if name in ('negate', 'unary:-'):
+            return '(-{})'.format(args[0])
+        if name == 'ternary':
+            return '({} if {} else {})'.format(args[1], args[0], args[2])
+        if name == 'si':
+            return '({} if {} else 0.0)'.format(args[1], args[0])
+        if name in comparison_operators:
+            return self.boolean('{} {} {}'.format(args[0], comparison_operators[name], args[1]))
+        if name in boolean_operators:
+            return self.boolean(' {} '.format(boolean_operators[name]).join(args))
+        if name == 'dans':
+            return self.boolean('{} in ({},)'.format(args[0], ', '.join(args[1:])))
+        if name in self.function_code_by_name:
+            return '{}({})'.format(self.function_code_by_name[name], ', '.join(args))
+        raise ValueError('Unknown function : %s' % name)
+
+    def chain(self, operator, function_name, args):
+        if len(args) > max_chained_operands:
+            return '{}(({},))'.format(function_name, ', '.join(args))
+        return '({})'.format(' {} '.format(operator).join(args))
+
+    def boolean(self, condition):
+        return '(1.0 if {} else 0.0)'.format(condition)
+
+
+class NumpyCodeGenerator(PythonCodeGenerator):
+    """Generate the source code of the module computing a light AST for many households with NumPy arrays."""
+
+    functions_module_name = 'calculette_impots_m_language_parser.m_numpy_functions'
+    function_code_by_name = dict(
+        PythonCodeGenerator.function_code_by_name,
+        abs='np.abs',
+        max='np.maximum',
+        min='np.minimum',
+        )
+
+    def import_lines(self):
+        return [
+            'import numpy as np',
+            '',
+            'from {} import column, {}'.format(self.functions_module_name, ', '.join(m_function_names)),
+            ]
+
+    def function_lines(self):
+        lines = [
+            'def evaluate_batch(inputs, roots=None):',
+            '    columns = np.ascontiguousarray(np.asarray(inputs, dtype=float).T)',
+            '    nb_rows = columns.shape[1]',
+            ]
+        for index, name in enumerate(self.light_ast['inputs_light']):
+            lines.append('    v_{} = columns[{}]'.format(name, index))
+        lines.extend(self.formula_lines())
+        lines.append('    values = {')
+        for name in self.light_ast['computing_order']:
+            lines.append('        {!r}: v_{},'.format(name, name))
+        lines.append('        }')
+        lines.extend([
+            '    if roots is None:',
+            '        roots = computing_order',
+            '    return {root: column(values[root], nb_rows) for root in roots}',
+            ])
+        return lines
+
+    def call(self, name, args):
+        if name == 'product' and len(args) > max_chained_operands:
+            return 'np.prod(np.broadcast_arrays({}), axis=0)'.format(', '.join(args))
+        if name == 'ternary':
+            return 'np.where({}, {}, {})'.format(args[0], args[1], args[2])
+        if name == 'si':
+            return 'np.where({}, {}, 0.0)'.format(args[0], args[1])
+        if name in boolean_operators:
+            operator = ' & ' if name == 'boolean:et' else ' | '
+            return self.boolean(operator.join('({} != 0)'.format(arg) for arg in args))
+        if name == 'dans':
+            return self.boolean('np.isin({}, ({},))'.format(args[0], ', '.join(args[1:])))
+        return super(NumpyCodeGenerator, self).call(name, args)
+
+    def boolean(self, condition):
+        return 'np.where({}, 1.0, 0.0)'.format(condition)
+
+
+code_generator_class_by_backend = {
+    'python': PythonCodeGenerator,
+    'numpy': NumpyCodeGenerator,
+    }
+
+
+# Public functions
+
+def compile_ast(source_dir, cache_dir=None, backend='python'):
+    """Return the module compiled from the 3_light_ast directory `source_dir`."""
+    return compile_light_ast(load_light_ast(source_dir), cache_dir, backend)
+
+
+def compile_light_ast(light_ast, cache_dir=None, backend='python'):
+    """
+    Return the module compiled from a light AST, a dict of the contents of the `light_ast_names` files. With
+    `cache_dir`, the module is written there or loaded from there if the same light AST was already compiled.
+    """
+    code_generator_class = code_generator_class_by_backend[backend]
+    light_ast_hash = get_light_ast_hash(light_ast, backend)
+    if cache_dir is None:
+        source = code_generator_class(light_ast).module_source(light_ast_hash)
+        return load_module_from_source(source, '<light AST {}>'.format(light_ast_hash))
+
+    module_path = os.path.join(cache_dir, 'light_ast_{}.py'.format(light_ast_hash))
+    if not os.path.exists(module_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        source = code_generator_class(light_ast).module_source(light_ast_hash)
+        fd, temporary_file_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(source)
+        os.replace(temporary_file_path, module_path)
+    spec = importlib.util.spec_from_file_location('light_ast_{}'.format(light_ast_hash), module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_light_ast(source_dir):
+    return {
+        name: serialization.load(source_dir, name)
+        for name in light_ast_names
+        }
+
+
+def get_light_ast_hash(light_ast, backend='python'):
+    """Hash of the light AST and of the code generating the module."""
+    code_generator_class = code_generator_class_by_backend[backend]
+    light_ast_hash = hashlib.sha256(backend.encode('utf-8'))
+    light_ast_hash.update(json.dumps(light_ast, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+    source_modules = [sys.modules[__name__], importlib.import_module(code_generator_class.functions_module_name)]
+    for source_module in source_modules:
+        light_ast_hash.update(inspect.getsource(source_module).encode('utf-8'))
+    return light_ast_hash.hexdigest()
+
+
+# Helpers
+
+def load_module_from_source(source, file_name):
+    module = types.ModuleType('light_ast')
+    exec(compile(source, file_name, 'exec'), module.__dict__)
+    return module
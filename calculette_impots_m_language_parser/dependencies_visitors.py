@@ -1,12 +1,24 @@
 # -*- coding: utf-8 -*-
 
 
+"""
+Visitors of the AST of `m_to_ast` giving the dependencies of the formulas.
+
+`visit_node` returns the `(formula_name, dependencies)` pair of a formula, and an iterable for the other nodes: the
+names of the symbols of an expression, or the pairs of the formulas of a `pour` formula or of a rule. The iterables
+are lazy. When the debug logging is enabled, each visit is traced with its depth and its result: the lazy iterables
+are then materialized to be logged, and an iterator over the logged result is returned in their place.
+"""
+
+
 import logging
 import pprint
+import threading
 
-from toolz.curried import concat, filter, mapcat, pipe, unique
+from toolz.curried import concat, map, mapcat, pipe, unique
 
-from .unloop_helpers import iter_unlooped_nodes
+from . import serialization
+from .unloop_helpers import UnloopTemplate, substitute
 
 
 log = logging.getLogger(__name__)
@@ -15,27 +27,42 @@ log = logging.getLogger(__name__)
 # Main visitor
 
 
-deep_level = 0
+trace_state = threading.local()
 
 
 def visit_node(node):
     """Main visitor which calls the specific visitors below."""
-    global deep_level
-    visitor_name = 'visit_' + node['type']
-    visitor = globals().get(visitor_name)
+    visitor = visitor_by_type.get(node['type'])
     if visitor is None:
-        error_message = '"def {}(node):" is not defined, node = {}'.format(
-            visitor_name,
+        error_message = '"def visit_{}(node):" is not defined, node = {}'.format(
+            node['type'],
             pprint.pformat(node, width=120),
             )
         raise NotImplementedError(error_message)
-    log.debug('{}:{}:{}'.format(deep_level, visitor.__name__, node))
-    deep_level += 1
-    result = list(visitor(node))
-    deep_level -= 1
-    log.debug('{}:{}: => {}'.format(deep_level, visitor.__name__, result))
-    assert deep_level >= 0, deep_level
-    return result
+    if not log.isEnabledFor(logging.DEBUG):
+        return visitor(node)
+    return trace_visit(visitor, node)
+
+
+def trace_visit(visitor, node):
+    deep_level = getattr(trace_state, 'deep_level', 0)
+    log.debug('%d:%s:%s', deep_level, visitor.__name__, node)
+    trace_state.deep_level = deep_level + 1
+    try:
+        result = visitor(node)
+        logged_result = result if isinstance(result, (list, tuple)) else list(result)
+    finally:
+        trace_state.deep_level = deep_level
+    log.debug('%d:%s: => %s', deep_level, visitor.__name__, logged_result)
+    return result if logged_result is result else iter(logged_result)
+
+
+def iter_formulas_dependencies(source_dir):
+    """Yield the `(formula_name, dependencies)` pairs of the rules of a 1_ast_by_file directory, file by file."""
+    for file_path in serialization.list_files(source_dir):
+        for node in serialization.load_file(file_path):
+            if node['type'] == 'regle':
+                yield from visit_node(node)
 
 
 # Specific visitors
@@ -75,19 +102,51 @@ def visit_integer(node):
     return []
 
 
+def visit_invert(node):
+    return visit_node(node['operand'])
+
+
 def visit_loop_expression(node):
-    return mapcat(visit_node, iter_unlooped_nodes(
-        loop_variables_nodes=node['loop_variables'],
+    template = UnloopTemplate(
         node=node['expression'],
-        ))
+        loop_variables_nodes=node['loop_variables'],
+        )
+    if template.contains_loops:
+        return mapcat(visit_node, template.iter_unlooped_views())
+    # Without nested loops, the dependencies are the symbols of the expression: only their names are substituted.
+    return concat(template.iter_substituted_names(list(visit_node(node['expression']))))
+
+
+def visit_negate(node):
+    return visit_node(node['operand'])
 
 
 def visit_pour_formula(node):
-    return map(visit_node, iter_unlooped_nodes(
-        loop_variables_nodes=node['loop_variables'],
+    template = UnloopTemplate(
         node=node['formula'],
+        loop_variables_nodes=node['loop_variables'],
         unloop_keys=['name'],
-        ))
+        )
+    if template.contains_loops:
+        return map(visit_node, template.iter_unlooped_views())
+    formula = node['formula']
+    dependencies = list(visit_node(formula['expression']))
+    return (
+        (
+            substitute(formula['name'], value_by_loop_variable_name),
+            pipe(
+                dependencies,
+                map(lambda name: substitute(name, value_by_loop_variable_name)),
+                unique,
+                list,
+                ),
+            )
+        for value_by_loop_variable_name in template.iter_value_dicts()
+        )
+
+
+def visit_product(node):
+    return mapcat(visit_node, node['operands'])
 
 
 def visit_product_expression(node):
@@ -95,10 +154,15 @@ def visit_product_expression(node):
 
 
 def visit_regle(node):
-    return mapcat(
-        lambda node1: visit_node(node1) if node1['type'] == 'pour_formula' else [visit_node(node1)],
-        node['formulas'],
-        )
+    for formula in node['formulas']:
+        if formula['type'] == 'pour_formula':
+            yield from visit_node(formula)
+        else:
+            yield visit_node(formula)
+
+
+def visit_sum(node):
+    return mapcat(visit_node, node['operands'])
 
 
 def visit_sum_expression(node):
@@ -110,15 +174,20 @@ def visit_symbol(node):
 
 
 def visit_ternary_operator(node):
-    return pipe([
-        visit_node(node['value_if_true']),
-        visit_node(node['condition']),
-        visit_node(node['value_if_false']) if 'value_if_false' in node else None,
-        ],
-        filter(None),
-        concat,
-        )
+    yield from visit_node(node['value_if_true'])
+    yield from visit_node(node['condition'])
+    if 'value_if_false' in node:
+        yield from visit_node(node['value_if_false'])
 
 
 def visit_unary(node):
     return visit_node(node['expression'])
+
+
+# Dispatch table, built once: define `visit_<type>(node)` to support a new node type.
+
+visitor_by_type = {
+    name[len('visit_'):]: visitor
+    for name, visitor in list(globals().items())
+    if name.startswith('visit_') and name != 'visit_node'
+    }
@@ -0,0 +1,142 @@
+"""
+Dependency slices of the simplified AST (see `simplify_ast`) for any set of root variables.
+
+`lighten_ast` slices the formulas for the fixed list `lighten_ast.roots`. A `DependencyIndex` is built once from the
+simplified AST and then slices it for as many root sets as needed. The transitive closure of each requested variable
+is kept in a cache with least recently used eviction: overlapping root sets reuse these closures, and the traversal of
+a new variable stops at the variables whose closure is cached.
+
+The index of another millésime can reuse the children and the cached closures of the formulas which are not affected
+by the differences between both millésimes, see `reuse`.
+"""
+
+
+import collections
+
+from calculette_impots_m_language_parser import lighten_ast, millesime_diff
+
+
+# Globals
+
+default_max_cached_closures = 1024
+
+DependencySlice = collections.namedtuple('DependencySlice', [
+    'formulas',
+    'constants',
+    'inputs',
+    'unknowns',
+    'computing_levels',
+    'computing_order',
+    ])
+
+
+# Index
+
+class DependencyIndex(object):
+    """Children of the formulas of a simplified AST, with a cache of transitive closures."""
+
+    def __init__(self, formulas, constants, inputs_list, max_cached_closures=default_max_cached_closures,
+                 children_dict=None):
+        self.formulas = formulas
+        self.constants = constants
+        self.inputs = set(inputs_list)
+        self.children_dict = children_dict if children_dict is not None else {
+            name: lighten_ast.get_children(formula)
+            for name, formula in formulas.items()
+            }
+        self.unknown_names = lighten_ast.find_undefined_names(formulas, constants, inputs_list, self.children_dict)
+        self.max_cached_closures = max_cached_closures
+        self.closure_by_name = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def closure(self, name):
+        """Return the frozenset of the symbols needed to compute the formula `name`, including itself."""
+        closure = self.closure_by_name.get(name)
+        if closure is not None:
+            self.hits += 1
+            self.closure_by_name.move_to_end(name)
+            return closure
+        self.misses += 1
+
+        closure = {name}
+        to_inspect = [name]
+        while to_inspect:
+            node = to_inspect.pop()
+            for child in self.children_dict[node]:
+                if child in closure:
+                    continue
+                cached_closure = self.closure_by_name.get(child)
+                if cached_closure is not None:
+                    self.closure_by_name.move_to_end(child)
+                    closure |= cached_closure
+                else:
+                    closure.add(child)
+                    if child in self.formulas:
+                        to_inspect.append(child)
+        closure = frozenset(closure)
+
+        self.closure_by_name[name] = closure
+        while len(self.closure_by_name) > self.max_cached_closures:
+            self.closure_by_name.popitem(last=False)
+        return closure
+
+    def slice(self, roots):
+        """Return the `DependencySlice` of the formulas needed to compute the given formulas."""
+        useful_nodes = set()
+        for root in roots:
+            if root not in self.formulas:
+                raise ValueError('Root formula {} is not defined.'.format(root))
+            useful_nodes |= self.closure(root)
+
+        formulas = []
+        constants = []
+        inputs = []
+        unknowns = []
+        for node in sorted(useful_nodes):
+            if node in self.formulas:
+                formulas.append(node)
+            elif node in self.constants:
+                constants.append(node)
+            elif node in self.inputs:
+                inputs.append(node)
+            else:
+                assert node in self.unknown_names, node
+                unknowns.append(node)
+
+        children_light = lighten_ast.compute_children_light(self.children_dict, set(formulas))
+        computing_levels = lighten_ast.compute_computing_levels(children_light)
+        computing_order = [formula for level in computing_levels for formula in level]
+        return DependencySlice(formulas, constants, inputs, unknowns, computing_levels, computing_order)
+
+
+# Public functions
+
+def load(source_dir, max_cached_closures=default_max_cached_closures):
+    """Build the index of a 2_simplified_ast directory."""
+    formulas, constants, input_variables, inputs_list = lighten_ast.load_data(source_dir)
+    return DependencyIndex(formulas, constants, inputs_list, max_cached_closures)
+
+
+def reuse(previous_index, formulas, constants, inputs_list, changed_symbols):
+    """
+    Build the index of another millésime from the index of a previous one. `changed_symbols` are the symbols whose
+    definition differs (see `millesime_diff.changed_symbols`): the children of the other formulas are reused, and so
+    are the cached closures of the formulas which do not depend on a changed symbol.
+
+    Return a tuple (index, affected_formulas) where affected_formulas is the set of the formulas depending on a changed
+    symbol, whose derived artifacts must be rebuilt.
+    """
+    previous_children_dict = previous_index.children_dict
+    children_dict = {
+        name: previous_children_dict[name]
+        if name in previous_children_dict and name not in changed_symbols
+        else lighten_ast.get_children(formula)
+        for name, formula in formulas.items()
+        }
+    affected_formulas = millesime_diff.affected_formulas(changed_symbols, children_dict)
+    index = DependencyIndex(formulas, constants, inputs_list, previous_index.max_cached_closures, children_dict)
+    for name, closure in previous_index.closure_by_name.items():
+        if name in formulas and name not in affected_formulas:
+            index.closure_by_name[name] = closure
+    return index, affected_formulas
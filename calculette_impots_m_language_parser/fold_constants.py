@@ -0,0 +1,167 @@
+"""
+Fold the constants of the simplified AST (see `simplify_ast`).
+
+The symbols of constants are replaced by their values, and function calls whose arguments are all values are replaced
+by their result, computed with the functions of `m_functions` like the code generated by `compile_ast`. A `ternary` or
+`si` with a constant condition is replaced by the selected branch, and the constant arguments of `boolean:et` and
+`boolean:ou` are dropped or decide the result.
+
+Formulas folded to a value become constants, and are folded in turn in the formulas using them. Sums and products
+mixing values and symbols are left as is: reordering them would change the rounding of the floats.
+"""
+
+
+import collections
+import functools
+import operator
+
+from calculette_impots_m_language_parser import lighten_ast, m_functions, serialization, simplify_ast
+
+
+# Globals
+
+function_by_name = {
+    'sum': lambda *args: functools.reduce(operator.add, args),
+    'product': lambda *args: functools.reduce(operator.mul, args),
+    'negate': operator.neg,
+    'unary:-': operator.neg,
+    'invert': m_functions.invert,
+    'operator:<': lambda x, y: 1.0 if x < y else 0.0,
+    'operator:<=': lambda x, y: 1.0 if x <= y else 0.0,
+    'operator:=': lambda x, y: 1.0 if x == y else 0.0,
+    'operator:!=': lambda x, y: 1.0 if x != y else 0.0,
+    'operator:>': lambda x, y: 1.0 if x > y else 0.0,
+    'operator:>=': lambda x, y: 1.0 if x >= y else 0.0,
+    'dans': lambda x, *values: 1.0 if x in values else 0.0,
+    'boolean:et': lambda *args: 1.0 if all(args) else 0.0,
+    'boolean:ou': lambda *args: 1.0 if any(args) else 0.0,
+    'abs': abs,
+    'max': max,
+    'min': min,
+    'arr': m_functions.arr,
+    'inf': m_functions.inf,
+    'null': m_functions.null,
+    'positif': m_functions.positif,
+    'positif_ou_nul': m_functions.positif_ou_nul,
+    'present': m_functions.present,
+    }
+
+
+# Public functions
+
+def fold_constants(formulas, constants, kept_formulas=()):
+    """
+    Return the folded formulas, the constants including the formulas folded to a value, and a dict of statistics.
+
+    The formulas of `kept_formulas` stay formulas even when they are folded to a value.
+    """
+    stats = collections.Counter()
+    constants = dict(constants)
+    # Like in `lighten_ast`, a formula hides a constant of the same name.
+    for name in formulas:
+        constants.pop(name, None)
+
+    parents_by_name = collections.defaultdict(set)
+    for name, formula in formulas.items():
+        for child in lighten_ast.get_children(formula):
+            parents_by_name[child].add(name)
+
+    folded_formulas = {}
+    to_fold = collections.deque(sorted(formulas))
+    waiting = set(to_fold)
+    while to_fold:
+        name = to_fold.popleft()
+        waiting.discard(name)
+        folded_formula = fold_node(folded_formulas.get(name, formulas[name]), constants, stats)
+        folded_formulas[name] = folded_formula
+        if folded_formula['nodetype'] == 'float' and name not in kept_formulas and name not in constants:
+            constants[name] = folded_formula['value']
+            stats['constant_formulas'] += 1
+            for parent in sorted(parents_by_name[name]):
+                if parent not in waiting:
+                    to_fold.append(parent)
+                    waiting.add(parent)
+
+    new_formulas = {
+        name: formula
+        for name, formula in folded_formulas.items()
+        if name not in constants
+        }
+    stats = collections.OrderedDict([
+        ('formulas', len(formulas)),
+        ('formulas_after', len(new_formulas)),
+        ('tree_nodes', sum(map(count_nodes, formulas.values()))),
+        ('nodes_after', sum(map(count_nodes, new_formulas.values()))),
+        ('substituted_constants', stats['substituted_constants']),
+        ('folded_calls', stats['folded_calls']),
+        ('constant_formulas', stats['constant_formulas']),
+        ])
+    return new_formulas, constants, stats
+
+
+def fold_constants_in_dir(source_dir, target_dir, format_name='json', kept_formulas=lighten_ast.roots):
+    """Write a 2_simplified_ast directory whose formulas have their constants folded."""
+    formulas = simplify_ast.expand_formulas(serialization.load(source_dir, 'formulas'))
+    constants = serialization.load(source_dir, 'constants')
+    new_formulas, new_constants, stats = fold_constants(formulas, constants, kept_formulas)
+    serialization.dump(new_formulas, target_dir, 'formulas', format_name)
+    serialization.dump(new_constants, target_dir, 'constants', format_name)
+    serialization.dump(serialization.load(source_dir, 'input_variables'), target_dir, 'input_variables', format_name)
+    print('Folded {constant_formulas} formulas to constants: {tree_nodes} nodes in the formulas, '
+          '{nodes_after} after.'.format(**stats))
+    return stats
+
+
+def fold_node(node, constants, stats):
+    """Return the folded node, without modifying `node`."""
+    nodetype = node['nodetype']
+    if nodetype == 'symbol':
+        value = constants.get(node['name'])
+        if value is None:
+            return node
+        stats['substituted_constants'] += 1
+        return {'nodetype': 'float', 'value': value}
+    if nodetype == 'float':
+        return node
+    if nodetype == 'call':
+        args = [fold_node(arg, constants, stats) for arg in node['args']]
+        folded_node = fold_call(node['name'], args)
+        if folded_node is None:
+            return {'nodetype': 'call', 'name': node['name'], 'args': args}
+        stats['folded_calls'] += 1
+        return folded_node
+    raise ValueError('Unknown type : %s' % nodetype)
+
+
+def count_nodes(node):
+    if node['nodetype'] == 'call':
+        return 1 + sum(map(count_nodes, node['args']))
+    return 1
+
+
+# Helpers
+
+def fold_call(name, args):
+    """Return the node replacing the call, or None if it cannot be folded."""
+    values = [arg['value'] if arg['nodetype'] == 'float' else None for arg in args]
+    if None not in values and name in function_by_name:
+        return value_node(function_by_name[name](*values))
+
+    if name in ('ternary', 'si') and values[0] is not None:
+        if values[0]:
+            return args[1]
+        return args[2] if name == 'ternary' else value_node(0.0)
+
+    if name in ('boolean:et', 'boolean:ou'):
+        # The result of `et` is decided by a false value, the result of `ou` by a true one.
+        deciding_value = name == 'boolean:ou'
+        if any(value is not None and bool(value) == deciding_value for value in values):
+            return value_node(1.0 if deciding_value else 0.0)
+        if None in values and any(value is not None for value in values):
+            remaining_args = [arg for arg, value in zip(args, values) if value is None]
+            return {'nodetype': 'call', 'name': name, 'args': remaining_args}
+    return None
+
+
+def value_node(value):
+    return {'nodetype': 'float', 'value': float(value)}
@@ -0,0 +1,117 @@
+"""
+Profile the rules of the M grammar: how often the parser tries each rule, how often it fails, and how much source
+code it reads again after backtracking.
+
+For each rule, the profile counts:
+- `attempts`, `successes` and `failures` of its parsing expression;
+- `repeated_attempts`: attempts at a position where the rule was already tried in the same source code, which
+  memoizing the rule would avoid (memoized attempts are still counted, they are then very fast);
+- `matched_chars`: characters consumed by its successes;
+- `backtracked_chars`: for each failure, the characters between its start and the furthest position reached by its
+  sub-rules, which were parsed for nothing;
+- `seconds`: time spent in the rule, including its sub-rules.
+
+Positions are character offsets in the preprocessed source code.
+"""
+
+
+from collections import OrderedDict
+import time
+
+from arpeggio import NoMatch
+
+from calculette_impots_m_language_parser import m_to_ast
+
+
+# Globals
+
+stat_names = ['attempts', 'successes', 'failures', 'repeated_attempts', 'matched_chars', 'backtracked_chars',
+              'seconds']
+
+
+# Public functions
+
+def profile_source_codes(source_codes, memoization=False):
+    """
+    Parse M source codes with new parsers using the given memoization policy (see `m_to_ast.set_memoization`), and
+    return a tuple (profile, seconds): the profile is an OrderedDict of the stats of each rule, in the order of the
+    grammar, and seconds is the total parsing time.
+
+    The profiling slows the parsing down much more than the memoization speeds it up: the source codes are first
+    parsed once by a parser which is not profiled, and seconds is the time of this parsing.
+    """
+    source_codes = [m_to_ast.preprocess(source_code) for source_code in source_codes]
+
+    parser = m_to_ast.build_m_parser()
+    m_to_ast.apply_memoization(parser, memoization)
+    start = time.perf_counter()
+    for source_code in source_codes:
+        parser.parse(source_code)
+    seconds = time.perf_counter() - start
+
+    parser = m_to_ast.build_m_parser()
+    m_to_ast.apply_memoization(parser, memoization)
+    profile = profile_parser(parser)
+    for source_code in source_codes:
+        parser.parse(source_code)
+    return profile, seconds
+
+
+def profile_parser(parser):
+    """
+    Instrument the rules of a parser and return the profile they fill each time the parser is used. The parser must
+    not be used without profiling afterwards.
+    """
+    profile = OrderedDict()
+    reach_stack = []
+    for rule_name, expression in m_to_ast.get_rule_expressions(parser).items():
+        stats = profile[rule_name] = OrderedDict((stat_name, 0) for stat_name in stat_names)
+        expression.parse = profiled(expression.parse, stats, reach_stack)
+    return profile
+
+
+def sorted_profile(profile, key='seconds'):
+    """Return the (rule_name, stats) pairs of a profile sorted by decreasing `key`."""
+    return sorted(profile.items(), key=lambda item: item[1][key], reverse=True)
+
+
+# Helpers
+
+def profiled(parse, stats, reach_stack):
+    """
+    Wrap the `parse` method of a parsing expression to fill its stats. `reach_stack` holds the furthest position
+    reached by the rules being parsed, from the outermost to the innermost.
+    """
+    tried_positions = set()
+    tried_input = [None]
+
+    def profiled_parse(parser):
+        if parser.input is not tried_input[0]:
+            tried_positions.clear()
+            tried_input[0] = parser.input
+        position = parser.position
+        stats['attempts'] += 1
+        if position in tried_positions:
+            stats['repeated_attempts'] += 1
+        else:
+            tried_positions.add(position)
+        reach_stack.append(position)
+        start = time.perf_counter()
+        try:
+            result = parse(parser)
+        except NoMatch:
+            stats['failures'] += 1
+            stats['backtracked_chars'] += reach_stack[-1] - position
+            raise
+        else:
+            stats['successes'] += 1
+            stats['matched_chars'] += parser.position - position
+            reach_stack[-1] = max(reach_stack[-1], parser.position)
+        finally:
+            stats['seconds'] += time.perf_counter() - start
+            reach = reach_stack.pop()
+            if reach_stack and reach > reach_stack[-1]:
+                reach_stack[-1] = reach
+        return result
+
+    return profiled_parse
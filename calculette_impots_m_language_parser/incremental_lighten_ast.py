@@ -0,0 +1,224 @@
+"""
+Update the light AST (see `lighten_ast`) after some formulas or constants of the simplified AST changed, without
+lightening the whole simplified AST again.
+
+An `IncrementalLightener` keeps the children and the parents of every formula, the set of the useful symbols and the
+computing level of every useful formula. `update` takes the changed formulas and constants and only visits the part
+of the graph they affect:
+
+* the symbols which lost their last useful parent are removed from the useful set, and the symbols which are newly
+  reachable from a root are added to it;
+* the computing levels are recomputed for the useful formulas whose children changed and for the formulas which
+  depend on them.
+
+The light AST written by `save` is identical to the one written by `lighten_ast.lighten_ast` for the updated
+simplified AST.
+"""
+
+
+import collections
+
+from calculette_impots_m_language_parser import lighten_ast
+
+
+# Lightener
+
+class IncrementalLightener(object):
+    """Light AST of a simplified AST, kept up to date when formulas or constants change. The inputs do not change."""
+
+    def __init__(self, formulas, constants, inputs_list, roots=lighten_ast.roots):
+        self.formulas = dict(formulas)
+        self.constants = dict(constants)
+        self.inputs = set(inputs_list)
+        self.roots = set(roots)
+
+        self.children_dict = {name: lighten_ast.get_children(formula) for name, formula in self.formulas.items()}
+        self.parents_dict = collections.defaultdict(set)
+        for parent, children in self.children_dict.items():
+            for child in children:
+                self.parents_dict[child].add(parent)
+
+        unknown_names = lighten_ast.find_undefined_names(self.formulas, self.constants, inputs_list,
+                                                         self.children_dict)
+        useful_nodes = lighten_ast.get_useful_nodes(roots, self.formulas, self.constants, inputs_list,
+                                                    self.children_dict, unknown_names)
+        self.useful_nodes = set().union(*useful_nodes)
+
+        self.children_light = lighten_ast.compute_children_light(self.children_dict, set(useful_nodes[0]))
+        self.level_by_formula = {
+            formula: level
+            for level, formulas in enumerate(lighten_ast.compute_computing_levels(self.children_light))
+            for formula in formulas
+            }
+
+    def update(self, changed_formulas=None, changed_constants=None):
+        """
+        Apply the changes of the simplified AST. `changed_formulas` and `changed_constants` map the added or changed
+        names to their new formula (as loaded by `lighten_ast.load_data`) or value, and the removed names to None.
+
+        Return the set of the useful formulas whose computing level was recomputed. Like `lighten_ast`, raise a
+        ValueError when useful formulas are in a cycle: the lightener must then be built again.
+        """
+        changed_formulas = changed_formulas or {}
+        changed_constants = changed_constants or {}
+        changed_names = set(changed_formulas) | set(changed_constants)
+        retyped_names = {
+            name
+            for name, formula in changed_formulas.items()
+            if (name in self.formulas) != (formula is not None)
+            }
+
+        # Remove the previous children of the changed formulas, then the useful symbols which are not a root formula
+        # nor the child of a useful formula anymore. The useful formulas are not in a cycle (see
+        # `lighten_ast.compute_computing_levels`), so a symbol which is not reachable anymore loses all its useful
+        # parents.
+        to_inspect = []
+        for name, formula in changed_formulas.items():
+            children = self.children_dict.pop(name, ())
+            for child in children:
+                self.parents_dict[child].discard(name)
+            if name in self.useful_nodes:
+                to_inspect.extend(children)
+                to_inspect.append(name)
+            if formula is None:
+                self.formulas.pop(name, None)
+            else:
+                self.formulas[name] = formula
+        for name, value in changed_constants.items():
+            if value is None:
+                self.constants.pop(name, None)
+            else:
+                self.constants[name] = value
+
+        removed_nodes = set()
+        while to_inspect:
+            node = to_inspect.pop()
+            if node in self.useful_nodes and not self.is_reachable(node):
+                self.useful_nodes.remove(node)
+                removed_nodes.add(node)
+                to_inspect.extend(self.children_dict.get(node, ()))
+
+        # Add the new children of the changed formulas, and the symbols which are now reachable from them or from the
+        # roots.
+        to_inspect = []
+        for name, formula in changed_formulas.items():
+            if formula is not None:
+                self.children_dict[name] = lighten_ast.get_children(formula)
+                for child in self.children_dict[name]:
+                    self.parents_dict[child].add(name)
+                if name in self.useful_nodes:
+                    to_inspect.extend(self.children_dict[name])
+                elif name in self.roots:
+                    to_inspect.append(name)
+        added_nodes = set()
+        while to_inspect:
+            node = to_inspect.pop()
+            if node in self.useful_nodes:
+                continue
+            self.useful_nodes.add(node)
+            added_nodes.add(node)
+            if node in self.formulas:
+                to_inspect.extend(child for child in self.children_dict[node] if child not in self.useful_nodes)
+
+        for name in removed_nodes | changed_names:
+            if name not in self.useful_nodes or name not in self.formulas:
+                self.children_light.pop(name, None)
+                self.level_by_formula.pop(name, None)
+
+        # The children of these formulas may have changed, or one of their children is not a formula anymore or became
+        # one. Only the formulas whose light children changed need a new computing level.
+        updated_formulas = set()
+        for name in (added_nodes - removed_nodes) | set(changed_formulas) | {
+                parent for name in retyped_names for parent in self.parents_dict.get(name, ())}:
+            if name in self.useful_nodes and name in self.formulas:
+                children_light = sorted(child for child in self.children_dict[name] if child in self.formulas)
+                if children_light != self.children_light.get(name):
+                    self.children_light[name] = children_light
+                    updated_formulas.add(name)
+        return self.update_levels(updated_formulas)
+
+    def is_reachable(self, name):
+        """Tell whether `name` is a root formula or the child of a useful formula."""
+        if name in self.roots and name in self.formulas:
+            return True
+        return any(parent in self.useful_nodes for parent in self.parents_dict.get(name, ()))
+
+    def update_levels(self, updated_formulas):
+        """
+        Recompute the computing levels of `updated_formulas` and of the useful formulas which depend on them, with
+        Kahn's algorithm restricted to these formulas. Return the set of these formulas.
+        """
+        dirty_formulas = set(updated_formulas)
+        to_inspect = list(updated_formulas)
+        while to_inspect:
+            for parent in self.parents_dict.get(to_inspect.pop(), ()):
+                if parent in self.children_light and parent not in dirty_formulas:
+                    dirty_formulas.add(parent)
+                    to_inspect.append(parent)
+
+        nb_remaining_children = {
+            formula: sum(1 for child in self.children_light[formula] if child in dirty_formulas)
+            for formula in dirty_formulas
+            }
+        level = [formula for formula, nb_children in nb_remaining_children.items() if nb_children == 0]
+        nb_sorted_formulas = 0
+        while level:
+            next_level = []
+            for formula in level:
+                self.level_by_formula[formula] = max(
+                    (self.level_by_formula[child] + 1 for child in self.children_light[formula]), default=0)
+                for parent in self.parents_dict.get(formula, ()):
+                    if parent in dirty_formulas:
+                        nb_remaining_children[parent] -= 1
+                        if nb_remaining_children[parent] == 0:
+                            next_level.append(parent)
+            nb_sorted_formulas += len(level)
+            level = next_level
+
+        if nb_sorted_formulas < len(dirty_formulas):
+            # Raise the same error as a full lightening.
+            lighten_ast.compute_computing_levels(self.children_light)
+        return dirty_formulas
+
+    def computing_levels(self):
+        formulas_by_level = collections.defaultdict(list)
+        for formula, level in self.level_by_formula.items():
+            formulas_by_level[level].append(formula)
+        return [sorted(formulas_by_level[level]) for level in range(len(formulas_by_level))]
+
+    def light_ast(self):
+        """Return the light AST as a dict of the files written by `lighten_ast.save_data`, by name."""
+        computing_levels = self.computing_levels()
+        useful_nodes = sorted(self.useful_nodes)
+        return collections.OrderedDict([
+            ('computing_order', [formula for level in computing_levels for formula in level]),
+            ('computing_levels', computing_levels),
+            ('children_light', self.children_light),
+            ('formulas_light', {name: self.formulas[name] for name in useful_nodes if name in self.formulas}),
+            ('constants_light', {
+                name: self.constants[name]
+                for name in useful_nodes
+                if name not in self.formulas and name in self.constants
+                }),
+            ('inputs_light', [
+                name
+                for name in useful_nodes
+                if name not in self.formulas and name not in self.constants and name in self.inputs
+                ]),
+            ('unknowns_light', [
+                name
+                for name in useful_nodes
+                if name not in self.formulas and name not in self.constants and name not in self.inputs
+                ]),
+            ])
+
+    def save(self, target_dir, format_name='json'):
+        lighten_ast.save_data(target_dir, format_name=format_name, **self.light_ast())
+
+
+# Public functions
+
+def load(source_dir, roots=lighten_ast.roots):
+    """Build the lightener of a 2_simplified_ast directory."""
+    formulas, constants, input_variables, inputs_list = lighten_ast.load_data(source_dir)
+    return IncrementalLightener(formulas, constants, inputs_list, roots)
@@ -0,0 +1,91 @@
+"""
+Timings and counters of the stages of `m_to_ast`, `simplify_ast` and `lighten_ast`.
+
+The stages record their wall and CPU times and their counters in the module-global `report`, which is disabled by
+default: it then only keeps the timings and the counters which cost nothing to compute. When it is enabled, the
+nodes of the AST are also counted by type, which slows the parsing down. `scripts/parse_code_m.py --report` writes the
+report of a regeneration as JSON.
+
+The modules use `instrumentation.report` at call time, so that `recording` can replace it, for example to get the
+report of a single file.
+"""
+
+
+from collections import Counter, OrderedDict
+import contextlib
+import json
+import time
+
+
+# Report
+
+class Report(object):
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stages = OrderedDict()
+        self.counters = Counter()
+        self.files = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Add the wall and CPU times of the `with` block to the stage `name`."""
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            self.add_stage(name, 1, time.perf_counter() - wall_start, time.process_time() - cpu_start)
+
+    def add_stage(self, name, calls, wall_seconds, cpu_seconds):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = OrderedDict([('calls', 0), ('wall_seconds', 0.), ('cpu_seconds', 0.)])
+        stage['calls'] += calls
+        stage['wall_seconds'] += wall_seconds
+        stage['cpu_seconds'] += cpu_seconds
+
+    def count(self, name, increment=1):
+        self.counters[name] += increment
+
+    def merge(self, report_dict):
+        """Add the stages and the counters of a report converted by `to_dict`, from a worker process for example."""
+        for name, stage in report_dict['stages'].items():
+            self.add_stage(name, stage['calls'], stage['wall_seconds'], stage['cpu_seconds'])
+        self.counters.update(report_dict['counters'])
+
+    def to_dict(self):
+        report_dict = OrderedDict([
+            ('stages', self.stages),
+            ('counters', OrderedDict(sorted(self.counters.items()))),
+            ])
+        if self.files:
+            report_dict['files'] = self.files
+        return report_dict
+
+    def dump(self, file_path):
+        with open(file_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+# Globals
+
+report = Report()
+
+
+# Public functions
+
+@contextlib.contextmanager
+def recording(new_report):
+    """Record in `new_report` instead of `report` in the `with` block."""
+    global report
+    previous_report = report
+    report = new_report
+    try:
+        yield new_report
+    finally:
+        report = previous_report
+
+
+def byte_size(data):
+    """Return the size of bytes, or of a string encoded in UTF-8."""
+    return len(data) if isinstance(data, bytes) else len(data.encode('utf-8'))
@@ -1,4 +1,90 @@
 import json
+import re
+
+
+extension = '.json'
+is_binary = False
+
+default_chunk_size = 1024 * 1024
+whitespace_re = re.compile(r'\s*')
+
 
 def dumps(obj):
     return json.dumps(obj, sort_keys=True, indent=2)
+
+
+def loads(data):
+    return json.loads(data)
+
+
+def iter_dumps_items(items):
+    """
+    Yield the text of the JSON object of the `(key, value)` pairs of `items` piece by piece, formatted like `dumps`
+    but with the keys in the order of `items`.
+    """
+    separator = '{\n'
+    for key, value in items:
+        # Strip the braces of a one-key object to keep the indentation of `dumps`.
+        yield separator + dumps({key: value})[2:-2]
+        separator = ',\n'
+    yield '{}' if separator == '{\n' else '\n}'
+
+
+def iter_loads(f, dropped_keys=(), chunk_size=default_chunk_size):
+    """
+    Yield the items of the JSON array read from the file object `f`, each one as soon as it is decoded, so that the
+    whole array is never in memory. The keys of `dropped_keys` are removed from the decoded objects.
+    """
+    def drop_keys(obj):
+        for key in dropped_keys:
+            obj.pop(key, None)
+        return obj
+
+    decoder = json.JSONDecoder(object_hook=drop_keys if dropped_keys else None)
+    buffer = ''
+    position = 0
+    is_read = False
+
+    def read_more():
+        """Append the next chunk to the buffer, at least as large as the buffer to read big items in linear time."""
+        nonlocal buffer, position, is_read
+        chunk = f.read(max(chunk_size, len(buffer) - position))
+        buffer = buffer[position:] + chunk
+        position = 0
+        is_read = not chunk
+        return not is_read
+
+    def next_character():
+        nonlocal position
+        while True:
+            position = whitespace_re.match(buffer, position).end()
+            if position < len(buffer):
+                return buffer[position]
+            if not read_more():
+                return None
+
+    if next_character() != '[':
+        raise ValueError('Expected a JSON array')
+    position += 1
+    if next_character() == ']':
+        return
+    while True:
+        next_character()
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if read_more():
+                continue
+            raise
+        # A number may go on in the next chunk: decode it again once the buffer is extended.
+        if end == len(buffer) and not is_read:
+            read_more()
+            continue
+        position = end
+        yield item
+        character = next_character()
+        if character == ']':
+            return
+        if character != ',':
+            raise ValueError('Expected "," or "]" after an item of the JSON array, got {!r}'.format(character))
+        position += 1
@@ -4,67 +4,81 @@ Keep only the variables that are useful to compute a set of "root" variables. Th
 
 
 import collections
-import os
-import json
 
 import numpy as np
 
-from calculette_impots_m_language_parser import json_dump
+from calculette_impots_m_language_parser import compact_ast, instrumentation, serialization, simplify_ast
 
 
 # List of variables used to compute taxes (this list was written with M code
 # experts during the hackathon  CodeImpot)
 roots = ['NBPT', 'REVKIRE', 'BCSG', 'BRDS', 'IBM23', 'TXMOYIMP', 'NAPTIR',
          'IINET', 'RRRBG', 'RNI', 'IDRS3', 'IAVIM']
-print('The important variables are : {}'.format(roots))
 
 
 # Public functions
 
-def lighten_ast(source_dir, target_dir):
-    formulas, constants, input_variables, inputs_list = load_data(source_dir)
+def lighten_ast(source_dir, target_dir, format_name='json', roots=roots):
+    """
+    Keep the formulas needed to compute `roots`. To slice the same simplified AST for several sets of roots, see
+    `dependency_index`. To update the light AST after a few formulas changed, see `incremental_lighten_ast`.
+    """
+    report = instrumentation.report
+    print('The important variables are : {}'.format(roots))
+    with report.stage('lighten_ast.load'):
+        formulas, constants, input_variables, inputs_list = load_data(source_dir, shared=True)
 
-    # Get deep children (dependancies)
-    children_dict = {}
-    for name, formula in formulas.items():
-        children_dict[name] = get_children(formula)
+    # Get deep children (dependancies), on the integer IDs of the compact form.
+    with report.stage('lighten_ast.children'):
+        ast = compact_ast.from_simplified_ast(formulas, constants, input_variables)
 
+    with report.stage('lighten_ast.useful_nodes'):
+        symbols = ast.symbols
+        unknown_names = [symbols.names[symbol_id] for symbol_id in symbols.ids_of_kind(compact_ast.UNKNOWN)]
+        print('Found {} undefined names.'.format(len(unknown_names)))
 
-    unknown_names = find_undefined_names(formulas, constants, inputs_list, children_dict)
-    print('Found {} undefined names.'.format(len(unknown_names)))
-
-    parents_dict = get_parents(children_dict)
-
-    useful_formulas, useful_constants, useful_inputs, useful_unknown = get_useful_nodes(roots, formulas, constants, inputs_list, children_dict, unknown_names)
+        useful_formulas, useful_constants, useful_inputs, useful_unknown = get_compact_useful_nodes(roots, ast)
 
     print('{} formulas are used to compute a useful variable.'.format(len(useful_formulas)))
     print('{} constants are used to compute a useful variable.'.format(len(useful_constants)))
     print('{} inputs are used to compute a useful variable.'.format(len(useful_inputs)))
     print('{} undefined symbols are used to compute a useful variable.'.format(len(useful_unknown)))
+    report.count('lighten_ast.formulas', len(formulas))
+    report.count('lighten_ast.undefined_names', len(unknown_names))
+    report.count('lighten_ast.useful_formulas', len(useful_formulas))
+    report.count('lighten_ast.useful_constants', len(useful_constants))
+    report.count('lighten_ast.useful_inputs', len(useful_inputs))
+    report.count('lighten_ast.useful_undefined_names', len(useful_unknown))
 
 
     # Ignore useless variables (= not used to compute a useful variables)
+    # The lists are sorted, as the order of the traversal depends on the iteration order of the sets of children.
     formulas_light = {k: formulas[k] for k in useful_formulas}
     constants_light = {k: constants[k] for k in useful_constants}
-    inputs_light = useful_inputs
-    unknowns_light = useful_unknown
+    inputs_light = sorted(useful_inputs)
+    unknowns_light = sorted(useful_unknown)
 
-    children_light = compute_children_light(children_dict, formulas_light)
+    with report.stage('lighten_ast.computing_levels'):
+        children_light = compute_compact_children_light(ast, useful_formulas)
 
-    computing_order = compute_non_recursive_computing_order(children_light)
+        computing_levels = compute_computing_levels(children_light)
+        print('The formulas are computed in {} levels.'.format(len(computing_levels)))
+        computing_order = [formula for level in computing_levels for formula in level]
+    report.count('lighten_ast.computing_levels', len(computing_levels))
 
-    save_data(target_dir, computing_order, children_light, formulas_light, constants_light, inputs_light, unknowns_light)
+    with report.stage('lighten_ast.save'):
+        save_data(target_dir, computing_order, computing_levels, children_light, formulas_light, constants_light,
+                  inputs_light, unknowns_light, format_name)
 
 
 # Helper functions
 
-def load_data(source_dir):
-    with open(os.path.join(source_dir, 'formulas.json'), 'r') as f:
-        formulas = json.load(f)
-    with open(os.path.join(source_dir, 'constants.json'), 'r') as f:
-        constants = json.load(f)
-    with open(os.path.join(source_dir, 'input_variables.json'), 'r') as f:
-        input_variables = json.load(f)
+def load_data(source_dir, shared=False):
+    """With `shared=True`, the formulas may share subtrees and must not be modified, see `serialization`."""
+    # The `reduce` nodes of lazy loops are kept, see `get_children`.
+    formulas = simplify_ast.expand_formula_maps(serialization.load(source_dir, 'formulas', shared))
+    constants = serialization.load(source_dir, 'constants')
+    input_variables = serialization.load(source_dir, 'input_variables')
 
     inputs_list = []
     for e in input_variables:
@@ -92,14 +106,24 @@ def get_children(node):
 
         return children
 
+    elif nodetype == 'reduce':
+        # Unroll the names of the children instead of the expression.
+        loop_variables = node['loop_variables']
+        children = set()
+        for child in get_children(node['expression']):
+            children.update(simplify_ast.unroll(child, loop_variables, str.replace))
+
+        return children
+
     raise ValueError('Unknown type : %s'%nodetype)
 
 
 def find_undefined_names(formulas, constants, inputs_list, children_dict):
+    inputs_set = set(inputs_list)
     unknown_names = set()
     for k, v in children_dict.items():
         for var in v:
-            if (var not in formulas) and (var not in constants) and (var not in inputs_list):
+            if (var not in formulas) and (var not in constants) and (var not in inputs_set):
                 unknown_names.add(var)
     return unknown_names
 
@@ -119,7 +143,9 @@ def get_parents(children_dict):
 
 
 def get_useful_nodes(roots, formulas, constants, inputs_list, children_dict, unknown_names):
-    # List nodes used somewhere, with a graph traversal
+    # List nodes used somewhere, with a graph traversal in O(nodes + edges).
+    # The lists keep the order of the traversal, the sets (and the counter of the nodes waiting in `to_inspect`) are
+    # used for membership tests.
 
     to_inspect = []
     for root in roots:
@@ -127,80 +153,124 @@ def get_useful_nodes(roots, formulas, constants, inputs_list, children_dict, unk
             to_inspect.append(root)
         else:
             print('Warning: root formula {} is not defined.'.format(root))
+    nb_waiting_by_node = collections.Counter(to_inspect)
+
+    inputs_set = set(inputs_list)
 
     useful_formulas = []
     useful_constants = []
     useful_inputs = []
     useful_unknown = []
+    useful_nodes = set()
 
     while to_inspect:
         node = to_inspect.pop()
+        nb_waiting_by_node[node] -= 1
 
-        if node in useful_formulas:
+        if node in useful_nodes:
             continue
 
         for child in children_dict[node]:
             if child in formulas:
-                if (child not in useful_formulas) and (child not in to_inspect):
+                if (child not in useful_nodes) and not nb_waiting_by_node[child]:
                     to_inspect.append(child)
+                    nb_waiting_by_node[child] += 1
             elif child in constants:
-                if child not in useful_constants:
+                if child not in useful_nodes:
                     useful_constants.append(child)
-            elif child in inputs_list:
-                if child not in useful_inputs:
+                    useful_nodes.add(child)
+            elif child in inputs_set:
+                if child not in useful_nodes:
                     useful_inputs.append(child)
+                    useful_nodes.add(child)
             elif child in unknown_names:
-                if child not in useful_unknown:
+                if child not in useful_nodes:
                     useful_unknown.append(child)
+                    useful_nodes.add(child)
             else:
                 raise Exception('Unknown variable category : %s for parent %s.'%(child, node))
 
         useful_formulas.append(node)
+        useful_nodes.add(node)
 
     return useful_formulas, useful_constants, useful_inputs, useful_unknown
 
 
-def compute_children_light(children_dict, formulas_light):
-    children_light = {}
-    for formula in formulas_light:
-        children_light[formula] = []
-        for child in children_dict[formula]:
-            if child in formulas_light:
-                children_light[formula].append(child)
-    return children_light
-
-
-def compute_non_recursive_computing_order(children_light):
-    def find_order(node):
-        is_leaf = True
-        for child in children_light[node]:
-            if child not in computing_order:
-                find_order(child)
-
-        computing_order.append(node)
-
-    computing_order = []
+def get_compact_useful_nodes(roots, ast):
+    """
+    Return the names of the formulas, constants, inputs and undefined names needed to compute `roots`, like
+    `get_useful_nodes` but on a `compact_ast.CompactAst`.
+    """
+    symbols = ast.symbols
+    root_ids = []
     for root in roots:
-        if root in children_light:
-            find_order(root)
+        if root in symbols and symbols.kinds[symbols.get_id(root)] == compact_ast.FORMULA:
+            root_ids.append(symbols.get_id(root))
+        else:
+            print('Warning: root formula {} is not defined.'.format(root))
 
-    return computing_order
+    useful_nodes_by_kind = [[] for _ in compact_ast.kind_names]
+    for symbol_id in ast.get_useful_ids(root_ids):
+        useful_nodes_by_kind[symbols.kinds[symbol_id]].append(symbols.names[symbol_id])
+    return useful_nodes_by_kind
 
-def save_data(target_dir, computing_order, children_light, formulas_light, constants_light, inputs_light, unknowns_light):
-    with open(os.path.join(target_dir, 'computing_order.json'), 'w') as f:
-        f.write(json_dump.dumps(computing_order))
 
-    with open(os.path.join(target_dir, 'children_light.json'), 'w') as f:
-        f.write(json_dump.dumps(children_light))
+def compute_compact_children_light(ast, formulas_light):
+    """Like `compute_children_light`, on a `compact_ast.CompactAst`."""
+    symbols = ast.symbols
+    children_light = {}
+    for formula in formulas_light:
+        # The formulas have the first IDs, in the order of their names.
+        children_light[formula] = [
+            symbols.names[child_id]
+            for child_id in ast.children(symbols.get_id(formula))
+            if child_id < ast.nb_formulas
+            ]
+    return children_light
 
-    with open(os.path.join(target_dir, 'formulas_light.json'), 'w') as f:
-        f.write(json_dump.dumps(formulas_light))
 
-    with open(os.path.join(target_dir, 'constants_light.json'), 'w') as f:
-        f.write(json_dump.dumps(constants_light))
+def compute_children_light(children_dict, formulas_light):
+    children_light = {}
+    for formula in formulas_light:
+        children_light[formula] = sorted(child for child in children_dict[formula] if child in formulas_light)
+    return children_light
 
-    with open(os.path.join(target_dir, 'inputs_light.json'), 'w') as f:
-        f.write(json_dump.dumps(inputs_light))
 
-    with open(os.path.join(target_dir, 'unknowns_light.json'), 'w') as f:
-        f.write(json_dump.dumps(unknowns_light))
+def compute_computing_levels(children_light):
+    """
+    Sort the formulas in dependency levels with Kahn's algorithm: the formulas of a level only depend on formulas of
+    the previous levels, so they can be computed together. The formulas of each level are sorted by name.
+    """
+    parents_light = get_parents(children_light)
+    nb_remaining_children = {formula: len(children) for formula, children in children_light.items()}
+
+    computing_levels = []
+    level = sorted(formula for formula, nb_children in nb_remaining_children.items() if nb_children == 0)
+    while level:
+        computing_levels.append(level)
+        next_level = []
+        for formula in level:
+            for parent in parents_light[formula]:
+                nb_remaining_children[parent] -= 1
+                if nb_remaining_children[parent] == 0:
+                    next_level.append(parent)
+        level = sorted(next_level)
+
+    nb_sorted_formulas = sum(len(level) for level in computing_levels)
+    if nb_sorted_formulas < len(children_light):
+        unsorted_formulas = sorted(
+            formula for formula, nb_children in nb_remaining_children.items() if nb_children > 0)
+        raise ValueError('Cyclic dependencies: the formulas {} are in a cycle or depend on one'.format(
+            ', '.join(unsorted_formulas)))
+    return computing_levels
+
+
+def save_data(target_dir, computing_order, computing_levels, children_light, formulas_light, constants_light,
+              inputs_light, unknowns_light, format_name='json'):
+    serialization.dump(computing_order, target_dir, 'computing_order', format_name)
+    serialization.dump(computing_levels, target_dir, 'computing_levels', format_name)
+    serialization.dump(children_light, target_dir, 'children_light', format_name)
+    serialization.dump(formulas_light, target_dir, 'formulas_light', format_name)
+    serialization.dump(constants_light, target_dir, 'constants_light', format_name)
+    serialization.dump(inputs_light, target_dir, 'inputs_light', format_name)
+    serialization.dump(unknowns_light, target_dir, 'unknowns_light', format_name)
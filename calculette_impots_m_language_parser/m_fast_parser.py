@@ -0,0 +1,711 @@
+"""
+Fast parser of the M language, used by `m_to_ast` with `backend='fast'`.
+
+A regular expression splits the preprocessed source code into tokens, then a recursive descent parser builds the
+AST directly, with one method per precedence level for the expressions (boolean operators, "dans", comparisons,
+sums, products, factors). It builds the same AST as the Arpeggio parser with `MLanguageVisitor`, which is checked by
+the tests and by the script `compare_parser_backends.py` on the M sources of the millésimes. The alternatives of the
+grammar are tried in the same order, backtracking when one of them fails.
+
+Unlike Arpeggio which matches keywords as prefixes, a keyword only matches a whole word.
+"""
+
+
+from collections import OrderedDict
+import re
+
+from calculette_impots_m_language_parser import instrumentation, m_to_ast
+
+
+# Globals
+
+# Arpeggio skips these whitespace characters before each token. It also skips them at the beginning of a string.
+token_regex = re.compile(r'''
+    ([\t\n\r\ ]*)
+    (?:
+        (?P<comment>\#.*)
+        | "[\t\n\r\ ]*(?P<string>[^"]*)"
+        | (?P<float>\d+\.\d+)
+        | (?P<word>\w+)
+        | (?P<operator>\.\.|>=|<=|!=|[-+*/()\[\],;:=<>])
+    )
+    ''', re.VERBOSE)
+whitespace_regex = re.compile(r'[\t\n\r ]*')
+integer_regex = re.compile(r'\d+')
+
+comparison_operators = {'>=', '<=', '!=', '>', '<', '='}
+erreur_types = {'anomalie', 'discordance', 'informative'}
+value_types = {'BOOLEEN', 'DATE_AAAA', 'DATE_JJMMAAAA', 'DATE_MM', 'ENTIER', 'REEL'}
+variable_calculee_subtypes = {'base', 'restituee'}
+variable_saisie_subtypes = {'contexte', 'famille', 'penalite', 'revenu'}
+
+
+class ParseError(ValueError):
+    """Syntax error at a 1-based line and column of the parsed source code."""
+
+    def __init__(self, message, line, col):
+        super(ParseError, self).__init__('{} at line {}, column {}.'.format(message, line, col))
+        self.line = line
+        self.col = col
+
+
+class Backtrack(Exception):
+    """Failure of an alternative of the grammar, which is cheaper to raise than a ParseError."""
+
+
+# Public functions
+
+def parse(source_code, line_index=None):
+    """
+    Parse a preprocessed M source code and return the list of its declarations, like `MLanguageVisitor` does.
+    The "linecol" keys are computed with `line_index`, and omitted when it is None.
+    """
+    parser = MLanguageParser(source_code, line_index)
+    try:
+        return parser.parse_source_file()
+    except Backtrack:
+        raise parser.make_error() from None
+
+
+def tokenize(source_code):
+    """
+    Return the tokens of a preprocessed M source code, as a list of (kind, value, position) tuples ending with an
+    ('eof', '', position) tuple. The value of a string is its content, or '"' when it is empty as with Arpeggio.
+    """
+    tokens = []
+    position = 0
+    match = token_regex.match
+    end = len(source_code)
+    while True:
+        token_match = match(source_code, position)
+        if token_match is None:
+            position = whitespace_regex.match(source_code, position).end()
+            if position == end:
+                tokens.append(('eof', '', position))
+                return tokens
+            raise ParseError('Unexpected character {!r}'.format(source_code[position]),
+                             *m_to_ast.LineIndex(source_code).linecol(position))
+        kind = token_match.lastgroup
+        value = token_match.group(kind)
+        if kind == 'string' and not value:
+            value = '"'
+        tokens.append((kind, value, token_match.end(1)))
+        position = token_match.end()
+
+
+# Helpers
+
+def make_leaf(type, value):
+    """Return the same node as `m_to_ast.make_node(type=type, value=value)`, faster for the most frequent nodes."""
+    if instrumentation.report.enabled:
+        instrumentation.report.count('m_to_ast.nodes.' + type)
+    return OrderedDict([('type', type), ('value', value)])
+
+
+# Parser
+
+
+class MLanguageParser(object):
+    def __init__(self, source_code, line_index=None):
+        self.source_code = source_code
+        self.line_index = line_index
+        tokens = tokenize(source_code)
+        self.kinds = [token[0] for token in tokens]
+        self.values = [token[1] for token in tokens]
+        self.positions = [token[2] for token in tokens]
+        self.index = 0
+        # Furthest failure, reported when no alternative matches, like Arpeggio does.
+        self.error_index = 0
+        self.error_expected = None
+
+    # Tokens
+
+    def fail(self, expected):
+        if self.index >= self.error_index:
+            self.error_index = self.index
+            self.error_expected = expected
+        raise Backtrack()
+
+    def make_error(self):
+        index = min(self.error_index, len(self.values) - 1)
+        line, col = m_to_ast.LineIndex(self.source_code).linecol(self.positions[index])
+        found = self.values[index] if self.kinds[index] != 'eof' else 'end of file'
+        return ParseError('Expected {} instead of {!r}'.format(self.error_expected, found), line, col)
+
+    def accept(self, value):
+        """Skip the next token and return True if its value is `value`."""
+        if self.values[self.index] == value and self.kinds[self.index] != 'string':
+            self.index += 1
+            return True
+        return False
+
+    def expect(self, value):
+        if not self.accept(value):
+            self.fail(repr(value))
+
+    def expect_adjacent(self, word, value):
+        """Match a literal such as "tableau[" of the grammar, made of a word and an operator without spaces."""
+        index = self.index
+        if self.kinds[index] == 'word' and self.values[index] == word and self.values[index + 1] == value \
+                and self.positions[index + 1] == self.positions[index] + len(word):
+            self.index += 2
+        else:
+            self.fail(repr(word + value))
+
+    def expect_kind(self, kind, name=None):
+        index = self.index
+        if self.kinds[index] != kind:
+            self.fail(name or kind)
+        self.index = index + 1
+        return self.values[index]
+
+    def expect_one_of(self, values, name):
+        value = self.values[self.index]
+        if value not in values or self.kinds[self.index] != 'word':
+            self.fail(name)
+        self.index += 1
+        return value
+
+    def linecol(self, first_index, last_index):
+        if self.line_index is None:
+            return None
+        return (self.line_index.linecol(self.positions[first_index]),
+                self.line_index.linecol(self.positions[last_index]))
+
+    def attempt(self, parse_method, *args):
+        """Return the result of a parse method, or None after restoring the position if it fails."""
+        index = self.index
+        try:
+            return parse_method(*args)
+        except Backtrack:
+            self.index = index
+            return None
+
+    def repeat(self, parse_method, separator=None):
+        """Parse `item (separator item)*`, or `item*` without separator, and return the items."""
+        items = []
+        while True:
+            index = self.index
+            if separator is not None and items and not self.accept(separator):
+                return items
+            item = self.attempt(parse_method)
+            if item is None:
+                self.index = index
+                return items
+            items.append(item)
+
+    def repeat_words(self):
+        """Parse `symbol+` and return the words."""
+        words = [self.expect_kind('word', 'symbol')]
+        while self.kinds[self.index] == 'word':
+            words.append(self.values[self.index])
+            self.index += 1
+        return words
+
+    # Declarations
+
+    def parse_source_file(self):
+        nodes = []
+        nb_items = 0
+        while self.kinds[self.index] != 'eof':
+            if self.kinds[self.index] == 'comment':
+                self.index += 1
+            else:
+                node = self.parse_declaration()
+                if node is None:
+                    raise Backtrack()
+                nodes.append(node)
+            nb_items += 1
+        if nb_items == 0:
+            self.fail('a declaration')
+        return nodes
+
+    def parse_declaration(self):
+        value = self.values[self.index]
+        next_value = self.values[self.index + 1]
+        alternatives = []
+        if value == 'application':
+            alternatives.append(self.parse_application)
+        elif value == 'enchaineur':
+            alternatives.append(self.parse_enchaineur)
+        if next_value == ':':
+            alternatives.append(self.parse_variable)
+        if value == 'regle':
+            alternatives.append(self.parse_regle)
+        elif value == 'verif':
+            alternatives.append(self.parse_verif)
+        if next_value == ':':
+            alternatives.append(self.parse_erreur)
+        elif value == 'sortie':
+            alternatives.append(self.parse_sortie)
+        if not alternatives:
+            self.fail('a declaration')
+        for parse_method in alternatives:
+            node = self.attempt(parse_method)
+            if node is not None:
+                return node
+        return None
+
+    def parse_application(self):
+        first_index = self.index
+        self.expect('application')
+        name = self.expect_kind('word', 'symbol')
+        last_index = self.index
+        self.expect(';')
+        return m_to_ast.make_node(type='application', linecol=self.linecol(first_index, last_index), name=name)
+
+    def parse_applications_reference(self):
+        self.expect('application')
+        self.expect(':')
+        names = [self.expect_kind('word', 'symbol')]
+        while self.accept(','):
+            names.append(self.expect_kind('word', 'symbol'))
+        return names
+
+    def parse_enchaineur(self):
+        first_index = self.index
+        self.expect('enchaineur')
+        name = self.expect_kind('word', 'symbol')
+        applications = self.parse_applications_reference()
+        last_index = self.index
+        self.expect(';')
+        return m_to_ast.make_node(applications=applications, linecol=self.linecol(first_index, last_index), name=name,
+                                  type='enchaineur')
+
+    def parse_enchaineur_reference(self):
+        self.expect('enchaineur')
+        self.expect(':')
+        value = self.expect_kind('word', 'symbol')
+        self.expect(';')
+        return value
+
+    def parse_erreur(self):
+        first_index = self.index
+        name = self.expect_kind('word', 'symbol')
+        self.expect(':')
+        erreur_type = self.expect_one_of(erreur_types, 'erreur_type')
+        strings = []
+        for _ in range(4):
+            self.expect(':')
+            strings.append(self.expect_kind('string'))
+        if self.accept(':'):
+            strings.append(self.expect_kind('string'))
+        last_index = self.index
+        self.expect(';')
+        return m_to_ast.make_node(
+            codes=strings[:3] + strings[4:],
+            description=strings[3],
+            erreur_type=erreur_type,
+            linecol=self.linecol(first_index, last_index),
+            name=name,
+            type='erreur',
+            )
+
+    def parse_formula(self):
+        first_index = self.index
+        name = self.expect_kind('word', 'symbol')
+        index = self.parse_brackets() if self.values[self.index] == '[' else None
+        self.expect('=')
+        expression = self.parse_expression()
+        last_index = self.index
+        self.expect(';')
+        return m_to_ast.make_node(expression=expression, index=index, linecol=self.linecol(first_index, last_index),
+                                  name=name, type='formula')
+
+    def parse_pour_formula(self):
+        self.expect('pour')
+        loop_variables = self.parse_loop_variables()
+        self.expect(':')
+        return m_to_ast.make_node(formula=self.parse_formula(), loop_variables=loop_variables, type='pour_formula')
+
+    def parse_regle_formula(self):
+        if self.values[self.index] == 'pour':
+            pour_formula = self.attempt(self.parse_pour_formula)
+            if pour_formula is not None:
+                return pour_formula
+        return self.parse_formula()
+
+    def parse_regle(self):
+        first_index = self.index
+        self.expect('regle')
+        symbols = self.repeat_words()
+        self.expect(':')
+        applications = self.parse_applications_reference()
+        self.expect(';')
+        enchaineur = self.attempt(self.parse_enchaineur_reference) if self.values[self.index] == 'enchaineur' \
+            else None
+        last_index = self.index
+        formulas = [self.parse_regle_formula()]
+        while True:
+            index = self.index
+            formula = self.attempt(self.parse_regle_formula)
+            if formula is None:
+                break
+            last_index = index
+            formulas.append(formula)
+        return m_to_ast.make_node(
+            applications=applications,
+            enchaineur=enchaineur,
+            formulas=[formula for formula in formulas if formula['type'] == 'formula'] +
+            [formula for formula in formulas if formula['type'] == 'pour_formula'],
+            linecol=self.linecol(first_index, last_index),
+            name=symbols[-1],
+            tags=[m_to_ast.make_node(type='symbol', value=symbol) for symbol in symbols[:-1]] or None,
+            type='regle',
+            )
+
+    def parse_sortie(self):
+        self.expect_adjacent('sortie', '(')
+        variable_name = self.expect_kind('word', 'symbol')
+        self.expect(')')
+        self.expect(';')
+        return m_to_ast.make_node(type='sortie', variable_name=variable_name)
+
+    def parse_variable(self):
+        keyword = self.values[self.index + 2]
+        if keyword in ('calculee', 'tableau'):
+            return self.parse_variable_calculee()
+        elif keyword == 'const':
+            return self.parse_variable_const()
+        elif keyword == 'saisie':
+            return self.parse_variable_saisie()
+        self.index += 2
+        self.fail('variable')
+
+    def parse_value_type(self):
+        if self.values[self.index] == 'type':
+            return self.attempt(self.parse_value_type_name)
+        return None
+
+    def parse_value_type_name(self):
+        self.expect('type')
+        return self.expect_one_of(value_types, 'value_type')
+
+    def parse_variable_calculee(self):
+        first_index = self.index
+        name = self.expect_kind('word', 'symbol')
+        self.expect(':')
+        tableau = None
+        if self.values[self.index] == 'tableau':
+            self.expect_adjacent('tableau', '[')
+            tableau = self.parse_integer()
+            self.expect(']')
+        self.expect('calculee')
+        subtypes = []
+        while self.kinds[self.index] == 'word' and self.values[self.index] in variable_calculee_subtypes:
+            subtypes.append(self.values[self.index])
+            self.index += 1
+        self.expect(':')
+        description = self.expect_kind('string')
+        value_type = self.parse_value_type()
+        last_index = self.index
+        self.expect(';')
+        return m_to_ast.make_node(
+            base=('base' in subtypes) or None,
+            description=description,
+            linecol=self.linecol(first_index, last_index),
+            name=name,
+            restituee=('restituee' in subtypes) or None,
+            tableau=tableau,
+            type='variable_calculee',
+            value_type=value_type,
+            )
+
+    def parse_variable_const(self):
+        first_index = self.index
+        name = self.expect_kind('word', 'symbol')
+        self.expect(':')
+        self.expect('const')
+        self.expect('=')
+        value = float(self.expect_kind('float'))
+        last_index = self.index
+        self.expect(';')
+        return m_to_ast.make_node(linecol=self.linecol(first_index, last_index), name=name, type='variable_const',
+                                  value=value)
+
+    def parse_variable_saisie_attribute(self):
+        name = self.expect_kind('word', 'symbol')
+        self.expect('=')
+        return name, self.parse_integer()
+
+    def parse_variable_saisie(self):
+        first_index = self.index
+        name = self.expect_kind('word', 'symbol')
+        self.expect(':')
+        self.expect('saisie')
+        subtype = self.expect_one_of(variable_saisie_subtypes, 'variable_saisie_subtype')
+        attributes = self.repeat(self.parse_variable_saisie_attribute)
+        restituee = self.accept('restituee')
+        self.expect('alias')
+        alias = self.expect_kind('word', 'symbol')
+        self.expect(':')
+        description = self.expect_kind('string')
+        value_type = self.parse_value_type()
+        last_index = self.index
+        self.expect(';')
+        return m_to_ast.make_node(
+            alias=alias,
+            attributes=OrderedDict(sorted(attributes)) if attributes else None,
+            description=description,
+            linecol=self.linecol(first_index, last_index),
+            name=name,
+            restituee=(not restituee) or None,
+            subtype=subtype,
+            type='variable_saisie',
+            value_type=value_type,
+            )
+
+    def parse_verif(self):
+        first_index = self.index
+        self.expect('verif')
+        symbols = self.repeat_words()
+        self.expect(':')
+        applications = self.parse_applications_reference()
+        self.expect(';')
+        last_index = self.index
+        conditions = [self.parse_verif_condition()]
+        while True:
+            index = self.index
+            condition = self.attempt(self.parse_verif_condition)
+            if condition is None:
+                break
+            last_index = index
+            conditions.append(condition)
+        return m_to_ast.make_node(
+            applications=applications,
+            conditions=conditions,
+            linecol=self.linecol(first_index, last_index),
+            name=symbols[-1],
+            tags=[m_to_ast.make_node(type='symbol', value=symbol) for symbol in symbols[:-1]] or None,
+            type='verif',
+            )
+
+    def parse_verif_condition(self):
+        self.expect('si')
+        expression = self.parse_expression()
+        self.expect('alors')
+        self.expect('erreur')
+        erreurs = self.repeat_words()
+        self.expect(';')
+        return m_to_ast.make_node(
+            error_name=erreurs[0],
+            expression=expression,
+            type='verif_condition',
+            variable_name=erreurs[1] if len(erreurs) > 1 else None,
+            )
+
+    # Loops
+
+    def parse_enumeration(self):
+        items = self.repeat(self.parse_enumeration_item, separator=',')
+        if not items:
+            self.fail('enumeration')
+        values = [value for kind, value in items if kind == 'integer'] + \
+            [value for kind, value in items if kind == 'symbol']
+        enumerations = [m_to_ast.make_node(type='enumeration_values', values=values)] if values else []
+        return enumerations + [value for kind, value in items if kind == 'interval']
+
+    def parse_enumeration_item(self):
+        index = self.index
+        word = self.expect_kind('word', 'enumeration item')
+        if self.values[self.index] == '..' and self.kinds[self.index + 1] == 'word':
+            self.index += 2
+            return 'interval', m_to_ast.make_node(first=word, last=self.values[index + 2], type='interval')
+        self.index = index
+        if integer_regex.match(word):
+            return 'integer', self.parse_integer()
+        self.index += 1
+        return 'symbol', word
+
+    def parse_integer(self):
+        word = self.values[self.index]
+        integer_match = integer_regex.match(word) if self.kinds[self.index] == 'word' else None
+        # Arpeggio would only match the digits at the beginning of the word, and fail on the next ones.
+        if integer_match is None or integer_match.end() != len(word):
+            self.fail('integer')
+        self.index += 1
+        return int(word)
+
+    def parse_loop_expression(self):
+        loop_variables = self.parse_loop_variables()
+        self.expect(':')
+        return m_to_ast.make_node(expression=self.parse_expression(), loop_variables=loop_variables,
+                                  type='loop_expression')
+
+    def parse_loop_variables(self):
+        if self.values[self.index] == 'un':
+            loop_variables = self.repeat(self.parse_loop_variable1, separator='et')
+            if loop_variables:
+                return loop_variables
+        loop_variables = self.repeat(self.parse_loop_variable2, separator=';')
+        if not loop_variables:
+            self.fail('loop_variables')
+        return loop_variables
+
+    def parse_loop_variable1(self):
+        self.expect('un')
+        name = self.expect_kind('word', 'symbol')
+        self.expect('dans')
+        return m_to_ast.make_node(enumerations=self.parse_enumeration(), name=name, type='loop_variable')
+
+    def parse_loop_variable2(self):
+        name = self.expect_kind('word', 'symbol')
+        self.expect('=')
+        return m_to_ast.make_node(enumerations=self.parse_enumeration(), name=name, type='loop_variable')
+
+    # Expressions, from the lowest precedence to the highest
+
+    def parse_expression(self):
+        operand = self.parse_dans()
+        if self.values[self.index] not in ('et', 'ou'):
+            return operand
+        operands = [operand]
+        operators = []
+        while self.values[self.index] in ('et', 'ou') and self.kinds[self.index] == 'word':
+            operators.append(self.values[self.index])
+            self.index += 1
+            operands.append(self.parse_dans())
+        return m_to_ast.make_node(operands=operands, operators=operators, type='boolean_expression')
+
+    def parse_dans(self):
+        expression = self.parse_comparaison()
+        value = self.values[self.index]
+        if value != 'dans' and (value != 'non' or self.values[self.index + 1] != 'dans'):
+            return expression
+        negative_form = value == 'non'
+        self.index += 2 if negative_form else 1
+        self.expect('(')
+        enumeration = self.parse_enumeration()
+        self.expect(')')
+        assert len(enumeration) == 1, enumeration
+        return m_to_ast.make_node(enumeration=enumeration[0], expression=expression,
+                                  negative_form=negative_form or None, type='dans')
+
+    def parse_comparaison(self):
+        left_operand = self.parse_sum_expression()
+        operator = self.values[self.index]
+        if operator not in comparison_operators or self.kinds[self.index] != 'operator':
+            return left_operand
+        self.index += 1
+        return m_to_ast.make_node(left_operand=left_operand, operator=operator,
+                                  right_operand=self.parse_sum_expression(), type='comparaison')
+
+    def parse_sum_expression(self):
+        operand = self.parse_product_expression()
+        if self.values[self.index] not in ('+', '-'):
+            return operand
+        positives = [operand]
+        negatives = []
+        while self.values[self.index] in ('+', '-') and self.kinds[self.index] == 'operator':
+            operator = self.values[self.index]
+            self.index += 1
+            (positives if operator == '+' else negatives).append(self.parse_product_expression())
+        # In the M language, the first operand is always positive.
+        operands = positives + [m_to_ast.make_node(operand=operand, type='negate') for operand in negatives]
+        return m_to_ast.make_node(operands=operands, type='sum')
+
+    def parse_product_expression(self):
+        operand = self.parse_factor()
+        if self.values[self.index] not in ('*', '/'):
+            return operand
+        products = [operand]
+        divisions = []
+        while self.values[self.index] in ('*', '/') and self.kinds[self.index] == 'operator':
+            operator = self.values[self.index]
+            self.index += 1
+            (products if operator == '*' else divisions).append(self.parse_factor())
+        # In the M language, the first operand is always multiplied, never divided.
+        operands = products + [m_to_ast.make_node(operand=operand, type='invert') for operand in divisions]
+        return m_to_ast.make_node(operands=operands, type='product')
+
+    def parse_factor(self):
+        sign = self.values[self.index]
+        if sign in ('+', '-') and self.kinds[self.index] == 'operator':
+            self.index += 1
+        else:
+            sign = None
+        result = self.parse_factor_alternatives()
+        if sign is None:
+            return result
+        if result['type'] in ('float', 'integer'):
+            result = result.copy()
+            if sign == '-':
+                result['value'] = -result['value']
+            return result
+        return m_to_ast.make_node(expression=result, operator=sign, type='unary')
+
+    def parse_factor_alternatives(self):
+        index = self.index
+        kind = self.kinds[index]
+        value = self.values[index]
+        if kind == 'word':
+            next_value = self.values[index + 1]
+            if value == 'pour':
+                result = self.attempt(self.parse_pour_factor)
+                if result is not None:
+                    return result
+            elif value == 'si':
+                result = self.attempt(self.parse_ternary_operator)
+                if result is not None:
+                    return result
+            if next_value == '(':
+                result = self.attempt(self.parse_function_call)
+                if result is not None:
+                    return result
+            elif next_value == '[':
+                result = self.attempt(self.parse_symbol_brackets)
+                if result is not None:
+                    return result
+            self.index += 1
+            # Some symbols start with a digit, only the symbols made of digits are integers.
+            if value.isdigit():
+                return make_leaf('integer', int(value))
+            return make_leaf('symbol', value)
+        elif kind == 'float':
+            self.index += 1
+            return make_leaf('float', float(value))
+        elif value == '(' and kind == 'operator':
+            self.index += 1
+            expression = self.parse_expression()
+            self.expect(')')
+            return expression
+        self.fail('factor')
+
+    def parse_pour_factor(self):
+        self.expect('pour')
+        return self.parse_loop_expression()
+
+    def parse_ternary_operator(self):
+        self.expect('si')
+        condition = self.parse_expression()
+        self.expect('alors')
+        value_if_true = self.parse_expression()
+        value_if_false = self.parse_expression() if self.accept('sinon') else None
+        self.expect('finsi')
+        return m_to_ast.make_node(condition=condition, type='ternary_operator', value_if_false=value_if_false,
+                                  value_if_true=value_if_true)
+
+    def parse_function_call(self):
+        name = self.expect_kind('word', 'symbol')
+        self.expect('(')
+        loop_expression = self.attempt(self.parse_loop_expression)
+        if loop_expression is not None:
+            arguments = [loop_expression]
+        else:
+            arguments = [self.parse_expression()]
+            while self.accept(','):
+                arguments.append(self.parse_expression())
+        self.expect(')')
+        return m_to_ast.make_node(arguments=arguments, name=name, type='function_call')
+
+    def parse_symbol_brackets(self):
+        # The index of a symbol followed by brackets is dropped by `MLanguageVisitor.visit_factor`.
+        symbol = make_leaf('symbol', self.expect_kind('word', 'symbol'))
+        self.parse_brackets()
+        return symbol
+
+    def parse_brackets(self):
+        self.expect('[')
+        index = self.expect_kind('word', 'symbol')
+        self.expect(']')
+        return index
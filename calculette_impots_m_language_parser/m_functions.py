@@ -0,0 +1,43 @@
+"""
+Functions of the M language, used by the code generated by `compile_ast`.
+
+Values are floats. Booleans are 1.0 or 0.0, and undefined values are 0.0.
+"""
+
+
+import math
+
+
+# Builtin functions of the M language
+
+def arr(x):
+    """Round to the nearest integer, halves away from zero."""
+    return float(math.floor(x + 0.5) if x >= 0 else -math.floor(0.5 - x))
+
+
+def inf(x):
+    """Round down to an integer."""
+    return float(math.floor(x))
+
+
+def null(x):
+    return 1.0 if x == 0 else 0.0
+
+
+def positif(x):
+    return 1.0 if x > 0 else 0.0
+
+
+def positif_ou_nul(x):
+    return 1.0 if x >= 0 else 0.0
+
+
+def present(x):
+    return 1.0 if x != 0 else 0.0
+
+
+# Functions of the simplified AST
+
+def invert(x):
+    """Inverse of `x`, a division by zero gives 0."""
+    return 1.0 / x if x != 0 else 0.0
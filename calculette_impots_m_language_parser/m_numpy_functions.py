@@ -0,0 +1,53 @@
+"""
+Functions of the M language on NumPy arrays, used by the code generated by the "numpy" backend of `compile_ast`.
+
+Each function computes the function of `m_functions` element-wise. Arguments may also be floats.
+"""
+
+
+import numpy as np
+
+
+# Builtin functions of the M language
+
+def arr(x):
+    """Round to the nearest integer, halves away from zero."""
+    return np.where(x >= 0, np.floor(x + 0.5), -np.floor(0.5 - x))
+
+
+def inf(x):
+    """Round down to an integer."""
+    return np.floor(x)
+
+
+def null(x):
+    return np.where(x == 0, 1.0, 0.0)
+
+
+def positif(x):
+    return np.where(x > 0, 1.0, 0.0)
+
+
+def positif_ou_nul(x):
+    return np.where(x >= 0, 1.0, 0.0)
+
+
+def present(x):
+    return np.where(x != 0, 1.0, 0.0)
+
+
+# Functions of the simplified AST
+
+def invert(x):
+    """Inverse of `x`, a division by zero gives 0."""
+    is_zero = np.equal(x, 0)
+    return np.where(is_zero, 0.0, 1.0 / np.where(is_zero, 1.0, x))
+
+
+# Helpers
+
+def column(value, nb_rows):
+    """Return `value` as an array of `nb_rows` floats: formulas which do not depend on the inputs are floats."""
+    if np.ndim(value) == 0:
+        return np.full(nb_rows, value, dtype=float)
+    return value
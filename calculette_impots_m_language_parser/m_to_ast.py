@@ -5,42 +5,255 @@ Convert M language source code to a JSON AST. All the information is kept. Loops
 
 
 from collections import OrderedDict
+import bisect
+import hashlib
+import itertools
 import logging
 import os
-import sys
+import pickle
 import re
 
-from arpeggio import PTNodeVisitor, visit_parse_tree
+import arpeggio
+from arpeggio import NoMatch, PTNodeVisitor, visit_parse_tree
 from arpeggio.cleanpeg import ParserPEG
 from toolz import concatv, pluck
 
-from calculette_impots_m_language_parser import json_dump
+from calculette_impots_m_language_parser import instrumentation, json_dump, m_fast_parser
 
 
 # Globals
 
 debug = False
 
-log = logging.getLogger()
-logging.basicConfig(level=logging.DEBUG if debug else logging.WARNING, stream=sys.stdout)
+log = logging.getLogger(__name__)
 
 script_dir_path = os.path.dirname(os.path.abspath(__file__))
 m_grammar_file_path = os.path.join(script_dir_path, 'm_language.cleanpeg')
-with open(m_grammar_file_path) as m_grammar_file:
-    m_grammar = m_grammar_file.read()
 root_rule = 'm_source_file'
-m_parser = ParserPEG(m_grammar, root_rule, debug=debug, reduce_tree=False)
-log.debug('M language clean-PEG grammar was parsed with success.')
+m_parser = None  # Built on first use by get_m_parser.
+# Parsers of the M source code: Arpeggio with the grammar file, or the faster parser of `m_fast_parser` which gives the
+# same AST.
+backends = ['arpeggio', 'fast']
+# Memoization policy of the parser, see `set_memoization`: False, True for every rule or a collection of rule names.
+memoization = False
+# Cached result of a memoized rule which did not match, see `memoize_rule`.
+failure_marker = object()
+
+# Matches the beginning of a line which starts a top-level declaration: regle, verif, application, enchaineur,
+# sortie, or a variable or erreur declaration ("NAME : ..."). Lines such as "application : batch ;" belong to a regle.
+declaration_start_regex = re.compile(
+    r'(regle|verif)\b|sortie\s*\(|(application|enchaineur)\s+\w|(?!(application|enchaineur)\b)\w+\s*:'
+    )
 
 
 # Public functions
 
-def parse_m_file(source_code):
-    '''Parse a source code in language M and returns its Abstract Syntax Tree (AST)'''
+def get_m_parser(parser_file_path=None):
+    '''
+    Return the M language parser, building it on first use.
+
+    When `parser_file_path` is given, the compiled parser is loaded from this file instead of compiling the grammar,
+    or saved to it once compiled. A file saved for another grammar or another version of Arpeggio is ignored.
+    '''
+    global m_parser
+    if m_parser is None:
+        with open(m_grammar_file_path) as m_grammar_file:
+            m_grammar = m_grammar_file.read()
+        if parser_file_path is not None:
+            m_parser = load_m_parser(parser_file_path, m_grammar)
+        if m_parser is None:
+            m_parser = build_m_parser(m_grammar)
+            if parser_file_path is not None:
+                save_m_parser(m_parser, parser_file_path, m_grammar)
+        # The memoized rules cannot be saved, so the policy is applied after saving the parser.
+        apply_memoization(m_parser, memoization)
+    return m_parser
+
+
+def build_m_parser(m_grammar=None):
+    '''Compile the M grammar into a new parser, without memoization.'''
+    if m_grammar is None:
+        with open(m_grammar_file_path) as m_grammar_file:
+            m_grammar = m_grammar_file.read()
+    parser = ParserPEG(m_grammar, root_rule, debug=debug, reduce_tree=False)
+    log.debug('M language clean-PEG grammar was parsed with success.')
+    return parser
+
+
+def set_memoization(policy):
+    '''
+    Set the memoization policy of the M parser: False, True to memoize every rule (Arpeggio packrat parsing) or a
+    collection of rule names to memoize only these rules. Memoizing a rule avoids parsing it again at the same
+    position after a backtrack, at the cost of keeping its results until the end of the parsing. See the script
+    `profile_grammar.py` to choose the rules.
+    '''
+    global memoization
+    memoization = policy
+    if m_parser is not None:
+        apply_memoization(m_parser, policy)
+
+
+def parse_memoization_policy(text):
+    '''Convert the value of a command line option to a memoization policy: "none", "all" or comma-separated rules.'''
+    if text == 'none':
+        return False
+    if text == 'all':
+        return True
+    return [rule_name.strip() for rule_name in text.split(',') if rule_name.strip()]
+
+
+def apply_memoization(parser, policy):
+    '''Apply a memoization policy (see `set_memoization`) to a parser built by `build_m_parser`.'''
+    expression_by_rule_name = get_rule_expressions(parser)
+    if policy is True or policy is False:
+        rule_names = ()
+    else:
+        rule_names = policy
+        unknown_rule_names = set(rule_names) - set(expression_by_rule_name)
+        if unknown_rule_names:
+            raise ValueError('Unknown grammar rules: {}'.format(', '.join(sorted(unknown_rule_names))))
+    parser.memoization = policy is True
+    for expression in expression_by_rule_name.values():
+        expression.__dict__.pop('parse', None)
+    parser.__dict__.pop('parse', None)
+    caches = [memoize_rule(expression_by_rule_name[rule_name]) for rule_name in rule_names]
+    if caches:
+        unmemoized_parse = parser.parse
+
+        def parse(*args, **kwargs):
+            # Like Arpeggio's `_clear_caches`, the results of a previous input, or of the same input parsed
+            # again, are never reused.
+            for cache in caches:
+                cache.clear()
+            try:
+                return unmemoized_parse(*args, **kwargs)
+            finally:
+                for cache in caches:
+                    cache.clear()
+
+        parser.parse = parse
+
+
+def get_rule_expressions(parser):
+    '''Return the parsing expressions of the rules of a parser, by rule name.'''
+    expression_by_rule_name = OrderedDict()
+    expressions = [parser.parser_model]
+    seen_ids = set()
+    while expressions:
+        expression = expressions.pop()
+        if id(expression) in seen_ids:
+            continue
+        seen_ids.add(id(expression))
+        if expression.root:
+            expression_by_rule_name[expression.rule_name] = expression
+        expressions.extend(reversed(expression.nodes))
+    return expression_by_rule_name
+
+
+def parse_m_file(source_code, linecol=True, serializer=json_dump, backend='arpeggio'):
+    '''
+    Parse a source code in language M and returns its Abstract Syntax Tree (AST), serialized by `serializer` (see the
+    `serialization` module).
+
+    With `linecol=False`, the nodes have no "linecol" key and the positions are not computed at all. With
+    `backend='fast'`, the source code is parsed by `m_fast_parser` instead of Arpeggio.
+    '''
+    check_backend(backend)
+    report = instrumentation.report
     source_code = preprocess(source_code)
-    parse_tree = m_parser.parse(source_code)
-    result = visit_parse_tree(parse_tree, MLanguageVisitor(debug=debug))
-    return json_dump.dumps(result)
+    line_index = LineIndex(source_code) if linecol else None
+    if backend == 'fast':
+        with report.stage('m_to_ast.fast_parse'):
+            result = m_fast_parser.parse(source_code, line_index)
+    else:
+        with report.stage('m_to_ast.parse'):
+            parse_tree = get_m_parser().parse(source_code)
+        with report.stage('m_to_ast.visit'):
+            result = visit_parse_tree(parse_tree, MLanguageVisitor(line_index=line_index, linecol=linecol, debug=debug))
+    with report.stage('m_to_ast.serialize'):
+        data = serializer.dumps(result)
+    report.count('m_to_ast.bytes_in', instrumentation.byte_size(source_code))
+    report.count('m_to_ast.bytes_out', instrumentation.byte_size(data))
+    return data
+
+
+def parse_m_file_by_declaration(source_code, executor=None, linecol=True, serializer=json_dump, backend='arpeggio'):
+    '''
+    Parse a source code in language M declaration by declaration, so that a syntax error only drops the declaration
+    containing it.
+
+    Return a tuple (AST, errors) where errors lists the declarations which could not be parsed. When a process pool
+    executor is given, the declarations are parsed in parallel with `executor.map`.
+    '''
+    check_backend(backend)
+    report = instrumentation.report
+    source_code = preprocess(source_code)
+    line_indexes, chunks = zip(*split_declarations(source_code))
+    map_ = map if executor is None else executor.map
+    nodes = []
+    errors = []
+    with report.stage('m_to_ast.parse_by_declaration'):
+        for chunk_nodes, error in map_(parse_declaration, line_indexes, chunks, itertools.repeat(linecol),
+                                      itertools.repeat(backend)):
+            nodes.extend(chunk_nodes)
+            if error is not None:
+                errors.append(error)
+    with report.stage('m_to_ast.serialize'):
+        data = serializer.dumps(nodes)
+    report.count('m_to_ast.bytes_in', instrumentation.byte_size(source_code))
+    report.count('m_to_ast.bytes_out', instrumentation.byte_size(data))
+    report.count('m_to_ast.declaration_errors', len(errors))
+    return data, errors
+
+
+def parse_declaration(line_index, chunk, linecol=True, backend='arpeggio'):
+    '''
+    Parse a chunk of a preprocessed M source code starting at line `line_index` (0-based) of its file.
+
+    Return a tuple (nodes, error) where error is None when the chunk is valid. Line numbers are the ones of the file.
+    '''
+    chunk_line_index = LineIndex(chunk, first_line_index=line_index) if linecol else None
+    try:
+        if backend == 'fast':
+            return m_fast_parser.parse(chunk, chunk_line_index), None
+        parse_tree = get_m_parser().parse(chunk)
+    except (NoMatch, m_fast_parser.ParseError) as exc:
+        error = OrderedDict([
+            ('first_line', line_index + 1),
+            ('line', line_index + exc.line),
+            ('column', exc.col),
+            ('message', str(exc)),
+            ])
+        return [], error
+    visitor = MLanguageVisitor(line_index=chunk_line_index, linecol=linecol, debug=debug)
+    return visit_parse_tree(parse_tree, visitor), None
+
+
+def split_declarations(source_code):
+    '''
+    Split a preprocessed M source code before each top-level declaration.
+
+    Yield tuples (line_index, chunk) where line_index is the 0-based index of the first line of the chunk. Comments
+    before the first declaration belong to the first chunk, and a declaration only starts after a line ending with ";".
+    '''
+    lines = source_code.split('\n')
+    chunk_start_index = 0
+    seen_declaration = False
+    is_after_semicolon = True
+    in_string = False
+    for line_index, line in enumerate(lines):
+        stripped_line = line.strip()
+        if not stripped_line or stripped_line.startswith('#'):
+            continue
+        if not in_string and is_after_semicolon and declaration_start_regex.match(stripped_line):
+            if seen_declaration:
+                yield chunk_start_index, '\n'.join(lines[chunk_start_index:line_index])
+                chunk_start_index = line_index
+            seen_declaration = True
+        if stripped_line.count('"') % 2 == 1:
+            in_string = not in_string
+        is_after_semicolon = stripped_line.endswith(';')
+    yield chunk_start_index, '\n'.join(lines[chunk_start_index:])
 
 
 # M CONSTANTS
@@ -53,6 +266,68 @@ M_DIVISION = '/'
 
 # Helpers
 
+def check_backend(backend):
+    if backend not in backends:
+        raise ValueError('Unknown parser backend: {}'.format(backend))
+
+
+def get_parser_file_signature(m_grammar):
+    """Identify the grammar and the Arpeggio version a saved parser was compiled with."""
+    return (hashlib.sha256(m_grammar.encode('utf-8')).hexdigest(), arpeggio.__version__)
+
+
+def memoize_rule(expression):
+    '''
+    Cache the results of the parsing expression of a rule by position, like Arpeggio does for every rule when
+    memoization is enabled. Return the cache, which `apply_memoization` empties at the start and end of every parse.
+
+    A failure is cached as `failure_marker` and raises a new NoMatch, with the rules and the position of the furthest
+    failure of the parser, as Arpeggio raises `parser.nm`.
+    '''
+    parse = expression.parse
+    cache = {}
+
+    def memoized_parse(parser):
+        position = parser.position
+        cached = cache.get(position)
+        if cached is None:
+            try:
+                result = parse(parser)
+            except NoMatch:
+                cache[position] = (failure_marker, position)
+                raise
+            cache[position] = (result, parser.position)
+            return result
+        result, parser.position = cached
+        if result is failure_marker:
+            parser.nm = NoMatch(list(parser.nm.rules), parser.nm.position, parser)
+            raise parser.nm
+        return result
+
+    # Arpeggio calls the `parse` method of the expressions, an instance attribute replaces it.
+    expression.parse = memoized_parse
+    return cache
+
+
+def load_m_parser(parser_file_path, m_grammar):
+    try:
+        with open(parser_file_path, 'rb') as parser_file:
+            signature, parser = pickle.load(parser_file)
+    except FileNotFoundError:
+        return None
+    if signature != get_parser_file_signature(m_grammar):
+        log.debug('Ignoring the parser saved in %s for another grammar or Arpeggio version.', parser_file_path)
+        return None
+    return parser
+
+
+def save_m_parser(parser, parser_file_path, m_grammar):
+    temporary_file_path = '{}.{}.tmp'.format(parser_file_path, os.getpid())
+    with open(temporary_file_path, 'wb') as parser_file:
+        pickle.dump((get_parser_file_signature(m_grammar), parser), parser_file)
+    os.replace(temporary_file_path, parser_file_path)
+
+
 def preprocess(source_code):
     lines = source_code.split('\n')
 
@@ -112,18 +387,9 @@ def find_one_or_none(nodes, type):
     return results[0] if results else None
 
 
-def get_linecol(node):
-    global m_parser
-    return (m_parser.pos_to_linecol(node.position), m_parser.pos_to_linecol(node[-1].position))
-
-
 def make_node(node=None, linecol=None, type=None, **kwargs):
     clean_node = without_empty_values(
-        linecol=(
-            get_linecol(node)
-            if node is not None and linecol
-            else None
-            ),
+        linecol=linecol,
         type=(
             node.rule_name
             if type is None
@@ -131,6 +397,8 @@ def make_node(node=None, linecol=None, type=None, **kwargs):
             ),
         **kwargs
         )
+    if instrumentation.report.enabled:
+        instrumentation.report.count('m_to_ast.nodes.' + clean_node['type'])
     return pretty_ordered_keys(clean_node)
 
 
@@ -177,6 +445,25 @@ def without_empty_values(**kwargs):
         }
 
 
+# Positions
+
+
+class LineIndex(object):
+    """
+    Start offsets of the lines of a source code, computed once per parse, to convert the positions of the parse tree
+    nodes to (line, column) tuples with a binary search. Gives the same results as `Parser.pos_to_linecol` of Arpeggio.
+    """
+
+    def __init__(self, source_code, first_line_index=0):
+        self.first_line_index = first_line_index
+        lines = source_code.split('\n')
+        self.line_starts = [0] + list(itertools.accumulate(len(line) + 1 for line in lines[:-1]))
+
+    def linecol(self, position):
+        line = bisect.bisect_right(self.line_starts, position)
+        return self.first_line_index + line, position - self.line_starts[line - 1] + 1
+
+
 # PEG parser visitor
 
 
@@ -186,8 +473,21 @@ class MLanguageVisitor(PTNodeVisitor):
 
     Useful line to debug visitor in ipython:
     print(node); node; len(node); print(json.dumps(children, indent=2)); len(children)
+
+    The "linecol" keys are computed with `line_index`, which is required unless `linecol=False` omits them.
     """
 
+    def __init__(self, line_index=None, linecol=True, **kwargs):
+        super(MLanguageVisitor, self).__init__(**kwargs)
+        if linecol and line_index is None:
+            raise ValueError('A line_index is required to compute the "linecol" keys, unless linecol=False')
+        self.line_index = line_index if linecol else None
+
+    def get_linecol(self, node):
+        if self.line_index is None:
+            return None
+        return (self.line_index.linecol(node.position), self.line_index.linecol(node[-1].position))
+
     def visit__default__(self, node, children):
         """Ensure all grammar rules are implemented in visitor class."""
         if node.rule_name and node.rule_name != 'EOF':
@@ -197,7 +497,7 @@ class MLanguageVisitor(PTNodeVisitor):
     def visit_application(self, node, children):
         assert len(children) == 1, children
         return make_node(
-            linecol=True,
+            linecol=self.get_linecol(node),
             name=children[0]['value'],
             node=node,
             )
@@ -251,7 +551,7 @@ class MLanguageVisitor(PTNodeVisitor):
         assert len(children) == 2, children
         return make_node(
             applications=children[1]['names'],
-            linecol=True,
+            linecol=self.get_linecol(node),
             name=children[0]['value'],
             node=node,
             )
@@ -295,7 +595,7 @@ class MLanguageVisitor(PTNodeVisitor):
             codes=codes,
             description=description,
             erreur_type=erreur_type,
-            linecol=True,
+            linecol=self.get_linecol(node),
             name=children[0]['value'],
             node=node,
             )
@@ -356,7 +656,7 @@ class MLanguageVisitor(PTNodeVisitor):
         return make_node(
             expression=children[-1],
             index=brackets['index'] if brackets is not None else None,
-            linecol=True,
+            linecol=self.get_linecol(node),
             name=children[0]['value'],
             node=node,
             )
@@ -478,7 +778,7 @@ class MLanguageVisitor(PTNodeVisitor):
             applications=applications,
             enchaineur=enchaineur_reference['value'] if enchaineur_reference is not None else None,
             formulas=all_formulas,
-            linecol=True,
+            linecol=self.get_linecol(node),
             name=name,
             node=node,
             tags=tags,
@@ -564,7 +864,7 @@ class MLanguageVisitor(PTNodeVisitor):
         return make_node(
             base=('base' in subtypes) or None,
             description=description,
-            linecol=True,
+            linecol=self.get_linecol(node),
             name=children[0]['value'],
             node=node,
             restituee=('restituee' in subtypes) or None,
@@ -588,7 +888,7 @@ class MLanguageVisitor(PTNodeVisitor):
     def visit_variable_const(self, node, children):
         assert len(children) == 2, children
         return make_node(
-            linecol=True,
+            linecol=self.get_linecol(node),
             name=children[0]['value'],
             node=node,
             value=children[1]['value'],
@@ -610,7 +910,7 @@ class MLanguageVisitor(PTNodeVisitor):
             alias=None if alias is None else alias['value'],
             attributes=attributes,
             description=description,
-            linecol=True,
+            linecol=self.get_linecol(node),
             name=children[0]['value'],
             node=node,
             restituee=(restituee is None) or None,
@@ -653,7 +953,7 @@ class MLanguageVisitor(PTNodeVisitor):
         return make_node(
             applications=applications,
             conditions=conditions,
-            linecol=True,
+            linecol=self.get_linecol(node),
             name=name,
             node=node,
             tags=tags,
@@ -0,0 +1,135 @@
+"""
+Differences between the simplified ASTs (see `simplify_ast`) of two millésimes.
+
+Each formula is hashed from its name and its expression, with its lazy loops expanded and serialized as canonical
+JSON, so that the formulas of two millésimes are compared without keeping both ASTs in memory. The diff lists the
+added, removed and changed formulas, constants and input variables.
+
+The symbols whose definition changed, and the formulas which depend on them directly or not, are the only ones for
+which derived artifacts must be rebuilt: see `affected_formulas` and `dependency_index.reuse`.
+"""
+
+
+import collections
+import hashlib
+import json
+
+from calculette_impots_m_language_parser import serialization, simplify_ast
+
+
+# Globals
+
+MillesimeDiff = collections.namedtuple('MillesimeDiff', [
+    'added_formulas',
+    'removed_formulas',
+    'changed_formulas',
+    'added_constants',
+    'removed_constants',
+    'changed_constants',
+    'added_inputs',
+    'removed_inputs',
+    'changed_inputs',
+    ])
+
+# The hashes of a millésime: the hash of each formula, the value of each constant and the alias of each input variable.
+MillesimeHashes = collections.namedtuple('MillesimeHashes', ['formulas', 'constants', 'inputs'])
+
+
+# Public functions
+
+def hash_formula(name, expression):
+    """Return the hexadecimal hash of a formula, with its loops expanded if it is lazy."""
+    expression = simplify_ast.expand_loops(expression)
+    canonical_json = json.dumps([name, expression], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canonical_json.encode('utf-8')).hexdigest()
+
+
+def hash_formulas(formulas):
+    """Return the hashes of the formulas of a simplified AST by name. The `map` entries of lazy loops are expanded."""
+    return {
+        name: hash_formula(name, expression)
+        for name, expression in simplify_ast.expand_formula_maps(formulas).items()
+        }
+
+
+def load_hashes(source_dir):
+    """Return the `MillesimeHashes` of a 2_simplified_ast directory."""
+    return MillesimeHashes(
+        formulas=hash_formulas(serialization.load(source_dir, 'formulas')),
+        constants=serialization.load(source_dir, 'constants'),
+        inputs={
+            input_variable['name']: input_variable['alias']
+            for input_variable in serialization.load(source_dir, 'input_variables')
+            },
+        )
+
+
+def diff_hashes(old_hashes, new_hashes):
+    """Return the `MillesimeDiff` from the millésime of `old_hashes` to the one of `new_hashes`."""
+    return MillesimeDiff(*(
+        names
+        for old_dict, new_dict in zip(old_hashes, new_hashes)
+        for names in diff_dicts(old_dict, new_dict)
+        ))
+
+
+def diff_millesimes(old_dir, new_dir):
+    """Return the `MillesimeDiff` between two 2_simplified_ast directories."""
+    return diff_hashes(load_hashes(old_dir), load_hashes(new_dir))
+
+
+def changed_symbols(old_hashes, new_hashes):
+    """
+    Return the set of the symbols whose definition differs between two millésimes: the added, removed and changed
+    formulas and constants, and the names and aliases of the input variables which are only in one of them.
+    """
+    old_definitions = get_definitions(old_hashes)
+    new_definitions = get_definitions(new_hashes)
+    return {
+        name
+        for name in set(old_definitions) | set(new_definitions)
+        if old_definitions.get(name) != new_definitions.get(name)
+        }
+
+
+def affected_formulas(symbols, children_dict):
+    """
+    Return the set of the formulas of `children_dict` which are in `symbols` or depend on one of them, directly or
+    not. These are the formulas whose derived artifacts must be rebuilt when `symbols` changed.
+    """
+    parents_by_symbol = collections.defaultdict(list)
+    for parent, children in children_dict.items():
+        for child in children:
+            parents_by_symbol[child].append(parent)
+
+    affected = {name for name in symbols if name in children_dict}
+    to_visit = list(symbols)
+    while to_visit:
+        for parent in parents_by_symbol.get(to_visit.pop(), ()):
+            if parent not in affected:
+                affected.add(parent)
+                to_visit.append(parent)
+    return affected
+
+
+# Helpers
+
+def diff_dicts(old_dict, new_dict):
+    """Return the sorted lists of the added, removed and changed keys."""
+    return (
+        sorted(set(new_dict) - set(old_dict)),
+        sorted(set(old_dict) - set(new_dict)),
+        sorted(name for name in set(old_dict) & set(new_dict) if old_dict[name] != new_dict[name]),
+        )
+
+
+def get_definitions(hashes):
+    """Return a value by symbol which changes when the meaning of the symbol in the formulas changes."""
+    definitions = {}
+    for name, alias in hashes.inputs.items():
+        definitions[name] = definitions[alias] = 'input'
+    for name, value in hashes.constants.items():
+        definitions[name] = 'constant:{!r}'.format(float(value))
+    for name, formula_hash in hashes.formulas.items():
+        definitions[name] = 'formula:' + formula_hash
+    return definitions
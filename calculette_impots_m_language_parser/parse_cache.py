@@ -0,0 +1,132 @@
+"""
+On-disk cache of the ASTs produced by `m_to_ast.parse_m_file`.
+
+Entries are keyed by a hash of the M source code, of the parser backend, of the grammar and of the source code of
+the modules which shape the cached AST, so unchanged files are not parsed again. The size of the cache is bounded by
+evicting the least recently used entries.
+"""
+
+
+import hashlib
+import inspect
+import os
+import tempfile
+
+import arpeggio
+
+from calculette_impots_m_language_parser import binary_dump, json_dump, m_fast_parser, m_to_ast, serialization
+
+
+# Globals
+
+default_max_size = 512 * 1024 * 1024  # bytes
+
+# Modules whose source code changes the cached ASTs.
+context_modules = [m_to_ast, m_fast_parser, json_dump, binary_dump]
+
+context_digest_by_backend = {}
+
+
+# Cache
+
+class ParseCache(object):
+    """
+    Directory of ASTs named after the hash of their source code. Counts hits and misses.
+
+    The ASTs are stored as serialized by `serializer` (see the `serialization` module), each format in its own files.
+    The ASTs of each parser `backend` (see `m_to_ast.backends`) have their own entries.
+    """
+
+    def __init__(self, cache_dir, max_size=default_max_size, serializer=json_dump, backend='arpeggio'):
+        m_to_ast.check_backend(backend)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.serializer = serializer
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_path(self, source_code):
+        key = hashlib.sha256(get_context_digest(self.backend) + source_code.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key + self.serializer.extension)
+
+    def get(self, source_code):
+        """Return the cached AST of the source code, or None."""
+        entry_path = self.entry_path(source_code)
+        try:
+            with open(entry_path, 'rb' if self.serializer.is_binary else 'r') as f:
+                ast = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # The modification time is used as the last access time by `evict`.
+        os.utime(entry_path)
+        return ast
+
+    def set(self, source_code, ast):
+        write_atomically(self.entry_path(source_code), ast, self.serializer)
+
+    def parse_m_file(self, source_code):
+        '''Return the AST of the source code from the cache, or parse it and store it.'''
+        ast = self.get(source_code)
+        if ast is None:
+            ast = m_to_ast.parse_m_file(source_code, serializer=self.serializer, backend=self.backend)
+            self.set(source_code, ast)
+        return ast
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in `max_size`. Return the number of removed
+        entries."""
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if serialization.get_serializer_from_path(filename) is None:
+                continue
+            entry_path = os.path.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(entry_path)
+            except FileNotFoundError:
+                # Removed by a concurrent process.
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+
+        total_size = sum(size for _, size, _ in entries)
+        nb_evicted = 0
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+            nb_evicted += 1
+        return nb_evicted
+
+
+# Helpers
+
+def get_context_digest(backend='arpeggio'):
+    """
+    Digest of everything but the source code which changes the AST: the parser backend, the grammar, the source code of
+    `context_modules` and the Arpeggio version.
+    """
+    context_digest = context_digest_by_backend.get(backend)
+    if context_digest is None:
+        context_hash = hashlib.sha256(backend.encode('utf-8'))
+        with open(m_to_ast.m_grammar_file_path, 'rb') as m_grammar_file:
+            context_hash.update(m_grammar_file.read())
+        for module in context_modules:
+            context_hash.update(inspect.getsource(module).encode('utf-8'))
+        context_hash.update(arpeggio.__version__.encode('utf-8'))
+        context_digest = context_digest_by_backend[backend] = context_hash.digest()
+    return context_digest
+
+
+def write_atomically(file_path, data, serializer):
+    """Write a file so that concurrent readers never see it partially written."""
+    fd, temporary_file_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix='.tmp')
+    os.close(fd)
+    serialization.write_data(temporary_file_path, data, serializer)
+    os.replace(temporary_file_path, file_path)
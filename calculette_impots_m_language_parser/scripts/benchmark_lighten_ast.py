@@ -0,0 +1,156 @@
+"""
+Compare the dependency slicing and scheduling of `lighten_ast` with its former list-based and recursive implementation
+on every millésime, and check that both keep the same formulas. See `simplify_ast.simplified_ast_dir` for the
+simplified AST used.
+"""
+
+
+import argparse
+import contextlib
+import inspect
+import io
+import os
+import time
+
+import calculette_impots_m_language_parser
+from calculette_impots_m_language_parser import lighten_ast, simplify_ast
+
+
+package_base_dir = os.path.dirname(os.path.dirname(inspect.getfile(calculette_impots_m_language_parser)))
+default_json_dir = os.path.join(package_base_dir, 'json')
+
+
+# Former implementation, with membership tests on lists
+
+def legacy_find_undefined_names(formulas, constants, inputs_list, children_dict):
+    unknown_names = set()
+    for k, v in children_dict.items():
+        for var in v:
+            if (var not in formulas) and (var not in constants) and (var not in inputs_list):
+                unknown_names.add(var)
+    return unknown_names
+
+
+def legacy_get_useful_nodes(roots, formulas, constants, inputs_list, children_dict, unknown_names):
+    to_inspect = [root for root in roots if root in children_dict]
+
+    useful_formulas = []
+    useful_constants = []
+    useful_inputs = []
+    useful_unknown = []
+
+    while to_inspect:
+        node = to_inspect.pop()
+
+        if node in useful_formulas:
+            continue
+
+        for child in children_dict[node]:
+            if child in formulas:
+                if (child not in useful_formulas) and (child not in to_inspect):
+                    to_inspect.append(child)
+            elif child in constants:
+                if child not in useful_constants:
+                    useful_constants.append(child)
+            elif child in inputs_list:
+                if child not in useful_inputs:
+                    useful_inputs.append(child)
+            elif child in unknown_names:
+                if child not in useful_unknown:
+                    useful_unknown.append(child)
+            else:
+                raise Exception('Unknown variable category : %s for parent %s.'%(child, node))
+
+        useful_formulas.append(node)
+
+    return useful_formulas, useful_constants, useful_inputs, useful_unknown
+
+
+def legacy_compute_non_recursive_computing_order(children_light):
+    def find_order(node):
+        for child in children_light[node]:
+            if child not in computing_order:
+                find_order(child)
+
+        computing_order.append(node)
+
+    computing_order = []
+    for root in lighten_ast.roots:
+        if root in children_light:
+            find_order(root)
+
+    return computing_order
+
+
+# Benchmark
+
+def slice_dependencies(implementation, formulas, constants, inputs_list, children_dict):
+    unknown_names = implementation.find_undefined_names(formulas, constants, inputs_list, children_dict)
+    useful_nodes = implementation.get_useful_nodes(
+        lighten_ast.roots, formulas, constants, inputs_list, children_dict, unknown_names)
+    formulas_light = {name: formulas[name] for name in useful_nodes[0]}
+    children_light = lighten_ast.compute_children_light(children_dict, formulas_light)
+    computing_order = implementation.compute_computing_order(children_light)
+    return useful_nodes, computing_order
+
+
+class LegacyImplementation(object):
+    find_undefined_names = staticmethod(legacy_find_undefined_names)
+    get_useful_nodes = staticmethod(legacy_get_useful_nodes)
+    compute_computing_order = staticmethod(legacy_compute_non_recursive_computing_order)
+
+
+class CurrentImplementation(object):
+    find_undefined_names = staticmethod(lighten_ast.find_undefined_names)
+    get_useful_nodes = staticmethod(lighten_ast.get_useful_nodes)
+
+    @staticmethod
+    def compute_computing_order(children_light):
+        return [formula for level in lighten_ast.compute_computing_levels(children_light) for formula in level]
+
+
+def best_time(function, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+    return min(durations), result
+
+
+def load_simplified_ast(millesime_dir):
+    with contextlib.redirect_stdout(io.StringIO()), \
+            simplify_ast.simplified_ast_dir(millesime_dir) as source_dir:
+        return lighten_ast.load_data(source_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--json-dir', default=default_json_dir, help='directory containing one directory per millésime')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs, the best one is kept')
+    args = parser.parse_args()
+
+    print('{:<20} {:>9} {:>10} {:>10} {:>8}'.format('millésime', 'formulas', 'legacy', 'current', 'speedup'))
+    for millesime_name in sorted(os.listdir(args.json_dir)):
+        formulas, constants, input_variables, inputs_list = load_simplified_ast(
+            os.path.join(args.json_dir, millesime_name))
+        children_dict = {name: lighten_ast.get_children(formula) for name, formula in formulas.items()}
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            legacy_duration, legacy_result = best_time(
+                lambda: slice_dependencies(LegacyImplementation, formulas, constants, inputs_list, children_dict),
+                args.repeat)
+            current_duration, current_result = best_time(
+                lambda: slice_dependencies(CurrentImplementation, formulas, constants, inputs_list, children_dict),
+                args.repeat)
+        # The former computing order may contain a root twice, and sorts the formulas differently.
+        assert current_result[0] == legacy_result[0], 'Different slices for {}'.format(millesime_name)
+        assert set(current_result[1]) == set(legacy_result[1]), 'Different formulas for {}'.format(millesime_name)
+
+        print('{:<20} {:>9} {:>8.1f}ms {:>8.1f}ms {:>7.1f}x'.format(
+            millesime_name, len(formulas), legacy_duration * 1000, current_duration * 1000,
+            legacy_duration / current_duration))
+
+
+if __name__ == '__main__':
+    main()
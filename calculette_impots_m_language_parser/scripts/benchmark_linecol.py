@@ -0,0 +1,100 @@
+"""
+Compare the cost of the "linecol" positions when visiting the parse tree of M files:
+* arpeggio: positions computed with `Parser.pos_to_linecol` (former implementation)
+* line_index: positions computed with `m_to_ast.LineIndex`, including its construction
+* none: positions not computed (`parse_m_file(source_code, linecol=False)`)
+"""
+
+
+import argparse
+import gc
+import os
+import time
+
+from arpeggio import visit_parse_tree
+
+from calculette_impots_m_language_parser import m_to_ast
+
+
+script_dir_path = os.path.dirname(os.path.abspath(__file__))
+default_path = os.path.join(os.path.dirname(script_dir_path), 'tests', 'valid_formulas.m')
+
+
+class ArpeggioLinecolVisitor(m_to_ast.MLanguageVisitor):
+    def __init__(self, parser, **kwargs):
+        super(ArpeggioLinecolVisitor, self).__init__(**kwargs)
+        self.parser = parser
+
+    def get_linecol(self, node):
+        return (self.parser.pos_to_linecol(node.position), self.parser.pos_to_linecol(node[-1].position))
+
+
+def iter_m_file_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, _, filenames in sorted(os.walk(path)):
+                for filename in sorted(filenames):
+                    if filename.endswith('.m'):
+                        yield os.path.join(dir_path, filename)
+        else:
+            yield path
+
+
+def best_time(function, repeat):
+    """Like `timeit`, disable the garbage collector during the runs."""
+    durations = []
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return min(durations)
+
+
+def benchmark_file(m_file_path, repeat):
+    with open(m_file_path) as m_file:
+        source_code = m_to_ast.preprocess(m_file.read())
+    parser = m_to_ast.get_m_parser()
+    parse_tree = parser.parse(source_code)
+
+    def visit_with_arpeggio():
+        # Arpeggio caches the line ends of the last parsed input: reset them to pay for their computation each time.
+        parser.line_ends = []
+        visit_parse_tree(parse_tree, ArpeggioLinecolVisitor(parser))
+
+    def visit_with_line_index():
+        visit_parse_tree(parse_tree, m_to_ast.MLanguageVisitor(line_index=m_to_ast.LineIndex(source_code)))
+
+    def visit_without_linecol():
+        visit_parse_tree(parse_tree, m_to_ast.MLanguageVisitor(linecol=False))
+
+    return (
+        best_time(visit_with_arpeggio, repeat),
+        best_time(visit_with_line_index, repeat),
+        best_time(visit_without_linecol, repeat),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', default=[default_path],
+                        help='M files, or directories searched recursively for .m files')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs, the best one is kept')
+    args = parser.parse_args()
+
+    totals = [0, 0, 0]
+    print('{:<50} {:>10} {:>10} {:>10}'.format('file', 'arpeggio', 'line_index', 'none'))
+    for m_file_path in iter_m_file_paths(args.paths):
+        durations = benchmark_file(m_file_path, args.repeat)
+        totals = [total + duration for total, duration in zip(totals, durations)]
+        print('{:<50} {:>9.1f}ms {:>9.1f}ms {:>9.1f}ms'.format(
+            m_file_path[-50:], *(duration * 1000 for duration in durations)))
+    print('{:<50} {:>9.1f}ms {:>9.1f}ms {:>9.1f}ms'.format('TOTAL', *(total * 1000 for total in totals)))
+
+
+if __name__ == '__main__':
+    main()
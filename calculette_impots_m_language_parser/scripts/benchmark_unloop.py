@@ -0,0 +1,137 @@
+"""
+Compare the ways of unlooping the largest loops (`somme` expressions and `pour` formulas) of the 1_ast_by_file
+directories of the millésimes:
+* legacy: a full copy of the node for each combination of the loop variables, then `update_symbols` (former
+  implementation)
+* views: unlooped nodes sharing the subtrees without loop variables (`UnloopTemplate.iter_unlooped_views`)
+* names: symbol names substituted without building nodes (`UnloopTemplate.iter_substituted_names`), only for the
+  loops without nested loops
+
+Each implementation collects the symbol names of the unlooped nodes, and the results are checked to be equal.
+"""
+
+
+import argparse
+import gc
+import inspect
+import os
+import time
+
+import calculette_impots_m_language_parser
+from calculette_impots_m_language_parser import serialization, unloop_helpers
+
+
+package_base_dir = os.path.dirname(os.path.dirname(inspect.getfile(calculette_impots_m_language_parser)))
+default_json_dir = os.path.join(package_base_dir, 'json')
+
+
+def legacy_iter_unlooped_nodes(template):
+    for value_by_loop_variable_name in template.iter_value_dicts():
+        new_node = unloop_helpers.unshared_copy(template.node)
+        unloop_helpers.update_symbols(new_node, value_by_loop_variable_name)
+        yield new_node
+
+
+def symbol_names(node, names):
+    if isinstance(node, dict):
+        if node.get('type') == 'symbol':
+            names.append(node['value'])
+        else:
+            for child_node in node.values():
+                symbol_names(child_node, names)
+    elif isinstance(node, list):
+        for child_node in node:
+            symbol_names(child_node, names)
+    return names
+
+
+def iter_loops(node):
+    """Yield the `UnloopTemplate` of each loop found in `node`."""
+    if isinstance(node, dict):
+        node_type = node.get('type')
+        if node_type == 'loop_expression':
+            yield unloop_helpers.UnloopTemplate(node['expression'], node['loop_variables'])
+        elif node_type == 'pour_formula':
+            yield unloop_helpers.UnloopTemplate(node['formula']['expression'], node['loop_variables'])
+        for child_node in node.values():
+            yield from iter_loops(child_node)
+    elif isinstance(node, list):
+        for child_node in node:
+            yield from iter_loops(child_node)
+
+
+def load_largest_loops(json_dir, count):
+    """Return the `count` loops with the most nodes to build once unlooped."""
+    templates = []
+    for millesime_name in sorted(os.listdir(json_dir)):
+        for file_path in serialization.list_files(os.path.join(json_dir, millesime_name, '1_ast_by_file')):
+            templates.extend(iter_loops(serialization.load_file(file_path)))
+
+    def unlooped_size(template):
+        return len(list(template.iter_value_dicts())) * len(repr(template.node))
+
+    return sorted(templates, key=unlooped_size, reverse=True)[:count]
+
+
+def best_time(function, repeat):
+    """Like `timeit`, disable the garbage collector during the runs."""
+    durations = []
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = function()
+            durations.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return min(durations), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--json-dir', default=default_json_dir, help='directory containing one directory per millésime')
+    parser.add_argument('--count', type=int, default=200, help='number of loops benchmarked')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs, the best one is kept')
+    args = parser.parse_args()
+
+    templates = load_largest_loops(args.json_dir, args.count)
+    flat_templates = [template for template in templates if not template.contains_loops]
+
+    def run_legacy(templates):
+        return [
+            symbol_names(node, [])
+            for template in templates
+            for node in legacy_iter_unlooped_nodes(template)
+            ]
+
+    def run_views(templates):
+        return [
+            symbol_names(node, [])
+            for template in templates
+            for node in template.iter_unlooped_views()
+            ]
+
+    def run_names(templates):
+        return [
+            names
+            for template in templates
+            for names in template.iter_substituted_names(symbol_names(template.node, []))
+            ]
+
+    print('{} loops, {} without nested loops, {} unlooped nodes.'.format(
+        len(templates), len(flat_templates), sum(len(list(template.iter_value_dicts())) for template in templates)))
+    print('{:<30} {:>10} {:>10} {:>8}'.format('', 'legacy', 'new', 'speedup'))
+    for label, function, benchmarked_templates in (
+            ('views, all loops', run_views, templates),
+            ('names, loops without nesting', run_names, flat_templates),
+            ):
+        legacy_duration, legacy_result = best_time(lambda: run_legacy(benchmarked_templates), args.repeat)
+        duration, result = best_time(lambda: function(benchmarked_templates), args.repeat)
+        assert result == legacy_result, 'Different symbols for {}'.format(label)
+        print('{:<30} {:>8.1f}ms {:>8.1f}ms {:>7.1f}x'.format(
+            label, legacy_duration * 1000, duration * 1000, legacy_duration / duration))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Parse M source files with both parser backends of `m_to_ast` (Arpeggio and `m_fast_parser`), check that they give
+the same AST, and compare their parsing times.
+
+The paths are M files or directories, searched recursively (for example the directory of the M sources of every
+millésime). The script exits with status 1 when an AST differs, or when only one backend fails on a file.
+"""
+
+
+import argparse
+import difflib
+import inspect
+import os
+import sys
+import time
+
+from arpeggio import NoMatch
+
+import calculette_impots_m_language_parser
+from calculette_impots_m_language_parser import m_fast_parser, m_to_ast
+
+
+package_dir = os.path.dirname(inspect.getfile(calculette_impots_m_language_parser))
+default_m_file_path = os.path.join(package_dir, 'tests', 'valid_formulas.m')
+
+
+def iter_m_file_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, dir_names, file_names in sorted(os.walk(path)):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    yield os.path.join(dir_path, file_name)
+        else:
+            yield path
+
+
+def parse(source_code, backend):
+    """Return a tuple (ast, seconds), where ast is None when the source code could not be parsed."""
+    start = time.perf_counter()
+    try:
+        ast = m_to_ast.parse_m_file(source_code, backend=backend)
+    except (NoMatch, m_fast_parser.ParseError):
+        ast = None
+    return ast, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', default=[default_m_file_path],
+                        help='M files or directories of M files (the M file of the tests by default)')
+    args = parser.parse_args()
+
+    m_to_ast.get_m_parser()  # Do not count the compilation of the grammar.
+    seconds_by_backend = dict.fromkeys(m_to_ast.backends, 0.)
+    nb_files = 0
+    nb_differences = 0
+    for m_file_path in iter_m_file_paths(args.paths):
+        with open(m_file_path) as m_file:
+            source_code = m_file.read()
+        asts = []
+        for backend in m_to_ast.backends:
+            ast, seconds = parse(source_code, backend)
+            asts.append(ast)
+            seconds_by_backend[backend] += seconds
+        nb_files += 1
+        if asts[0] != asts[1]:
+            nb_differences += 1
+            if None in asts:
+                print('{}: only the {} backend fails.'.format(
+                    m_file_path, m_to_ast.backends[asts.index(None)]))
+            else:
+                diff_lines = difflib.unified_diff(asts[0].splitlines(), asts[1].splitlines(), *m_to_ast.backends,
+                                                  lineterm='')
+                print('{}: the ASTs differ.\n{}'.format(m_file_path, '\n'.join(list(diff_lines)[:40])))
+
+    print('Parsed {} files: {}.'.format(nb_files, ', '.join(
+        '{} in {:.2f}s'.format(backend, seconds) for backend, seconds in sorted(seconds_by_backend.items()))))
+    if nb_differences:
+        print('{} files differ.'.format(nb_differences))
+        sys.exit(1)
+    print('The ASTs are identical.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Compare the simplified ASTs of two millésimes (see `millesime_diff`): list the added, removed and changed formulas,
+constants and input variables, and count the formulas affected by these changes, whose derived artifacts must be
+rebuilt.
+
+Example:
+python diff_millesimes.py json/sources2014m_2_15/2_simplified_ast json/sourcesm2015m_4_6/2_simplified_ast
+"""
+
+
+import argparse
+import collections
+import json
+
+from calculette_impots_m_language_parser import lighten_ast, millesime_diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('old_dir', help='2_simplified_ast directory of the previous millésime')
+    parser.add_argument('new_dir', help='2_simplified_ast directory of the next millésime')
+    parser.add_argument('--names', action='store_true', help='print the names of the changes, not only their number')
+    parser.add_argument('--output', help='JSON file where the diff and the affected formulas are written')
+    args = parser.parse_args()
+
+    old_hashes = millesime_diff.load_hashes(args.old_dir)
+    new_hashes = millesime_diff.load_hashes(args.new_dir)
+    diff = millesime_diff.diff_hashes(old_hashes, new_hashes)
+    for field, names in zip(diff._fields, diff):
+        print('{}: {}{}'.format(field.replace('_', ' '), len(names), ' ({})'.format(', '.join(names))
+                                if args.names and names else ''))
+
+    formulas = lighten_ast.load_data(args.new_dir)[0]
+    children_dict = {name: lighten_ast.get_children(formula) for name, formula in formulas.items()}
+    changed_symbols = millesime_diff.changed_symbols(old_hashes, new_hashes)
+    affected_formulas = millesime_diff.affected_formulas(changed_symbols, children_dict)
+    print('{} of the {} formulas are affected by the {} changed symbols.'.format(
+        len(affected_formulas), len(formulas), len(changed_symbols)))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(collections.OrderedDict(
+                list(diff._asdict().items()) + [('affected_formulas', sorted(affected_formulas))]
+                ), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Report the reduction of the number of nodes of the simplified formulas of every millésime by `common_subexpressions`.
+
+The formulas come from `simplify_ast.simplified_ast_dir`. With --output-dir, the formulas with their common
+subexpressions hoisted are written to a 2_simplified_ast directory per millésime.
+"""
+
+
+import argparse
+import contextlib
+import inspect
+import io
+import os
+import tempfile
+
+import calculette_impots_m_language_parser
+from calculette_impots_m_language_parser import common_subexpressions, simplify_ast
+
+
+package_base_dir = os.path.dirname(os.path.dirname(inspect.getfile(calculette_impots_m_language_parser)))
+default_json_dir = os.path.join(package_base_dir, 'json')
+
+
+def eliminate_in_millesime(millesime_dir, target_dir, min_tree_size):
+    with contextlib.redirect_stdout(io.StringIO()), \
+            simplify_ast.simplified_ast_dir(millesime_dir) as source_dir:
+        return common_subexpressions.eliminate_common_subexpressions_in_dir(
+            source_dir, target_dir, min_tree_size=min_tree_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--json-dir', default=default_json_dir, help='directory containing one directory per millésime')
+    parser.add_argument('--output-dir', help='directory where the formulas of each millésime are written')
+    parser.add_argument('--min-tree-size', type=int, default=common_subexpressions.default_min_tree_size,
+                        help='number of nodes under which subexpressions are not hoisted')
+    args = parser.parse_args()
+
+    print('{:<20} {:>9} {:>11} {:>10} {:>12} {:>11} {:>10}'.format(
+        'millésime', 'formulas', 'tree nodes', 'DAG nodes', 'temporaries', 'nodes after', 'reduction'))
+    for millesime_name in sorted(os.listdir(args.json_dir)):
+        millesime_dir = os.path.join(args.json_dir, millesime_name)
+        with tempfile.TemporaryDirectory() as temporary_dir:
+            if args.output_dir is None:
+                target_dir = temporary_dir
+            else:
+                target_dir = os.path.join(args.output_dir, millesime_name, '2_simplified_ast')
+                os.makedirs(target_dir, exist_ok=True)
+            stats = eliminate_in_millesime(millesime_dir, target_dir, args.min_tree_size)
+        print('{:<20} {formulas:>9} {tree_nodes:>11} {dag_nodes:>10} {temporaries:>12} {nodes_after:>11} '
+              '{:>9.1f}%'.format(millesime_name, 100 * (1 - stats['nodes_after'] / stats['tree_nodes']), **stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Report how many nodes and formulas of every millésime are eliminated by `fold_constants`.
+
+The simplified formulas of each millésime are given by `simplify_ast.simplified_ast_dir`. With --output-dir, the
+folded formulas and constants are written to a 2_simplified_ast directory per millésime.
+"""
+
+
+import argparse
+import contextlib
+import inspect
+import io
+import os
+import tempfile
+
+import calculette_impots_m_language_parser
+from calculette_impots_m_language_parser import fold_constants, simplify_ast
+
+
+package_base_dir = os.path.dirname(os.path.dirname(inspect.getfile(calculette_impots_m_language_parser)))
+default_json_dir = os.path.join(package_base_dir, 'json')
+
+
+def fold_millesime(millesime_dir, target_dir):
+    with contextlib.redirect_stdout(io.StringIO()), \
+            simplify_ast.simplified_ast_dir(millesime_dir) as source_dir:
+        return fold_constants.fold_constants_in_dir(source_dir, target_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--json-dir', default=default_json_dir, help='directory containing one directory per millésime')
+    parser.add_argument('--output-dir', help='directory where the folded formulas of each millésime are written')
+    args = parser.parse_args()
+
+    print('{:<20} {:>9} {:>10} {:>11} {:>12} {:>10} {:>7} {:>10}'.format(
+        'millésime', 'formulas', 'constant', 'tree nodes', 'nodes after', 'reduction', 'folded', 'constants'))
+    print('{:<20} {:>9} {:>10} {:>11} {:>12} {:>10} {:>7} {:>10}'.format(
+        '', '', 'formulas', '', '', '', 'calls', 'inlined'))
+    for millesime_name in sorted(os.listdir(args.json_dir)):
+        millesime_dir = os.path.join(args.json_dir, millesime_name)
+        with tempfile.TemporaryDirectory() as temporary_dir:
+            if args.output_dir is None:
+                target_dir = temporary_dir
+            else:
+                target_dir = os.path.join(args.output_dir, millesime_name, '2_simplified_ast')
+                os.makedirs(target_dir, exist_ok=True)
+            stats = fold_millesime(millesime_dir, target_dir)
+        print('{:<20} {formulas:>9} {constant_formulas:>10} {tree_nodes:>11} {nodes_after:>12} {:>9.1f}% '
+              '{folded_calls:>7} {substituted_constants:>10}'.format(
+                  millesime_name, 100 * (1 - stats['nodes_after'] / stats['tree_nodes']), **stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,49 +1,113 @@
-import os
+"""
+Regenerate the AST files of the `json` directory from the M source code of every millésime.
+
+With --report, the timings of the stages and the counters of the run (see `instrumentation`) are written as JSON,
+with the parse time, the sizes and the node counts of every M file.
+"""
+
+
+import argparse
+import concurrent.futures
 import inspect
+import logging
+import os
+import sys
 
 import calculette_impots_m_language_parser
-from calculette_impots_m_language_parser import m_to_ast, simplify_ast, lighten_ast
+from calculette_impots_m_language_parser import instrumentation, m_to_ast, parse_cache, serialization, simplify_ast, \
+    lighten_ast
 
 
-source_base_dir = '/data/projects/impots/sources_m/sources-utf8'
+default_source_base_dir = '/data/projects/impots/sources_m/sources-utf8'
 package_base_dir = os.path.dirname(os.path.dirname(inspect.getfile(calculette_impots_m_language_parser)))
 target_base_dir = os.path.join(package_base_dir, 'json')
 
-source_dirs = sorted(os.listdir(source_base_dir))
-for millesime_name in source_dirs:
-    print('***{}***'.format(millesime_name))
 
+def init_worker(parser_file_path, memoization=False):
+    """
+    Load the compiled parser saved by the main process instead of compiling the grammar in each worker, and use the
+    memoization policy of the main process.
+    """
+    m_to_ast.set_memoization(memoization)
+    if parser_file_path is not None:
+        m_to_ast.get_m_parser(parser_file_path)
+
+
+def parse_source_file(source_file_path, target_file_path, cache_dir=None, by_declaration=False, format_name='json',
+                      report_enabled=False, backend='arpeggio'):
+    """
+    Write the AST of a M source file in the given format. Runs in worker processes when several jobs are used.
+
+    Return a tuple (cache_hit, errors, file_report): cache_hit tells whether the AST was found in the parse cache (None
+    when no cache is used), errors lists the declarations which could not be parsed in `by_declaration` mode and
+    file_report is the report of the file converted by `Report.to_dict`, to be merged in the report of the run.
+    """
+    file_report = instrumentation.Report(enabled=report_enabled)
+    with instrumentation.recording(file_report), file_report.stage('parse_code_m.parse_source_file'):
+        cache_hit, errors = parse_source_file_with_report(
+            source_file_path, target_file_path, cache_dir, by_declaration, format_name, backend)
+    file_report_dict = file_report.to_dict()
+    file_report_dict['source_file_path'] = source_file_path
+    file_report_dict['cache_hit'] = cache_hit
+    return cache_hit, errors, file_report_dict
+
+
+def parse_source_file_with_report(source_file_path, target_file_path, cache_dir, by_declaration, format_name,
+                                  backend):
+    with open(source_file_path, 'r') as f:
+        source_code = f.read()
+
+    serializer = serialization.get_serializer(format_name)
+    cache = None if cache_dir is None else parse_cache.ParseCache(cache_dir, serializer=serializer, backend=backend)
+    ast = None if cache is None else cache.get(source_code)
+    errors = []
+    if ast is None:
+        if by_declaration:
+            ast, errors = m_to_ast.parse_m_file_by_declaration(source_code, serializer=serializer, backend=backend)
+        else:
+            ast = m_to_ast.parse_m_file(source_code, serializer=serializer, backend=backend)
+        # Incomplete ASTs are not cached, so that their errors are reported again.
+        if cache is not None and not errors:
+            cache.set(source_code, ast)
+
+    serialization.write_data(target_file_path, ast, serializer)
+
+    return (None if cache is None else cache.hits == 1), errors
+
+
+def prepare_millesime(source_base_dir, millesime_name, format_name='json'):
+    """Create the target directories of a millésime and return the (source, target) paths of its files."""
     millesime_target_dir = os.path.join(target_base_dir, millesime_name)
     os.mkdir(millesime_target_dir)
 
-
-    # 1_ast_by_file
-
     millesime_source_dir = os.path.join(source_base_dir, millesime_name)
-    filenames = os.listdir(millesime_source_dir)
-
     millesime_ast_by_file_dir = os.path.join(millesime_target_dir, '1_ast_by_file')
     os.mkdir(millesime_ast_by_file_dir)
 
-    for filename in filenames:
+    extension = serialization.get_serializer(format_name).extension
+    file_paths = []
+    for filename in sorted(os.listdir(millesime_source_dir)):
         barename = os.path.splitext(filename)[0]
         source_file_path = os.path.join(millesime_source_dir, filename)
-        target_file_path = os.path.join(millesime_ast_by_file_dir, barename + '.json')
+        target_file_path = os.path.join(millesime_ast_by_file_dir, barename + extension)
+        file_paths.append((source_file_path, target_file_path))
+    return file_paths
 
-        with open(source_file_path, 'r') as f:
-            source_code = f.read()
 
-        ast = m_to_ast.parse_m_file(source_code)
+def build_derived_asts(millesime_name, format_name='json', lazy_loops=False):
+    """Run the stages which need the whole 1_ast_by_file directory of a millésime."""
+    print('***{}***'.format(millesime_name))
 
-        with open(target_file_path, 'w') as f:
-            f.write(ast)
+    millesime_target_dir = os.path.join(target_base_dir, millesime_name)
+    millesime_ast_by_file_dir = os.path.join(millesime_target_dir, '1_ast_by_file')
 
     # 2_simplified_ast
 
     millesime_simplified_ast_dir = os.path.join(millesime_target_dir, '2_simplified_ast')
     os.mkdir(millesime_simplified_ast_dir)
 
-    simplify_ast.simplify_ast(millesime_ast_by_file_dir, millesime_simplified_ast_dir)
+    with instrumentation.report.stage('simplify_ast'):
+        simplify_ast.simplify_ast(millesime_ast_by_file_dir, millesime_simplified_ast_dir, format_name, lazy_loops)
 
 
     # 3_light_ast
@@ -51,4 +115,134 @@ for millesime_name in source_dirs:
     millesime_light_ast_dir = os.path.join(millesime_target_dir, '3_light_ast')
     os.mkdir(millesime_light_ast_dir)
 
-    lighten_ast.lighten_ast(millesime_simplified_ast_dir, millesime_light_ast_dir)
+    with instrumentation.report.stage('lighten_ast'):
+        lighten_ast.lighten_ast(millesime_simplified_ast_dir, millesime_light_ast_dir, format_name)
+
+
+def add_file_report(file_report):
+    instrumentation.report.merge(file_report)
+    if instrumentation.report.enabled:
+        instrumentation.report.files.append(file_report)
+
+
+def report_errors(source_file_path, errors):
+    for error in errors:
+        print('{}:{}:{}: syntax error in the declaration starting at line {}: {}'.format(
+            source_file_path, error['line'], error['column'], error['first_line'], error['message']))
+
+
+def run_serial(file_paths_by_millesime, cache_dir, by_declaration, format_name, lazy_loops=False, backend='arpeggio'):
+    cache_hits = []
+    for millesime_name, file_paths in file_paths_by_millesime.items():
+        for source_file_path, target_file_path in file_paths:
+            cache_hit, errors, file_report = parse_source_file(
+                source_file_path, target_file_path, cache_dir, by_declaration, format_name,
+                instrumentation.report.enabled, backend)
+            add_file_report(file_report)
+            report_errors(source_file_path, errors)
+            cache_hits.append(cache_hit)
+        build_derived_asts(millesime_name, format_name, lazy_loops)
+    return cache_hits
+
+
+def run_parallel(file_paths_by_millesime, cache_dir, by_declaration, format_name, jobs, parser_file_path,
+                 lazy_loops=False, backend='arpeggio'):
+    """
+    Parse the files of all the millésimes in a pool of processes. The derived ASTs of a millésime are built in the
+    main process as soon as its last file is parsed, while the workers go on with the other millésimes.
+    """
+    remaining_files_by_millesime = {
+        millesime_name: len(file_paths)
+        for millesime_name, file_paths in file_paths_by_millesime.items()
+        }
+    for millesime_name, remaining_files in remaining_files_by_millesime.items():
+        if remaining_files == 0:
+            build_derived_asts(millesime_name, format_name, lazy_loops)
+
+    cache_hits = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                                                initargs=(parser_file_path, m_to_ast.memoization)) as executor:
+        task_by_future = {
+            executor.submit(
+                parse_source_file, source_file_path, target_file_path, cache_dir, by_declaration, format_name,
+                instrumentation.report.enabled, backend,
+                ): (millesime_name, source_file_path)
+            for millesime_name, file_paths in file_paths_by_millesime.items()
+            for source_file_path, target_file_path in file_paths
+            }
+        for future in concurrent.futures.as_completed(task_by_future):
+            millesime_name, source_file_path = task_by_future[future]
+            cache_hit, errors, file_report = future.result()
+            add_file_report(file_report)
+            report_errors(source_file_path, errors)
+            cache_hits.append(cache_hit)
+            remaining_files_by_millesime[millesime_name] -= 1
+            if remaining_files_by_millesime[millesime_name] == 0:
+                build_derived_asts(millesime_name, format_name, lazy_loops)
+    return cache_hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--source-dir', default=default_source_base_dir,
+                        help='directory containing one sub-directory of M files per millésime')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes used to parse the M files')
+    parser.add_argument('--cache-dir',
+                        help='directory of the parse cache: unchanged M files are not parsed again')
+    parser.add_argument('--cache-max-size', type=int, default=parse_cache.default_max_size // (1024 * 1024),
+                        help='size in MB above which the least recently used entries of the parse cache are evicted')
+    parser.add_argument('--by-declaration', action='store_true',
+                        help='parse the M files declaration by declaration: a syntax error only drops its declaration')
+    parser.add_argument('--parser-file',
+                        help='file where the compiled grammar is saved, to skip its compilation in the next runs')
+    parser.add_argument('--format', choices=list(serialization.serializer_by_format_name), default='json',
+                        help='format of the generated files: binary files are smaller and faster to load')
+    parser.add_argument('--lazy-loops', action='store_true',
+                        help='keep the loops of the simplified AST instead of unfolding them')
+    parser.add_argument('--backend', choices=m_to_ast.backends, default='arpeggio',
+                        help='parser of the M files: Arpeggio with the grammar file, or the faster parser of '
+                             'm_fast_parser which gives the same AST')
+    parser.add_argument('--memoize', default='none',
+                        help='memoization policy of the parser: "none", "all" or comma-separated rule names (see the '
+                             'script profile_grammar.py)')
+    parser.add_argument('--report',
+                        help='JSON file where the timings of the stages and the counters of the run are written')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if m_to_ast.debug else logging.WARNING, stream=sys.stdout)
+
+    m_to_ast.set_memoization(m_to_ast.parse_memoization_policy(args.memoize))
+    if args.parser_file is not None:
+        # Compile or load the parser before the worker processes need it.
+        m_to_ast.get_m_parser(args.parser_file)
+
+    if args.report is not None:
+        instrumentation.report.enabled = True
+
+    file_paths_by_millesime = {
+        millesime_name: prepare_millesime(args.source_dir, millesime_name, args.format)
+        for millesime_name in sorted(os.listdir(args.source_dir))
+        }
+
+    if args.jobs > 1:
+        cache_hits = run_parallel(
+            file_paths_by_millesime, args.cache_dir, args.by_declaration, args.format, args.jobs, args.parser_file,
+            args.lazy_loops, args.backend)
+    else:
+        cache_hits = run_serial(file_paths_by_millesime, args.cache_dir, args.by_declaration, args.format,
+                                args.lazy_loops, args.backend)
+
+    if args.cache_dir is not None:
+        cache = parse_cache.ParseCache(args.cache_dir, max_size=args.cache_max_size * 1024 * 1024,
+                                       serializer=serialization.get_serializer(args.format))
+        nb_evicted = cache.evict()
+        print('Parse cache: {} hits, {} misses, {} entries evicted.'.format(
+            cache_hits.count(True), cache_hits.count(False), nb_evicted))
+
+    if args.report is not None:
+        instrumentation.report.dump(args.report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Profile the rules of the M grammar (see `grammar_profiler`) on M source files, to choose the rules to memoize.
+
+The paths are M files or directories, searched recursively (for example the directory of the M sources of every
+millésime). The rules are listed by decreasing --sort value. A rule with many repeated attempts is worth memoizing
+with --memoize, if the parsing time goes down. This time is measured on a parsing without profiling, whose overhead
+would hide the effect of the memoization: compare it between runs with different --memoize policies.
+"""
+
+
+import argparse
+import inspect
+import json
+import os
+
+import calculette_impots_m_language_parser
+from calculette_impots_m_language_parser import grammar_profiler, m_to_ast
+
+
+package_dir = os.path.dirname(inspect.getfile(calculette_impots_m_language_parser))
+default_m_file_path = os.path.join(package_dir, 'tests', 'valid_formulas.m')
+
+
+def iter_m_file_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, dir_names, file_names in sorted(os.walk(path)):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    yield os.path.join(dir_path, file_name)
+        else:
+            yield path
+
+
+def iter_source_codes(m_file_paths):
+    for m_file_path in m_file_paths:
+        with open(m_file_path) as m_file:
+            yield m_file.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', default=[default_m_file_path],
+                        help='M files or directories of M files (the M file of the tests by default)')
+    parser.add_argument('--memoize', default='none',
+                        help='memoization policy: "none", "all" or comma-separated rule names')
+    parser.add_argument('--sort', choices=grammar_profiler.stat_names, default='seconds',
+                        help='stat by which the rules are sorted')
+    parser.add_argument('--output', help='JSON file where the profile is written')
+    args = parser.parse_args()
+
+    m_file_paths = list(iter_m_file_paths(args.paths))
+    profile, seconds = grammar_profiler.profile_source_codes(
+        iter_source_codes(m_file_paths), m_to_ast.parse_memoization_policy(args.memoize))
+
+    print('{:<28}{}'.format('rule', ''.join('{:>19}'.format(stat_name) for stat_name in grammar_profiler.stat_names)))
+    for rule_name, stats in grammar_profiler.sorted_profile(profile, args.sort):
+        print('{:<28}{}'.format(rule_name, ''.join(
+            '{:>19.3f}'.format(value) if isinstance(value, float) else '{:>19}'.format(value)
+            for value in stats.values()
+            )))
+    print('Parsed {} files in {:.2f}s without profiling, with memoization policy "{}".'.format(
+        len(m_file_paths), seconds, args.memoize))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'memoization': args.memoize, 'seconds': seconds, 'rules': profile}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
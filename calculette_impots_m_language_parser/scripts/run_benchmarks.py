@@ -0,0 +1,76 @@
+"""
+Run the benchmark suite (see `benchmark_suite`) on the millésimes of the `json` directory and on M source files.
+
+With --output, the results are saved as JSON. With --compare, they are compared with the results of a previous run:
+the benchmarks slower by more than --threshold, or whose peak memory grew by more than --memory-threshold, are listed
+and the script exits with status 1.
+"""
+
+
+import argparse
+import inspect
+import json
+import os
+import sys
+import tempfile
+
+import calculette_impots_m_language_parser
+from calculette_impots_m_language_parser import benchmark_suite
+
+
+package_dir = os.path.dirname(inspect.getfile(calculette_impots_m_language_parser))
+default_json_dir = os.path.join(os.path.dirname(package_dir), 'json')
+default_m_file_path = os.path.join(package_dir, 'tests', 'valid_formulas.m')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--json-dir', default=default_json_dir, help='directory containing one directory per millésime')
+    parser.add_argument('--millesime', action='append',
+                        help='millésime to benchmark, may be repeated (all the millésimes by default)')
+    parser.add_argument('--m-file', action='append',
+                        help='M source file whose parsing is benchmarked, may be repeated (the M file of the tests '
+                             'by default)')
+    parser.add_argument('--filter', help='only run the benchmarks whose name contains this string')
+    parser.add_argument('--repeat', type=int, default=benchmark_suite.default_repeat,
+                        help='number of timed runs, the best one is kept')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='do not measure the peak memory of the benchmarks, which is slow')
+    parser.add_argument('--output', help='JSON file where the results are written')
+    parser.add_argument('--compare', help='JSON file of the results of a previous run')
+    parser.add_argument('--threshold', type=float, default=benchmark_suite.default_threshold,
+                        help='relative slowdown above which a benchmark is reported as a regression')
+    parser.add_argument('--memory-threshold', type=float,
+                        help='relative growth of the peak memory above which a benchmark is reported as a regression '
+                             '(--threshold by default)')
+    args = parser.parse_args()
+
+    millesime_names = args.millesime or sorted(os.listdir(args.json_dir))
+    m_file_paths = args.m_file or [default_m_file_path]
+    with tempfile.TemporaryDirectory() as work_dir:
+        benchmarks = benchmark_suite.iter_benchmarks(args.json_dir, millesime_names, m_file_paths, work_dir)
+        run = benchmark_suite.run_benchmarks(benchmarks, args.repeat, args.filter,
+                                             measure_memory=not args.no_memory)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            previous_run = json.load(f)
+        regressions = benchmark_suite.find_regressions(previous_run, run, args.threshold, args.memory_threshold)
+        for name, measure, previous_value, value in regressions:
+            if measure == 'seconds':
+                print('Regression: {} took {:.1f}ms instead of {:.1f}ms (+{:.0%})'.format(
+                    name, value * 1000, previous_value * 1000, value / previous_value - 1))
+            else:
+                print('Regression: {} used {:.1f}MB instead of {:.1f}MB (+{:.0%})'.format(
+                    name, value / (1024 * 1024), previous_value / (1024 * 1024), value / previous_value - 1))
+        if regressions:
+            sys.exit(1)
+        print('No regression compared with the run of {}.'.format(previous_run['date']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Slice the simplified AST of a millésime for one or several sets of root variables.
+
+For each set of roots, print the number of formulas, constants, inputs and undefined symbols needed to compute them.
+With --output-dir, also write the files of a 3_light_ast directory for each set of roots.
+"""
+
+
+import argparse
+import os
+import time
+
+from calculette_impots_m_language_parser import dependency_index, lighten_ast, serialization
+
+
+def save_slice(index, dependency_slice, target_dir, format_name):
+    formulas_light = {name: index.formulas[name] for name in dependency_slice.formulas}
+    constants_light = {name: index.constants[name] for name in dependency_slice.constants}
+    children_light = lighten_ast.compute_children_light(index.children_dict, formulas_light)
+    os.makedirs(target_dir, exist_ok=True)
+    lighten_ast.save_data(target_dir, dependency_slice.computing_order, dependency_slice.computing_levels,
+                          children_light, formulas_light, constants_light, dependency_slice.inputs,
+                          dependency_slice.unknowns, format_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('source_dir', help='2_simplified_ast directory of a millésime')
+    parser.add_argument('--roots', action='append', required=True,
+                        help='comma-separated root variables, may be repeated to slice several sets')
+    parser.add_argument('--output-dir',
+                        help='directory where a sub-directory of light AST files is written for each set of roots')
+    parser.add_argument('--format', choices=list(serialization.serializer_by_format_name), default='json',
+                        help='format of the written files')
+    parser.add_argument('--max-cached-closures', type=int, default=dependency_index.default_max_cached_closures,
+                        help='number of transitive closures kept in memory')
+    args = parser.parse_args()
+
+    index = dependency_index.load(args.source_dir, args.max_cached_closures)
+    for roots_argument in args.roots:
+        roots = roots_argument.split(',')
+        start = time.perf_counter()
+        dependency_slice = index.slice(roots)
+        duration = time.perf_counter() - start
+        print('{}: {} formulas in {} levels, {} constants, {} inputs, {} undefined symbols ({:.1f}ms)'.format(
+            ', '.join(roots), len(dependency_slice.formulas), len(dependency_slice.computing_levels),
+            len(dependency_slice.constants), len(dependency_slice.inputs), len(dependency_slice.unknowns),
+            duration * 1000))
+        if args.output_dir is not None:
+            save_slice(index, dependency_slice, os.path.join(args.output_dir, '+'.join(roots)), args.format)
+    print('Closure cache: {} hits, {} misses.'.format(index.hits, index.misses))
+
+
+if __name__ == '__main__':
+    main()
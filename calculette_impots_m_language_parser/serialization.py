@@ -0,0 +1,143 @@
+"""
+Read and write the AST files of the three stages (1_ast_by_file, 2_simplified_ast, 3_light_ast) in one of the
+supported formats:
+* json: indented JSON with sorted keys, see `json_dump`
+* binary: compact binary format, see `binary_dump`
+
+A format is a module exposing `extension`, `is_binary`, `dumps(obj)` and `loads(data)`, and optionally
+`iter_loads(f, dropped_keys)` to read the items of a list one by one, `iter_dumps_items(items)` to write a dict piece
+by piece and `loads_shared(data)` to load a tree whose equal subtrees are the same objects.
+
+The loading functions return trees which may be modified. With `shared=True`, they return the shared trees of the
+formats with `loads_shared`, which are faster to load but must be treated as read-only.
+
+Files are named after their content ("formulas", "chap-1"...) followed by the extension of their format.
+"""
+
+
+from collections import OrderedDict
+import os
+
+from calculette_impots_m_language_parser import binary_dump, json_dump
+
+
+# Globals
+
+serializer_by_format_name = OrderedDict([
+    ('json', json_dump),
+    ('binary', binary_dump),
+    ])
+
+# When a file exists in several formats, the fastest to load is read.
+reading_order = ['binary', 'json']
+
+
+# Public functions
+
+def get_serializer(format_name):
+    try:
+        return serializer_by_format_name[format_name]
+    except KeyError:
+        raise ValueError('Unknown format {!r}, expected one of {}'.format(
+            format_name, ', '.join(serializer_by_format_name)))
+
+
+def get_serializer_from_path(file_path):
+    extension = os.path.splitext(file_path)[1]
+    for serializer in serializer_by_format_name.values():
+        if serializer.extension == extension:
+            return serializer
+    return None
+
+
+def write_data(file_path, data, serializer):
+    """Write data already serialized by `serializer.dumps`."""
+    with open(file_path, 'wb' if serializer.is_binary else 'w') as f:
+        f.write(data)
+
+
+def dump(obj, target_dir, name, format_name='json'):
+    """Write `obj` to the file `name` of `target_dir` and return the file path."""
+    serializer = get_serializer(format_name)
+    file_path = os.path.join(target_dir, name + serializer.extension)
+    write_data(file_path, serializer.dumps(obj), serializer)
+    return file_path
+
+
+def dump_items(items, target_dir, name, format_name='json'):
+    """
+    Write the dict of the `(key, value)` pairs of `items` to the file `name` of `target_dir` and return the file path.
+    The formats with `iter_dumps_items` write each pair as soon as it is produced; the others build the dict first.
+    """
+    serializer = get_serializer(format_name)
+    iter_dumps_items = getattr(serializer, 'iter_dumps_items', None)
+    if iter_dumps_items is None:
+        return dump(dict(items), target_dir, name, format_name)
+    file_path = os.path.join(target_dir, name + serializer.extension)
+    with open(file_path, 'wb' if serializer.is_binary else 'w') as f:
+        for data in iter_dumps_items(items):
+            f.write(data)
+    return file_path
+
+
+def load_file(file_path, shared=False):
+    serializer = get_serializer_from_path(file_path)
+    if serializer is None:
+        raise ValueError('Unknown format for file {}'.format(file_path))
+    loads = getattr(serializer, 'loads_shared', serializer.loads) if shared else serializer.loads
+    with open(file_path, 'rb' if serializer.is_binary else 'r') as f:
+        return loads(f.read())
+
+
+def iter_file_items(file_path, dropped_keys=(), shared=False):
+    """
+    Yield the items of the list stored in a file. The formats with `iter_loads` decode them one by one, without the
+    keys of `dropped_keys`; the files of the other formats are loaded at once and their items are left as is.
+    """
+    serializer = get_serializer_from_path(file_path)
+    if serializer is None:
+        raise ValueError('Unknown format for file {}'.format(file_path))
+    iter_loads = getattr(serializer, 'iter_loads', None)
+    if iter_loads is None:
+        yield from load_file(file_path, shared)
+        return
+    with open(file_path, 'rb' if serializer.is_binary else 'r') as f:
+        yield from iter_loads(f, dropped_keys)
+
+
+def load(source_dir, name, shared=False):
+    """Load the file `name` of `source_dir`, whatever its format."""
+    file_path = find_file(source_dir, name)
+    if file_path is None:
+        raise FileNotFoundError('No file named {} in {}'.format(name, source_dir))
+    return load_file(file_path, shared)
+
+
+def find_file(source_dir, name):
+    """Return the path of the file `name` of `source_dir` read by `load`, or None when there is none."""
+    for format_name in reading_order:
+        file_path = os.path.join(source_dir, name + serializer_by_format_name[format_name].extension)
+        if os.path.exists(file_path):
+            return file_path
+    return None
+
+
+def list_files(source_dir):
+    """Return the paths of the AST files of `source_dir`, one per name, sorted by file name."""
+    file_path_by_name = OrderedDict()
+    for filename in sorted(os.listdir(source_dir)):
+        name, extension = os.path.splitext(filename)
+        serializer = get_serializer_from_path(filename)
+        if serializer is None:
+            continue
+        previous_file_path = file_path_by_name.get(name)
+        if previous_file_path is None or is_read_before(serializer, get_serializer_from_path(previous_file_path)):
+            file_path_by_name[name] = os.path.join(source_dir, filename)
+    return list(file_path_by_name.values())
+
+
+# Helpers
+
+def is_read_before(serializer, other_serializer):
+    serializers = [serializer_by_format_name[format_name] for format_name in reading_order]
+    return serializers.index(serializer) < serializers.index(other_serializer)
@@ -4,7 +4,13 @@ Simplify the AST from calculette-impots-m-language-parser to allow only the foll
 * floats
 * function calls
 
-Loops are unfolded.
+Loops are unfolded. With `lazy_loops=True`, they are kept as two compact node types, expanded by `expand_formulas` to
+the unfolded formulas :
+* `reduce` nodes replace the calls to `somme`, with the `name` of the reducing function (`sum`), the `loop_variables`
+  (with their `name` and `enumerations`) and the `expression` summed for every value of the loop variables ;
+* `map` nodes are the expressions of the `pour` formulas, with the `name` template of the formulas, the
+  `loop_variables` and the `expression` template. They are indexed by the name template followed by the loop
+  variables, like `TSNi[i=V,C,P]`, because several `pour` formulas may share a name template.
 
 Only the formulas used for application "batch" are processed.
 
@@ -13,122 +19,268 @@ Les résultats sont enregistrés dans les fichiers suivants :
 * constants.json : Constantes
 * input_variables.json : Variables en entrée, avec leur `name` (référencé dans les formules) et leur `alias` (référencé dans le formulaire 2042).
 
+Avec `format_name='binary'`, les fichiers sont enregistrés au format binaire du module `binary_dump`.
+
 """
 
+import contextlib
 import os
-import json
+import tempfile
 
-from calculette_impots_m_language_parser import json_dump
+from calculette_impots_m_language_parser import instrumentation, serialization
 
 
-# Public functions
+# Globals
 
-def simplify_ast(source_dir, target_dir):
-    formulas, constants, computed_variables, input_variables = read_ast(source_dir)
+# Keys of the AST nodes which are not used to simplify them.
+dropped_keys = ('linecol',)
 
-    formulas_clean = clean_formulas(formulas)
 
-    formulas_dict = {
-        formula['name']: formula['expression']
-        for formula in formulas_clean
-    }
+# Public functions
 
-    constants_dict = {
-        constant['name']: constant['value']
-        for constant in constants
-    }
+def simplify_ast(source_dir, target_dir, format_name='json', lazy_loops=False):
+    """
+    Read, simplify and write the formulas one by one: `formulas.json` is written while the AST files are read, in the
+    order of their file names, and does not sort its formulas by name.
+
+    A first pass reads the constants, the input variables and the names of the formulas, without simplifying their
+    expressions. When a formula is defined several times, only its last definition is simplified and written, as when
+    the formulas were gathered in a dict.
+    """
+    last_positions = {}
+    constants_dict = {}
+    input_variables = []
 
-    with open(os.path.join(target_dir, 'formulas.json'), 'w') as f:
-        f.write(json_dump.dumps(formulas_dict))
-        print('Wrote %d formulas.' % len(formulas_dict))
-    with open(os.path.join(target_dir, 'constants.json'), 'w') as f:
-        f.write(json_dump.dumps(constants_dict))
+    report = instrumentation.report
+    with report.stage('simplify_ast.names'):
+        position = -1
+        for kind, item in iter_read_ast(source_dir):
+            if kind == 'formula':
+                for position, name in enumerate(iter_formula_names([item], lazy_loops), position + 1):
+                    last_positions[name] = position
+            elif kind == 'constant':
+                constants_dict[item['name']] = item['value']
+            elif kind == 'input_variable':
+                input_variables.append(item)
+        nb_overridden_formulas = position + 1 - len(last_positions)
+        if nb_overridden_formulas:
+            print('Warning: {} formula definitions are overridden by a later definition.'.format(
+                nb_overridden_formulas))
+
+    def iter_formulas():
+        position = 0
+        for kind, item in iter_read_ast(source_dir):
+            if kind == 'formula':
+                names = list(iter_formula_names([item], lazy_loops))
+                positions = range(position, position + len(names))
+                position += len(names)
+                if all(last_positions[name] != p for name, p in zip(names, positions)):
+                    continue
+                for p, formula in zip(positions, iter_clean_formulas([item], lazy_loops)):
+                    if last_positions[formula['name']] == p:
+                        yield formula['name'], formula['expression']
+
+    with report.stage('simplify_ast.formulas'):
+        serialization.dump_items(iter_formulas(), target_dir, 'formulas', format_name)
+    print('Wrote %d formulas.' % len(last_positions))
+    with report.stage('simplify_ast.constants_and_inputs'):
+        serialization.dump(constants_dict, target_dir, 'constants', format_name)
         print('Wrote %d constants.' % len(constants_dict))
-    with open(os.path.join(target_dir, 'input_variables.json'), 'w') as f:
-        f.write(json_dump.dumps(input_variables))
+        serialization.dump(input_variables, target_dir, 'input_variables', format_name)
         print('Wrote %d input variables.' % len(input_variables))
+    report.count('simplify_ast.formulas', len(last_positions))
+    report.count('simplify_ast.constants', len(constants_dict))
+    report.count('simplify_ast.input_variables', len(input_variables))
+
+
+@contextlib.contextmanager
+def simplified_ast_dir(millesime_dir):
+    """
+    Give the 2_simplified_ast directory of a millésime. When it has no formulas, they are simplified from the
+    1_ast_by_file directory into a temporary directory, removed on exit.
+    """
+    source_dir = os.path.join(millesime_dir, '2_simplified_ast')
+    if serialization.find_file(source_dir, 'formulas') is not None:
+        yield source_dir
+        return
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        simplify_ast(os.path.join(millesime_dir, '1_ast_by_file'), temporary_dir)
+        yield temporary_dir
+
+
+def expand_formulas(formulas):
+    """Return the formulas without `map` and `reduce` nodes, as written when `lazy_loops` is False."""
+    return {
+        name: expand_loops(expression)
+        for name, expression in expand_formula_maps(formulas).items()
+        }
+
+
+def expand_formula_maps(formulas):
+    """Return the formulas with a formula for every value of the loop variables of the `map` nodes."""
+    expanded_formulas = {}
+    for name, expression in formulas.items():
+        if expression['nodetype'] == 'map':
+            loop_variables = expression['loop_variables']
+            expanded_formulas.update(zip(
+                unroll(expression['name'], loop_variables, str.replace),
+                unroll(expression['expression'], loop_variables, loop_replace),
+                ))
+        else:
+            expanded_formulas[name] = expression
+    return expanded_formulas
+
+
+def expand_loops(node):
+    """Return the node with its `reduce` nodes replaced by calls to their function."""
+    nodetype = node['nodetype']
+
+    if nodetype == 'reduce':
+        template = expand_loops(node['expression'])
+        return {'nodetype': 'call', 'name': node['name'],
+                'args': unroll(template, node['loop_variables'], loop_replace)}
+
+    if nodetype == 'call':
+        args = [expand_loops(child) for child in node['args']]
+        return {'nodetype': 'call', 'name': node['name'], 'args': args}
+
+    return node
+
+
+def unroll(template, loop_variables, replace):
+    """
+    Return the copies of a template for every value of the loop variables, in the order of the unfolded loops.
+    `replace(template, variable_name, value)` returns a copy, like `loop_replace` for expressions and `str.replace`
+    for names.
+    """
+    templates = unroll_templates(template, loop_variables, replace)
+    instrumentation.report.count('simplify_ast.unrolled_loops')
+    instrumentation.report.count('simplify_ast.unrolled_copies', len(templates))
+    return templates
 
 
 # Helper functions
 
-def read_ast(source_dir):
-    formulas = []
-    constants = []
-    computed_variables = []
-    input_variables = []
+def unroll_templates(template, loop_variables, replace):
+    """Like `unroll`, without counting the unrolled loops."""
+    templates = [template]
+    for loop_variable in loop_variables:
+        variable_name = loop_variable['name']
+        templates = [replace(t, variable_name, v)
+                     for v in get_loop_values(loop_variable)
+                     for t in templates]
+    return templates
+
+
+def iter_declarations(source_dir):
+    """
+    Yield the `(file_path, declaration)` pairs of the files of a 1_ast_by_file directory. The declarations of JSON files
+    are decoded one by one, without their unused keys. The declarations may share subtrees and are only read.
+    """
+    for file_path in serialization.list_files(source_dir):
+        for declaration in serialization.iter_file_items(file_path, dropped_keys, shared=True):
+            yield file_path, declaration
+
 
-    file_list = os.listdir(source_dir)
-    for filename in file_list:
-        with open(os.path.join(source_dir, filename), 'r') as f:
-            content = json.load(f)
+def read_ast(source_dir):
+    items_by_kind = {kind: [] for kind in ('formula', 'constant', 'computed_variable', 'input_variable')}
+    for kind, item in iter_read_ast(source_dir):
+        items_by_kind[kind].append(item)
+    return (items_by_kind['formula'], items_by_kind['constant'], items_by_kind['computed_variable'],
+            items_by_kind['input_variable'])
+
+
+def iter_read_ast(source_dir):
+    """
+    Yield the `(kind, item)` pairs of the declarations of a 1_ast_by_file directory as soon as they are read. `kind` is
+    "formula", "constant", "computed_variable" or "input_variable".
+    """
+    for file_path, direct_child in iter_declarations(source_dir):
+        child_type = direct_child['type']
+        if child_type in {'verif', 'erreur', 'application', 'enchaineur', 'sortie'}:
+            pass
+
+        elif child_type == 'variable_calculee':
+            name = direct_child['name']
+            yield 'computed_variable', {'name': name}
+
+        elif child_type == 'variable_saisie':
+            name = direct_child['name']
+            alias = direct_child['alias']
+            yield 'input_variable', {'name': name, 'alias': alias}
+
+        elif child_type == 'variable_const':
+            value = float(direct_child['value'])
+            name = direct_child['name']
+            yield 'constant', {'name': name, 'value': value}
+
+        elif child_type == 'regle':
+            if 'batch' in direct_child['applications']:
+                for formula in direct_child['formulas']:
+                    yield 'formula', formula
 
-        for direct_child in content:
-            child_type = direct_child['type']
-            if child_type in {'verif', 'erreur', 'application', 'enchaineur', 'sortie'}:
-                pass
+        else:
+            raise ValueError('Unknown child type %s in %s : %s' % (
+                direct_child['type'], file_path, str(direct_child)))
 
-            elif child_type == 'variable_calculee':
-                name = direct_child['name']
-                computed_variables.append({'name': name})
 
-            elif child_type == 'variable_saisie':
-                name = direct_child['name']
-                alias = direct_child['alias']
-                input_variables.append({'name': name, 'alias': alias})
+def clean_formulas(formulas, lazy_loops=False):
+    return list(iter_clean_formulas(formulas, lazy_loops))
 
-            elif child_type == 'variable_const':
-                value = float(direct_child['value'])
-                name = direct_child['name']
-                constants.append({'name': name, 'value': value})
 
-            elif child_type == 'regle':
-                if 'batch' in direct_child['applications']:
-                    formulas += direct_child['formulas']
+def iter_formula_names(formulas, lazy_loops=False):
+    """Yield the names of the formulas of `iter_clean_formulas`, in the same order, without their expressions."""
+    for formula in formulas:
+        formula_type = formula['type']
+        if formula_type == 'formula':
+            yield formula['name']
 
+        elif formula_type == 'pour_formula':
+            template_name = formula['formula']['name']
+            loop_variables = clean_loop_variables(formula['loop_variables'])
+            if lazy_loops:
+                yield get_map_name(template_name, loop_variables)
             else:
-                raise ValueError('Unknown child type %s in %s : %s' % (
-                    direct_child['type'], filename, str(direct_child)))
+                yield from unroll_templates(template_name, loop_variables, str.replace)
+
+        else:
+            raise ValueError('Unknown formula type %s' % formula_type)
 
-    return formulas, constants, computed_variables, input_variables
 
+def get_map_name(template_name, loop_variables):
+    """Return the name of a `map` node, like `TSNi[i=V,C,P]`."""
+    return '{}[{}]'.format(template_name, ';'.join(
+        '{}={}'.format(loop_variable['name'], ','.join(get_loop_values(loop_variable)))
+        for loop_variable in loop_variables))
 
-def clean_formulas(formulas):
-    formulas_clean = []
+
+def iter_clean_formulas(formulas, lazy_loops=False):
     for formula in formulas:
         formula_type = formula['type']
         if formula_type == 'formula':
             name = formula['name']
             expression = formula['expression']
-            expression_clean = traversal(expression)
-            formulas_clean.append({'name': name, 'expression': expression_clean})
+            expression_clean = traversal(expression, lazy_loops)
+            yield {'name': name, 'expression': expression_clean}
 
         elif formula_type == 'pour_formula':
-            template_exp = traversal(formula['formula']['expression'])
+            template_exp = traversal(formula['formula']['expression'], lazy_loops)
             template_name = formula['formula']['name']
+            loop_variables = clean_loop_variables(formula['loop_variables'])
 
-            templates_exp = [template_exp]
-            templates_name = [template_name]
-            loop_variables = formula['loop_variables']
-            for loop_variable in loop_variables:
-                assert(loop_variable['type'] == 'loop_variable')
-                variable_name = loop_variable['name']
-                enumerations = loop_variable['enumerations']
-                loop_values = []
-                for enumeration in enumerations:
-                    loop_values += [str(i) for i in parse_enumeration(enumeration)]
-                templates_exp = [loop_replace(template, variable_name, v)
-                                for v in loop_values
-                                for template in templates_exp]
-                templates_name = [template.replace(variable_name, v)
-                                for v in loop_values
-                                for template in templates_name]
+            if lazy_loops:
+                yield {'name': get_map_name(template_name, loop_variables), 'expression': {
+                    'nodetype': 'map', 'name': template_name, 'loop_variables': loop_variables,
+                    'expression': template_exp}}
+                continue
 
+            templates_exp = unroll(template_exp, loop_variables, loop_replace)
+            templates_name = unroll(template_name, loop_variables, str.replace)
             for exp, name in zip(templates_exp, templates_name):
-                formulas_clean.append({'name': name, 'expression': exp})
+                yield {'name': name, 'expression': exp}
 
         else:
             raise ValueError('Unknown formula type %s' % formula_type)
-    return formulas_clean
 
 
 def loop_replace(node, old, new):
@@ -151,9 +303,46 @@ def loop_replace(node, old, new):
         args = [loop_replace(child, old, new) for child in node['args']]
         return {'nodetype': nodetype, 'name': name, 'args': args}
 
+    if nodetype == 'reduce':
+        if not loop_replace_commutes(node['loop_variables'], old, new):
+            return loop_replace(expand_loops(node), old, new)
+        expression = loop_replace(node['expression'], old, new)
+        return {'nodetype': nodetype, 'name': node['name'], 'loop_variables': node['loop_variables'],
+                'expression': expression}
+
     raise ValueError('Unknown type : %s' % nodetype)
 
 
+def loop_replace_commutes(loop_variables, old, new):
+    """
+    Tell whether replacing `old` by `new` before the loop variables gives the same names as replacing it after them,
+    like in the unfolded loops: it is the case when they have no character in common.
+    """
+    old_characters = set(old)
+    for loop_variable in loop_variables:
+        variable_characters = set(loop_variable['name'])
+        if variable_characters & old_characters or variable_characters & set(new):
+            return False
+        if any(old_characters & set(value) for value in get_loop_values(loop_variable)):
+            return False
+    return True
+
+
+def clean_loop_variables(loop_variables):
+    loop_variables_clean = []
+    for loop_variable in loop_variables:
+        assert(loop_variable['type'] == 'loop_variable')
+        loop_variables_clean.append({'name': loop_variable['name'], 'enumerations': loop_variable['enumerations']})
+    return loop_variables_clean
+
+
+def get_loop_values(loop_variable):
+    loop_values = []
+    for enumeration in loop_variable['enumerations']:
+        loop_values += [str(i) for i in parse_enumeration(enumeration)]
+    return loop_values
+
+
 def parse_enumeration(enumeration):
     enum_type = enumeration['type']
     if enum_type == 'enumeration_values':
@@ -167,7 +356,7 @@ def parse_enumeration(enumeration):
     raise ValueError('Unknown enumeration type')
 
 
-def traversal(node):
+def traversal(node, lazy_loops=False):
     nodetype = node['type']
 
     if nodetype == 'symbol':
@@ -189,60 +378,52 @@ def traversal(node):
             assert(len(node['arguments']) == 1)
             arg = node['arguments'][0]
             assert(arg['type'] == 'loop_expression')
-            template = traversal(arg['expression'])
-            loop_variables = arg['loop_variables']
-
-            templates = [template]
-            for loop_variable in loop_variables:
-                assert(loop_variable['type'] == 'loop_variable')
-                variable_name = loop_variable['name']
-                enumerations = loop_variable['enumerations']
-                loop_values = []
-                for enumeration in enumerations:
-                    loop_values += [str(i)
-                                    for i in parse_enumeration(enumeration)]
-                templates = [loop_replace(t, variable_name, v)
-                             for v in loop_values for t in templates]
-            args = templates
+            template = traversal(arg['expression'], lazy_loops)
+            loop_variables = clean_loop_variables(arg['loop_variables'])
+
+            if lazy_loops:
+                return {'nodetype': 'reduce', 'name': 'sum', 'loop_variables': loop_variables,
+                        'expression': template}
+            args = unroll(template, loop_variables, loop_replace)
             return {'nodetype': 'call', 'name': 'sum', 'args': args}
 
-        args = [traversal(child) for child in node['arguments']]
+        args = [traversal(child, lazy_loops) for child in node['arguments']]
         return {'nodetype': 'call', 'name': name, 'args': args}
 
     if nodetype == 'sum':
-        args = [traversal(child) for child in node['operands']]
+        args = [traversal(child, lazy_loops) for child in node['operands']]
         return {'nodetype': 'call', 'name': 'sum', 'args': args}
 
     if nodetype == 'negate':
-        args = [traversal(node['operand'])]
+        args = [traversal(node['operand'], lazy_loops)]
         return {'nodetype': 'call', 'name': 'negate', 'args': args}
 
     if nodetype == 'invert':
-        args = [traversal(node['operand'])]
+        args = [traversal(node['operand'], lazy_loops)]
         return {'nodetype': 'call', 'name': 'invert', 'args': args}
 
     if nodetype == 'product':
-        args = [traversal(child) for child in node['operands']]
+        args = [traversal(child, lazy_loops) for child in node['operands']]
         return {'nodetype': 'call', 'name': 'product', 'args': args}
 
     if nodetype == 'ternary_operator':
-        arg1 = traversal(node['condition'])
-        arg2 = traversal(node['value_if_true'])
+        arg1 = traversal(node['condition'], lazy_loops)
+        arg2 = traversal(node['value_if_true'], lazy_loops)
         if 'value_if_false' in node:
-            arg3 = traversal(node['value_if_false'])
+            arg3 = traversal(node['value_if_false'], lazy_loops)
             return {'nodetype': 'call', 'name': 'ternary', 'args':
                     [arg1, arg2, arg3]}
         else:
             return {'nodetype': 'call', 'name': 'si', 'args': [arg1, arg2]}
 
     if nodetype == 'comparaison':
-        arg1 = traversal(node['left_operand'])
-        arg2 = traversal(node['right_operand'])
+        arg1 = traversal(node['left_operand'], lazy_loops)
+        arg2 = traversal(node['right_operand'], lazy_loops)
         name = 'operator:' + node['operator']
         return {'nodetype': 'call', 'name': name, 'args': [arg1, arg2]}
 
     if nodetype == 'boolean_expression':
-        args = [traversal(child) for child in node['operands']]
+        args = [traversal(child, lazy_loops) for child in node['operands']]
         operators = node['operators']
 
         if len(operators) == 1:
@@ -251,7 +432,8 @@ def traversal(node):
 
         args_ou = []
         args_et = []
-        operators.append('ou')
+        # The AST may be shared (see binary_dump): do not append to the operators list in place.
+        operators = operators + ['ou']
         for i, operator in enumerate(operators):
             arg_left = args[i]
             if operator == 'ou':
@@ -269,14 +451,14 @@ def traversal(node):
         return {'nodetype': 'call', 'name': 'boolean:ou', 'args': args_ou}
 
     if nodetype == 'dans':
-        arg1 = traversal(node['expression'])
+        arg1 = traversal(node['expression'], lazy_loops)
         enum_values = parse_enumeration(node['enumeration'])
         args = [arg1]
         args += [{'nodetype': 'float', 'value': float(v)} for v in enum_values]
         return {'nodetype': 'call', 'name': 'dans', 'args': args}
 
     if nodetype == 'unary':
-        arg = traversal(node['expression'])
+        arg = traversal(node['expression'], lazy_loops)
         name = 'unary:' + node['operator']
         return {'nodetype': 'call', 'name': name, 'args': [arg]}
 
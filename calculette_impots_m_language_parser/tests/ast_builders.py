@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+"""Build the AST nodes of the tests."""
+
+
+# Simplified AST, see `simplify_ast`
+
+def symbol(name):
+    return {'nodetype': 'symbol', 'name': name}
+
+
+def value(value):
+    return {'nodetype': 'float', 'value': value}
+
+
+def call(name, *args):
+    return {'nodetype': 'call', 'name': name, 'args': list(args)}
+
+
+# AST of the M files, see `m_to_ast`
+
+def m_symbol(name):
+    return {'type': 'symbol', 'value': name}
+
+
+def m_loop_variable(name, enumeration):
+    return {'type': 'loop_variable', 'name': name, 'enumerations': [enumeration]}
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equal
+
+from calculette_impots_m_language_parser import benchmark_suite
+
+
+def test_run_benchmark():
+    result = benchmark_suite.run_benchmark(benchmark_suite.Benchmark('list', lambda: [0] * 100000), repeat=2)
+    assert result['seconds'] > 0
+    assert result['peak_memory'] >= 800000
+
+
+def test_find_regressions():
+    previous_run = {'benchmarks': {'a': {'seconds': 1.0}, 'b': {'seconds': 1.0}, 'c': {'seconds': 1.0}}}
+    run = {'benchmarks': {'a': {'seconds': 1.1}, 'b': {'seconds': 1.5}, 'd': {'seconds': 9.0}}}
+    assert_equal(benchmark_suite.find_regressions(previous_run, run, threshold=0.2), [('b', 'seconds', 1.0, 1.5)])
+
+
+def test_find_memory_regressions():
+    previous_run = {'benchmarks': {
+        'a': {'seconds': 1.0, 'peak_memory': 100},
+        'b': {'seconds': 1.0, 'peak_memory': 100},
+        'c': {'seconds': 1.0, 'peak_memory': None},
+        }}
+    run = {'benchmarks': {
+        'a': {'seconds': 1.0, 'peak_memory': 130},
+        'b': {'seconds': 1.0, 'peak_memory': 160},
+        'c': {'seconds': 1.0, 'peak_memory': 1000},
+        }}
+    assert_equal(benchmark_suite.find_regressions(previous_run, run, threshold=0.2),
+                 [('a', 'peak_memory', 100, 130), ('b', 'peak_memory', 100, 160)])
+    assert_equal(benchmark_suite.find_regressions(previous_run, run, threshold=0.2, memory_threshold=0.5),
+                 [('b', 'peak_memory', 100, 160)])
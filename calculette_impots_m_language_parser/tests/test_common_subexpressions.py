@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equal
+
+from calculette_impots_m_language_parser import common_subexpressions
+from calculette_impots_m_language_parser.tests.ast_builders import call, symbol
+
+
+def test_eliminate_common_subexpressions():
+    shared = call('max', call('sum', symbol('A'), symbol('B')), {'nodetype': 'float', 'value': 0.0})
+    formulas = {
+        'X': call('positif', shared),
+        'Y': call('product', shared, shared),
+        'Z': call('sum', symbol('A'), symbol('B')),
+        }
+    new_formulas, stats = common_subexpressions.eliminate_common_subexpressions(formulas, min_tree_size=2)
+    # `sum(A, B)` is evaluated once by the hoisted `max(...)` and once by Z.
+    assert_equal(new_formulas, {
+        'X': call('positif', symbol('CSE_TMP_2')),
+        'Y': call('product', symbol('CSE_TMP_2'), symbol('CSE_TMP_2')),
+        'Z': symbol('CSE_TMP_1'),
+        'CSE_TMP_1': call('sum', symbol('A'), symbol('B')),
+        'CSE_TMP_2': call('max', symbol('CSE_TMP_1'), {'nodetype': 'float', 'value': 0.0}),
+        })
+    assert_equal((stats['tree_nodes'], stats['dag_nodes'], stats['nodes_after']), (20, 7, 12))
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equal
+
+from calculette_impots_m_language_parser import compact_ast
+from calculette_impots_m_language_parser.tests.ast_builders import symbol
+
+
+formulas = {
+    'A': {'nodetype': 'call', 'name': 'sum', 'args': [symbol('B'), symbol('C'), symbol('B')]},
+    'B': {'nodetype': 'call', 'name': 'max', 'args': [symbol('SAISIE'), {'nodetype': 'float', 'value': 0.0}]},
+    'D': symbol('INCONNU'),
+    }
+constants = {'C': 2.0}
+input_variables = [{'name': 'SAISIE', 'alias': '1AJ'}]
+
+
+def test_symbol_ids():
+    ast = compact_ast.from_simplified_ast(formulas, constants, input_variables)
+    assert_equal(ast.symbols.names, ['A', 'B', 'D', 'C', 'SAISIE', '1AJ', 'INCONNU'])
+    assert_equal(list(ast.symbols.kinds), [
+        compact_ast.FORMULA, compact_ast.FORMULA, compact_ast.FORMULA, compact_ast.CONSTANT, compact_ast.INPUT,
+        compact_ast.INPUT, compact_ast.UNKNOWN,
+        ])
+    assert_equal(list(ast.children(ast.symbols.get_id('A'))), [1, 3])
+    assert_equal(ast.get_useful_ids([0]), [0, 1, 3, 4])
+
+
+def test_round_trip():
+    ast = compact_ast.from_simplified_ast(formulas, constants, input_variables)
+    assert_equal(ast.to_simplified_ast(), (formulas, constants, input_variables))
+
+
+def test_round_trip_shadowed_constant():
+    shadowed_constants = dict(constants, B=3.0)
+    ast = compact_ast.from_simplified_ast(formulas, shadowed_constants, input_variables)
+    assert_equal(ast.symbols.kinds[ast.symbols.get_id('B')], compact_ast.FORMULA)
+    assert_equal(ast.to_simplified_ast(), (formulas, shadowed_constants, input_variables))
+
+
+def test_lazy_loops_expanded():
+    reduce_node = {
+        'nodetype': 'reduce', 'name': 'sum', 'expression': symbol('Bx'),
+        'loop_variables': [{'name': 'x', 'enumerations': [{'type': 'interval', 'first': '1', 'last': '2'}]}],
+        }
+    ast = compact_ast.from_simplified_ast({'A': reduce_node}, {}, [])
+    assert_equal([ast.symbols.names[child_id] for child_id in ast.children(0)], ['B1', 'B2'])
+    assert_equal(ast.expression(0), {'nodetype': 'call', 'name': 'sum', 'args': [symbol('B1'), symbol('B2')]})
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import tempfile
+
+from nose.tools import assert_equal
+
+from calculette_impots_m_language_parser import compile_ast
+from calculette_impots_m_language_parser.tests.ast_builders import call, symbol, value
+
+
+light_ast = {
+    'computing_order': ['RATIO', 'TOTAL', 'ARRONDI', 'TEST'],
+    'formulas_light': {
+        'RATIO': call('product', symbol('REVENU'), call('invert', symbol('PARTS'))),
+        'TOTAL': call('sum', symbol('RATIO'), symbol('PLAFOND'), call('negate', symbol('INCONNU'))),
+        'ARRONDI': call('arr', call('product', symbol('TOTAL'), value(0.5))),
+        'TEST': call('ternary', call('boolean:et', call('dans', symbol('PARTS'), value(1.0), value(2.0)),
+                                     call('operator:>', symbol('TOTAL'), value(0.0))),
+                     call('max', symbol('ARRONDI'), value(100.0)),
+                     call('unary:-', value(1.0))),
+        },
+    'constants_light': {'PLAFOND': 15.0},
+    'inputs_light': ['REVENU', 'PARTS'],
+    'unknowns_light': ['INCONNU'],
+    }
+
+
+def test_evaluate():
+    module = compile_ast.compile_light_ast(light_ast)
+    assert_equal(module.evaluate({'REVENU': 1000.0, 'PARTS': 2.0}),
+                 {'RATIO': 500.0, 'TOTAL': 515.0, 'ARRONDI': 258.0, 'TEST': 258.0})
+    # Division by zero gives 0.
+    assert_equal(module.evaluate({'REVENU': 1000.0}), {'RATIO': 0.0, 'TOTAL': 15.0, 'ARRONDI': 8.0, 'TEST': -1.0})
+
+
+def test_cache():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        module = compile_ast.compile_light_ast(light_ast, cache_dir)
+        cached_module = compile_ast.compile_light_ast(light_ast, cache_dir)
+        assert_equal(cached_module.__file__, module.__file__)
+        assert_equal(cached_module.evaluate({'REVENU': 30.0, 'PARTS': 3.0})['TOTAL'], 25.0)
+
+
+def test_evaluate_batch():
+    module = compile_ast.compile_light_ast(light_ast, backend='numpy')
+    results = module.evaluate_batch([[1000.0, 2.0], [1000.0, 0.0], [30.0, 3.0]], roots=['TOTAL', 'TEST'])
+    assert_equal(list(results), ['TOTAL', 'TEST'])
+    assert_equal(results['TOTAL'].tolist(), [515.0, 15.0, 25.0])
+    assert_equal(results['TEST'].tolist(), [258.0, -1.0, -1.0])
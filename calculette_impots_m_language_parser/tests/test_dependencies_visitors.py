@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import tempfile
+
+from nose.tools import assert_equal
+
+from calculette_impots_m_language_parser import dependencies_visitors, serialization
+from calculette_impots_m_language_parser.tests.ast_builders import m_loop_variable, m_symbol
+
+
+# A = si B alors Ci sinon D finsi + somme(i=1..2: Ci);
+# pour i=V,C: Ei = A - Fi;
+regle = {
+    'type': 'regle',
+    'formulas': [
+        {'type': 'formula', 'name': 'A', 'expression': {'type': 'sum', 'operands': [
+            {'type': 'ternary_operator', 'condition': m_symbol('B'), 'value_if_true': m_symbol('Ci'),
+             'value_if_false': m_symbol('D')},
+            {'type': 'function_call', 'name': 'somme', 'arguments': [{
+                'type': 'loop_expression',
+                'loop_variables': [m_loop_variable('i', {'type': 'interval', 'first': '1', 'last': '2'})],
+                'expression': m_symbol('Ci'),
+                }]},
+            ]}},
+        {'type': 'pour_formula',
+         'loop_variables': [m_loop_variable('i', {'type': 'enumeration_values', 'values': ['V', 'C']})],
+         'formula': {'type': 'formula', 'name': 'Ei', 'expression': {'type': 'sum', 'operands': [
+             m_symbol('A'), {'type': 'negate', 'operand': m_symbol('Fi')}]}}},
+        ],
+    }
+
+
+def test_iter_formulas_dependencies():
+    with tempfile.TemporaryDirectory() as source_dir:
+        serialization.dump([{'type': 'verif'}, regle], source_dir, 'chap-1')
+        assert_equal(list(dependencies_visitors.iter_formulas_dependencies(source_dir)), [
+            ('A', ['Ci', 'B', 'D', 'C1', 'C2']),
+            ('EV', ['A', 'FV']),
+            ('EC', ['A', 'FC']),
+            ])
+
+
+def test_visit_formula():
+    name, dependencies = dependencies_visitors.visit_node(regle['formulas'][0])
+    assert_equal((name, dependencies), ('A', ['Ci', 'B', 'D', 'C1', 'C2']))
+
+
+def test_nested_loops_and_debug_logging():
+    # pour i=V,C: Gi = somme(x=1..2: Hxi);
+    pour_formula = {
+        'type': 'pour_formula',
+        'loop_variables': [m_loop_variable('i', {'type': 'enumeration_values', 'values': ['V', 'C']})],
+        'formula': {'type': 'formula', 'name': 'Gi', 'expression': {'type': 'function_call', 'name': 'somme',
+                    'arguments': [{
+                        'type': 'loop_expression',
+                        'loop_variables': [m_loop_variable('x', {'type': 'interval', 'first': '1', 'last': '2'})],
+                        'expression': m_symbol('Hxi'),
+                        }]}},
+        }
+    nested_regle = dict(regle, formulas=regle['formulas'] + [pour_formula])
+    expected = [
+        ('A', ['Ci', 'B', 'D', 'C1', 'C2']),
+        ('EV', ['A', 'FV']),
+        ('EC', ['A', 'FC']),
+        ('GV', ['H1V', 'H2V']),
+        ('GC', ['H1C', 'H2C']),
+        ]
+    assert_equal(list(dependencies_visitors.visit_node(nested_regle)), expected)
+
+    log = dependencies_visitors.log
+    level = log.level
+    log.setLevel(logging.DEBUG)
+    try:
+        assert_equal(list(dependencies_visitors.visit_node(nested_regle)), expected)
+        assert_equal(dependencies_visitors.visit_node(regle['formulas'][0]), expected[0])
+    finally:
+        log.setLevel(level)
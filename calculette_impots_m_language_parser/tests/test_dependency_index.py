@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equal
+
+from calculette_impots_m_language_parser import dependency_index
+from calculette_impots_m_language_parser.tests.ast_builders import call, symbol
+
+
+formulas = {
+    'A': call('sum', symbol('B'), symbol('K')),
+    'B': call('sum', symbol('I'), symbol('U')),
+    'C': call('sum', symbol('B'), symbol('J')),
+    'D': symbol('J'),
+    }
+
+
+def test_slice():
+    index = dependency_index.DependencyIndex(formulas, {'K': 1.0}, ['I', 'ALIAS_I', 'J', 'ALIAS_J'])
+    dependency_slice = index.slice(['A', 'C'])
+    assert_equal(dependency_slice, dependency_index.DependencySlice(
+        formulas=['A', 'B', 'C'],
+        constants=['K'],
+        inputs=['I', 'J'],
+        unknowns=['U'],
+        computing_levels=[['B'], ['A', 'C']],
+        computing_order=['B', 'A', 'C'],
+        ))
+    assert_equal((index.hits, index.misses), (0, 2))
+
+    assert_equal(index.slice(['C', 'D']).formulas, ['B', 'C', 'D'])
+    assert_equal((index.hits, index.misses), (1, 3))
+
+
+def test_eviction():
+    index = dependency_index.DependencyIndex(formulas, {'K': 1.0}, ['I', 'J'], max_cached_closures=2)
+    for root in ['A', 'C', 'D']:
+        index.closure(root)
+    assert_equal(list(index.closure_by_name), ['C', 'D'])
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equal
+
+from calculette_impots_m_language_parser import fold_constants
+from calculette_impots_m_language_parser.tests.ast_builders import call, symbol, value
+
+
+def test_fold_constants():
+    formulas = {
+        'SEUIL': call('arr', call('product', symbol('PLAF'), symbol('TX'))),
+        'A': call('max', call('sum', symbol('R'), call('negate', symbol('SEUIL'))), value(0.0)),
+        'B': call('ternary', call('operator:>', symbol('SEUIL'), value(100.0)), symbol('A'), symbol('R')),
+        'C': call('boolean:et', call('dans', symbol('TX'), value(0.5), value(1.0)), symbol('R')),
+        }
+    new_formulas, constants, stats = fold_constants.fold_constants(formulas, {'PLAF': 250.5, 'TX': 0.5})
+    assert_equal(new_formulas, {
+        'A': call('max', call('sum', symbol('R'), value(-125.0)), value(0.0)),
+        'B': symbol('A'),
+        'C': call('boolean:et', symbol('R')),
+        })
+    assert_equal(constants, {'PLAF': 250.5, 'TX': 0.5, 'SEUIL': 125.0})
+    assert_equal((stats['formulas_after'], stats['constant_formulas']), (3, 1))
+
+
+def test_kept_formulas():
+    new_formulas, constants, stats = fold_constants.fold_constants(
+        {'A': call('invert', value(0.0))}, {}, kept_formulas=['A'])
+    assert_equal(new_formulas, {'A': value(0.0)})
+    assert_equal(constants, {})
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import inspect
+import os
+
+from arpeggio import NoMatch
+from nose.tools import assert_equal, raises
+
+from calculette_impots_m_language_parser import grammar_profiler, m_to_ast
+
+
+script_dir = os.path.dirname(inspect.getfile(inspect.currentframe()))
+
+
+def read_valid_formulas():
+    with open(os.path.join(script_dir, 'valid_formulas.m')) as f:
+        return f.read()
+
+
+def test_memoization_policies():
+    source_code = read_valid_formulas()
+    ast = m_to_ast.parse_m_file(source_code)
+    try:
+        for policy in [True, ['factor', 'symbol'], False]:
+            m_to_ast.set_memoization(policy)
+            assert_equal(m_to_ast.parse_m_file(source_code), ast)
+    finally:
+        m_to_ast.set_memoization(False)
+
+
+def test_memoized_rules_parse_the_same_input_again():
+    parser = m_to_ast.build_m_parser()
+    m_to_ast.apply_memoization(parser, ['factor', 'symbol'])
+    source_code = m_to_ast.preprocess(read_valid_formulas())
+    assert_equal(str(parser.parse(source_code)), str(parser.parse(source_code)))
+
+    invalid_source_code = source_code + '\nregle 1:\napplication : batch;\nA = (B + ;\n'
+    errors = []
+    for some_parser in [m_to_ast.build_m_parser(), parser, parser]:
+        try:
+            some_parser.parse(invalid_source_code)
+        except NoMatch as exc:
+            errors.append(exc)
+    assert errors[1] is not errors[2]
+    assert_equal(str(errors[1]), str(errors[2]))
+    # The error is at the same position as without memoization, but the memoized rules are not listed again in the
+    # expected rules.
+    assert_equal([(exc.line, exc.col) for exc in errors], [(invalid_source_code.count('\n'), 10)] * 3)
+
+
+@raises(ValueError)
+def test_unknown_memoized_rule():
+    m_to_ast.apply_memoization(m_to_ast.build_m_parser(), ['unknown_rule'])
+
+
+def test_profile():
+    profile, _ = grammar_profiler.profile_source_codes([read_valid_formulas()])
+    for stats in profile.values():
+        assert_equal(stats['attempts'], stats['successes'] + stats['failures'])
+    assert_equal(profile['m_source_file']['successes'], 1)
+    # function_call is tried before (symbol brackets) and factor_literal, which parse the same symbol again.
+    assert profile['function_call']['backtracked_chars'] > 0
+    assert profile['symbol']['repeated_attempts'] > 0
+
+    memoized_profile, _ = grammar_profiler.profile_source_codes([read_valid_formulas()], memoization=['symbol'])
+    assert_equal(memoized_profile['symbol']['attempts'], profile['symbol']['attempts'])
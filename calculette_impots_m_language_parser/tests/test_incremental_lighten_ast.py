@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import io
+import os
+import tempfile
+
+from nose.tools import assert_equal
+
+from calculette_impots_m_language_parser import incremental_lighten_ast, lighten_ast, serialization
+from calculette_impots_m_language_parser.tests.ast_builders import call, symbol
+
+
+formulas = {
+    'R': call('sum', symbol('A'), symbol('B')),
+    'A': call('sum', symbol('B'), symbol('K')),
+    'B': call('sum', symbol('C'), symbol('I')),
+    'C': symbol('U'),
+    'D': symbol('L'),
+    }
+constants = {'K': 1.0, 'L': 2.0}
+input_variables = [{'name': 'I', 'alias': 'AI'}, {'name': 'J', 'alias': 'AJ'}]
+inputs_list = ['AI', 'I', 'AJ', 'J']
+
+
+def read_light_ast(formulas, constants):
+    with tempfile.TemporaryDirectory() as source_dir, tempfile.TemporaryDirectory() as target_dir:
+        serialization.dump(formulas, source_dir, 'formulas')
+        serialization.dump(constants, source_dir, 'constants')
+        serialization.dump(input_variables, source_dir, 'input_variables')
+        with contextlib.redirect_stdout(io.StringIO()):
+            lighten_ast.lighten_ast(source_dir, target_dir, roots=['R'])
+        return read_files(target_dir)
+
+
+def read_files(target_dir):
+    files = {}
+    for file_name in os.listdir(target_dir):
+        with open(os.path.join(target_dir, file_name)) as f:
+            files[file_name] = f.read()
+    return files
+
+
+def test_update():
+    lightener = incremental_lighten_ast.IncrementalLightener(formulas, constants, inputs_list, roots=['R'])
+    new_formulas = dict(formulas)
+    new_constants = dict(constants)
+    for changed_formulas, changed_constants, recomputed_formulas in [
+            # B uses D instead of C, which is not useful anymore.
+            ({'B': call('sum', symbol('I'), symbol('D'))}, {}, {'A', 'B', 'D', 'R'}),
+            # C becomes an undefined name, and K a formula.
+            ({'C': None, 'K': symbol('J')}, {'K': None}, {'A', 'K', 'R'}),
+            ({}, {'L': 3.0, 'M': 4.0}, set()),
+            ]:
+        assert_equal(lightener.update(changed_formulas, changed_constants), recomputed_formulas)
+        for name, formula in changed_formulas.items():
+            new_formulas[name] = formula
+        for name, value in changed_constants.items():
+            new_constants[name] = value
+        new_formulas = {name: formula for name, formula in new_formulas.items() if formula is not None}
+        new_constants = {name: value for name, value in new_constants.items() if value is not None}
+
+        with tempfile.TemporaryDirectory() as target_dir:
+            lightener.save(target_dir)
+            assert_equal(read_files(target_dir), read_light_ast(new_formulas, new_constants))
+    assert_equal(lightener.computing_levels(), [['D', 'K'], ['B'], ['A'], ['R']])
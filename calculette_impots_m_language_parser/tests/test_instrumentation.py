@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+import inspect
+import os
+
+from nose.tools import assert_equal
+
+from calculette_impots_m_language_parser import instrumentation, m_to_ast, simplify_ast
+
+
+script_dir = os.path.dirname(inspect.getfile(inspect.currentframe()))
+
+
+def test_parse_report():
+    with open(os.path.join(script_dir, 'valid_formulas.m')) as f:
+        source_code = f.read()
+    with instrumentation.recording(instrumentation.Report(enabled=True)) as report:
+        data = m_to_ast.parse_m_file(source_code)
+    assert_equal(list(report.stages), ['m_to_ast.parse', 'm_to_ast.visit', 'm_to_ast.serialize'])
+    assert_equal(report.counters['m_to_ast.bytes_out'], len(data.encode('utf-8')))
+    assert report.counters['m_to_ast.nodes.formula'] > 0
+    assert instrumentation.report is not report
+
+
+def test_merge():
+    with instrumentation.recording(instrumentation.Report()) as report:
+        simplify_ast.unroll('Ai', [{'name': 'i', 'enumerations': [{'type': 'enumeration_values',
+                                                                    'values': ['V', 'C']}]}], str.replace)
+        with report.stage('stage'):
+            pass
+    total_report = instrumentation.Report()
+    total_report.merge(report.to_dict())
+    total_report.merge(report.to_dict())
+    assert_equal(total_report.stages['stage']['calls'], 2)
+    assert_equal(dict(total_report.counters), {'simplify_ast.unrolled_loops': 2, 'simplify_ast.unrolled_copies': 4})
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equal, raises
+
+from calculette_impots_m_language_parser import compact_ast, lighten_ast
+from calculette_impots_m_language_parser.tests.ast_builders import call, symbol, value
+
+
+def test_get_useful_nodes():
+    children_dict = {
+        'A': {'B'},
+        'B': {'C', 'K'},
+        'C': {'I'},
+        'D': {'A', 'U'},
+        'E': set(),
+        }
+    formulas = dict.fromkeys(children_dict)
+    useful_nodes = lighten_ast.get_useful_nodes(['D', 'A'], formulas, {'K': 1.0}, ['ALIAS', 'I'], children_dict, {'U'})
+    assert_equal(useful_nodes, (['A', 'B', 'C', 'D'], ['K'], ['I'], ['U']))
+
+
+def test_get_compact_useful_nodes():
+    formulas = {
+        'A': symbol('B'),
+        'B': call('sum', symbol('C'), symbol('K')),
+        'C': symbol('I'),
+        'D': call('sum', symbol('A'), symbol('U')),
+        'E': value(0.0),
+        }
+    ast = compact_ast.from_simplified_ast(formulas, {'K': 1.0}, [{'name': 'I', 'alias': 'ALIAS'}])
+    useful_nodes = lighten_ast.get_compact_useful_nodes(['D', 'A'], ast)
+    assert_equal(useful_nodes, [['A', 'B', 'C', 'D'], ['K'], ['I'], ['U']])
+    assert_equal(lighten_ast.compute_compact_children_light(ast, useful_nodes[0]),
+                 {'A': ['B'], 'B': ['C'], 'C': [], 'D': ['A']})
+
+
+def test_compute_computing_levels():
+    children_light = {'A': ['B', 'C'], 'B': ['C'], 'C': [], 'D': []}
+    assert_equal(lighten_ast.compute_computing_levels(children_light), [['C', 'D'], ['B'], ['A']])
+
+
+@raises(ValueError)
+def test_compute_computing_levels_cycle():
+    lighten_ast.compute_computing_levels({'A': ['B'], 'B': ['A'], 'C': []})
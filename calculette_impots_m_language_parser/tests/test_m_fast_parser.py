@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+from nose.tools import assert_equal, raises
+
+from calculette_impots_m_language_parser import m_fast_parser, m_to_ast
+
+
+script_dir_path = os.path.dirname(os.path.abspath(__file__))
+
+# Every kind of declaration, and the constructions of the expressions which MLanguageVisitor transforms.
+declarations_source_code = '''
+application iliad ;
+enchaineur BASE_STRATEMAJO application : iliad , batch ;
+#commentaire
+V_ANREV : calculee : "annee des revenus" type ENTIER ;
+TSNN2 : tableau[12] calculee base restituee : "  traitements" ;
+MAJO : calculee restituee : "" ;
+TX_MICFON : const=30.00 ;
+V_0AC : saisie famille classe = 0 priorite = 31 restituee alias AC : "Case C" type BOOLEEN ;
+1AJ : saisie revenu classe = 1 alias AJ : "Salaires" ;
+A000 : anomalie : "A" : "000" : "00" : "SENS" : "N" ;
+A001 : discordance : "A" : "001" : "00" : "SENS" ;
+sortie(V_CALCUL) ;
+regle irisf 1:
+application : iliad , batch ;
+enchaineur : BASE_STRATEMAJO ;
+pour i=V,C,P:
+TSNi = somme(x=1..4,6: GLNxi) + somme(un j dans 01..03 et un k dans A,B: RjkMM) - 3 * (4 - -2.5) / X;
+R[DGFIP] = si (V_IND_TRAIT = 4 et X non dans (1,2,A) ou Y dans (3..5)) alors -A[X] sinon +max(0, B >= C, -1.5) finsi;
+K = si A > B alors 1 finsi * -(A + B) / C;
+verif 1000:
+application : batch , iliad ;
+si APPLI_OCEANS = 0 et (V_0AC + V_0AD) != 0 alors erreur A000 ;
+si positif(X) <= 1 alors erreur A001 V_ANREV ;
+'''
+
+
+def assert_same_ast(source_code):
+    for linecol in (True, False):
+        assert_equal(m_to_ast.parse_m_file(source_code, linecol=linecol, backend='fast'),
+                     m_to_ast.parse_m_file(source_code, linecol=linecol))
+
+
+def test_valid_formulas():
+    with open(os.path.join(script_dir_path, 'valid_formulas.m')) as m_file:
+        assert_same_ast(m_file.read())
+
+
+def test_declarations():
+    assert_same_ast(declarations_source_code)
+
+
+def test_parse_by_declaration_error():
+    source_code = '''
+regle 1:
+application : iliad , batch  ;
+a = 1;
+regle 2:
+application : iliad , batch  ;
+b = 2 +;
+A : calculee : "variable A" ;
+'''
+    ast, errors = m_to_ast.parse_m_file_by_declaration(source_code, backend='fast')
+    assert_equal([node['name'] for node in json.loads(ast)], ['1', 'A'])
+    assert_equal([(error['first_line'], error['line'], error['column']) for error in errors], [(5, 7, 8)])
+
+
+@raises(m_fast_parser.ParseError)
+def test_syntax_error():
+    m_fast_parser.parse('regle 1:\napplication : iliad ;\na = (1;\n')
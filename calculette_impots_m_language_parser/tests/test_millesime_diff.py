@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import tempfile
+
+from nose.tools import assert_equal
+
+from calculette_impots_m_language_parser import dependency_index, millesime_diff, serialization
+from calculette_impots_m_language_parser.tests.ast_builders import call, symbol
+
+
+old_formulas = {
+    'A': call('sum', symbol('B'), symbol('K')),
+    'B': call('sum', symbol('I'), symbol('U')),
+    'C': symbol('J'),
+    'D': call('sum', symbol('C'), symbol('L')),
+    'E': symbol('D'),
+    }
+new_formulas = dict(
+    old_formulas,
+    C=call('sum', symbol('J'), symbol('I')),
+    F=symbol('A'),
+    )
+del new_formulas['E']
+
+
+def load_hashes(formulas, constants, input_variables):
+    with tempfile.TemporaryDirectory() as source_dir:
+        serialization.dump(formulas, source_dir, 'formulas')
+        serialization.dump(constants, source_dir, 'constants')
+        serialization.dump(input_variables, source_dir, 'input_variables')
+        return millesime_diff.load_hashes(source_dir)
+
+
+def test_diff_millesimes():
+    old_hashes = load_hashes(old_formulas, {'K': 1.0, 'L': 2.0}, [{'name': 'I', 'alias': 'AI'}])
+    new_hashes = load_hashes(new_formulas, {'K': 1.0, 'L': 3.0},
+                             [{'name': 'I', 'alias': 'AI'}, {'name': 'J', 'alias': 'AJ'}])
+    assert_equal(millesime_diff.diff_hashes(old_hashes, new_hashes), millesime_diff.MillesimeDiff(
+        added_formulas=['F'],
+        removed_formulas=['E'],
+        changed_formulas=['C'],
+        added_constants=[],
+        removed_constants=[],
+        changed_constants=['L'],
+        added_inputs=['J'],
+        removed_inputs=[],
+        changed_inputs=[],
+        ))
+
+    changed_symbols = millesime_diff.changed_symbols(old_hashes, new_hashes)
+    assert_equal(changed_symbols, {'AJ', 'C', 'E', 'F', 'J', 'L'})
+
+    # A and B do not depend on a changed symbol: their closures are reused.
+    old_index = dependency_index.DependencyIndex(old_formulas, {'K': 1.0, 'L': 2.0}, ['I', 'AI'])
+    for name in old_formulas:
+        old_index.closure(name)
+    new_index, affected_formulas = dependency_index.reuse(
+        old_index, new_formulas, {'K': 1.0, 'L': 3.0}, ['I', 'AI', 'J', 'AJ'], changed_symbols)
+    assert_equal(affected_formulas, {'C', 'D', 'F'})
+    assert_equal(sorted(new_index.closure_by_name), ['A', 'B'])
+    full_index = dependency_index.DependencyIndex(new_formulas, {'K': 1.0, 'L': 3.0}, ['I', 'AI', 'J', 'AJ'])
+    assert_equal(new_index.slice(['D', 'F']), full_index.slice(['D', 'F']))
+
+
+def test_hash_lazy_formulas():
+    loop_variables = [{'name': 'i', 'enumerations': [{'type': 'enumeration_values', 'values': ['V', 'C']}]}]
+    lazy_formulas = {'Bi[i=V,C]': {'nodetype': 'map', 'name': 'Bi', 'loop_variables': loop_variables,
+                                   'expression': {'nodetype': 'reduce', 'name': 'sum', 'loop_variables': loop_variables,
+                                                  'expression': symbol('Xi')}}}
+    eager_expression = call('sum', symbol('XV'), symbol('XC'))
+    assert_equal(millesime_diff.hash_formulas(lazy_formulas),
+                 millesime_diff.hash_formulas({'BV': eager_expression, 'BC': eager_expression}))
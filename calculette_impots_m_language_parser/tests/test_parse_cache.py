@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+
+from nose.tools import assert_equal
+
+from calculette_impots_m_language_parser import m_to_ast, parse_cache
+
+
+source_code = '''
+regle 999:
+application : iliad , batch  ;
+a = 1;
+'''
+
+
+def test_hit_and_miss():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = parse_cache.ParseCache(cache_dir)
+        first_ast = cache.parse_m_file(source_code)
+        second_ast = cache.parse_m_file(source_code)
+        assert_equal((cache.hits, cache.misses), (1, 1))
+        assert_equal(first_ast, m_to_ast.parse_m_file(source_code))
+        assert_equal(second_ast, first_ast)
+
+        cache.parse_m_file(source_code.replace('a = 1', 'a = 2'))
+        assert_equal((cache.hits, cache.misses), (1, 2))
+
+
+def test_evict_least_recently_used():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = parse_cache.ParseCache(cache_dir)
+        old_source_code = source_code.replace('a = 1', 'a = 2')
+        cache.parse_m_file(old_source_code)
+        old_entry_path = cache.entry_path(old_source_code)
+        os.utime(old_entry_path, (0, 0))
+        cache.parse_m_file(source_code)
+
+        cache.max_size = os.path.getsize(cache.entry_path(source_code))
+        assert_equal(cache.evict(), 1)
+        assert_equal(os.path.exists(old_entry_path), False)
+        assert_equal(os.path.exists(cache.entry_path(source_code)), True)
+
+
+def test_backends_have_their_own_entries():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        arpeggio_cache = parse_cache.ParseCache(cache_dir)
+        fast_cache = parse_cache.ParseCache(cache_dir, backend='fast')
+        assert_equal(arpeggio_cache.entry_path(source_code) == fast_cache.entry_path(source_code), False)
+        arpeggio_cache.parse_m_file(source_code)
+        assert_equal(fast_cache.get(source_code), None)
+        assert_equal(fast_cache.parse_m_file(source_code), arpeggio_cache.get(source_code))
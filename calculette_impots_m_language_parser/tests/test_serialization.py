@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import tempfile
+
+from nose.tools import assert_equal, assert_is, assert_is_not, raises
+
+from calculette_impots_m_language_parser import binary_dump, json_dump, m_to_ast, serialization
+
+
+script_dir_path = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_binary_round_trip():
+    with open(os.path.join(script_dir_path, 'valid_formulas.m')) as m_file:
+        ast = json.loads(m_to_ast.parse_m_file(m_file.read()))
+    loaded_ast = binary_dump.loads(binary_dump.dumps(ast))
+    assert_equal(loaded_ast, json.loads(json_dump.dumps(ast)))
+
+
+def test_shared_subtrees():
+    symbol = {'type': 'symbol', 'value': 'A'}
+    data = binary_dump.dumps([symbol, dict(symbol)])
+    loaded = binary_dump.loads_shared(data)
+    assert_is(loaded[0], loaded[1])
+    loaded = binary_dump.loads(data)
+    assert_equal(loaded, [symbol, symbol])
+    assert_is_not(loaded[0], loaded[1])
+
+
+@raises(ValueError)
+def test_other_python_version():
+    data = binary_dump.dumps({'a': 1})
+    binary_dump.loads(binary_dump.magic + bytes([2, 7, binary_dump.marshal_version]) + data[len(binary_dump.header):])
+
+
+def test_load_prefers_binary():
+    with tempfile.TemporaryDirectory() as directory:
+        serialization.dump({'a': 1}, directory, 'constants', 'json')
+        serialization.dump({'a': 2}, directory, 'constants', 'binary')
+        assert_equal(serialization.load(directory, 'constants'), {'a': 2})
+        assert_equal(serialization.list_files(directory), [os.path.join(directory, 'constants.mast')])
+
+
+def test_list_files_sorted():
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ['chap-3', 'chap-1', 'chap-2']:
+            serialization.dump([], directory, name, 'json')
+        assert_equal(serialization.list_files(directory), [
+            os.path.join(directory, name + '.json') for name in ['chap-1', 'chap-2', 'chap-3']])
+
+
+def test_iter_file_items():
+    items = [
+        {'type': 'regle', 'linecol': [[1, 1], [2, 3]], 'formulas': [{'name': 'A', 'linecol': [[2, 1], [2, 3]]}]},
+        12,
+        ]
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = serialization.dump(items, directory, 'chap-1', 'json')
+        assert_equal(list(serialization.iter_file_items(file_path, dropped_keys=['linecol'])), [
+            {'type': 'regle', 'formulas': [{'name': 'A'}]},
+            12,
+            ])
+        with open(file_path) as f:
+            assert_equal(list(json_dump.iter_loads(f, chunk_size=3)), items)
+        file_path = serialization.dump(items, directory, 'chap-1', 'binary')
+        assert_equal(list(serialization.iter_file_items(file_path)), items)
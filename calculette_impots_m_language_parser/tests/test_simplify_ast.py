@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import io
+import os
+import tempfile
+
+from nose.tools import assert_equal
+
+from calculette_impots_m_language_parser import lighten_ast, serialization, simplify_ast
+from calculette_impots_m_language_parser.tests.ast_builders import m_loop_variable, m_symbol
+
+
+# pour i=V,C: TPRi = TSNi + somme(x=1..3: GLNxi) + somme(y=1,2: somme(x=1..2: Ayx));
+formulas = [
+    {
+        'type': 'pour_formula',
+        'loop_variables': [m_loop_variable('i', {'type': 'enumeration_values', 'values': ['V', 'C']})],
+        'formula': {'type': 'formula', 'name': 'TPRi', 'expression': {'type': 'sum', 'operands': [
+            m_symbol('TSNi'),
+            {'type': 'function_call', 'name': 'somme', 'arguments': [{
+                'type': 'loop_expression',
+                'loop_variables': [m_loop_variable('x', {'type': 'interval', 'first': '1', 'last': '3'})],
+                'expression': m_symbol('GLNxi'),
+                }]},
+            ]}},
+        },
+    {
+        'type': 'formula',
+        'name': 'B',
+        'expression': {'type': 'function_call', 'name': 'somme', 'arguments': [{
+            'type': 'loop_expression',
+            'loop_variables': [m_loop_variable('y', {'type': 'enumeration_values', 'values': [1, 2]})],
+            'expression': {'type': 'function_call', 'name': 'somme', 'arguments': [{
+                'type': 'loop_expression',
+                'loop_variables': [m_loop_variable('x', {'type': 'interval', 'first': '1', 'last': '2'})],
+                'expression': m_symbol('Ayx'),
+                }]},
+            }]},
+        },
+    ]
+
+
+def formulas_dict(lazy_loops):
+    return {
+        formula['name']: formula['expression']
+        for formula in simplify_ast.clean_formulas(formulas, lazy_loops)
+        }
+
+
+def test_lazy_loops():
+    eager_formulas = formulas_dict(lazy_loops=False)
+    lazy_formulas = formulas_dict(lazy_loops=True)
+    assert_equal(sorted(eager_formulas), ['B', 'TPRC', 'TPRV'])
+    assert_equal(sorted(lazy_formulas), ['B', 'TPRi[i=V,C]'])
+    assert_equal(lazy_formulas['B']['nodetype'], 'reduce')
+    assert_equal(simplify_ast.expand_formulas(lazy_formulas), eager_formulas)
+
+    expanded_maps = simplify_ast.expand_formula_maps(lazy_formulas)
+    for name, expression in eager_formulas.items():
+        assert_equal(lighten_ast.get_children(expanded_maps[name]), lighten_ast.get_children(expression))
+    assert_equal(lighten_ast.get_children(expanded_maps['TPRC']), {'TSNC', 'GLN1C', 'GLN2C', 'GLN3C'})
+
+
+def write_and_simplify(declarations, lazy_loops=False):
+    with tempfile.TemporaryDirectory() as source_dir, tempfile.TemporaryDirectory() as target_dir:
+        serialization.dump(declarations, source_dir, 'chap-1')
+        with contextlib.redirect_stdout(io.StringIO()):
+            simplify_ast.simplify_ast(source_dir, target_dir, lazy_loops=lazy_loops)
+        return serialization.load(target_dir, 'formulas'), serialization.load(target_dir, 'constants')
+
+
+def test_simplify_ast():
+    simplified_formulas, constants = write_and_simplify([
+        {'type': 'variable_const', 'name': 'CST', 'value': '2'},
+        {'type': 'regle', 'applications': ['batch'], 'formulas': formulas},
+        {'type': 'regle', 'applications': ['iliad'], 'formulas': formulas},
+        ])
+    assert_equal(simplified_formulas, formulas_dict(lazy_loops=False))
+    assert_equal(constants, {'CST': 2.0})
+
+
+def test_formula_defined_twice():
+    redefined_b = {'type': 'formula', 'name': 'B', 'expression': m_symbol('C')}
+    simplified_formulas, constants = write_and_simplify([
+        {'type': 'regle', 'applications': ['batch'], 'formulas': formulas + [redefined_b]},
+        ])
+    assert_equal(simplified_formulas, dict(formulas_dict(lazy_loops=False), B={'nodetype': 'symbol', 'name': 'C'}))
+
+
+def test_formula_defined_twice_lazy_loops():
+    redefined_b = {'type': 'formula', 'name': 'B', 'expression': m_symbol('C')}
+    simplified_formulas, constants = write_and_simplify([
+        {'type': 'regle', 'applications': ['batch'], 'formulas': formulas + [redefined_b] + formulas[:1]},
+        ], lazy_loops=True)
+    assert_equal(list(simplified_formulas), ['B', 'TPRi[i=V,C]'])
+    assert_equal(simplified_formulas, dict(formulas_dict(lazy_loops=True), B={'nodetype': 'symbol', 'name': 'C'}))
+
+
+def test_simplified_ast_dir():
+    with tempfile.TemporaryDirectory() as millesime_dir:
+        os.makedirs(os.path.join(millesime_dir, '1_ast_by_file'))
+        serialization.dump([{'type': 'regle', 'applications': ['batch'], 'formulas': formulas}],
+                           os.path.join(millesime_dir, '1_ast_by_file'), 'chap-1')
+        with contextlib.redirect_stdout(io.StringIO()), simplify_ast.simplified_ast_dir(millesime_dir) as source_dir:
+            assert_equal(serialization.load(source_dir, 'formulas'), formulas_dict(lazy_loops=False))
+        assert not os.path.exists(source_dir)
+
+        os.makedirs(os.path.join(millesime_dir, '2_simplified_ast'))
+        serialization.dump({}, os.path.join(millesime_dir, '2_simplified_ast'), 'formulas')
+        with simplify_ast.simplified_ast_dir(millesime_dir) as source_dir:
+            assert_equal(source_dir, os.path.join(millesime_dir, '2_simplified_ast'))
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equal, assert_is
+
+from calculette_impots_m_language_parser import unloop_helpers
+from calculette_impots_m_language_parser.tests.ast_builders import m_loop_variable, m_symbol
+
+
+loop_variables_nodes = [
+    m_loop_variable('i', {'type': 'enumeration_values', 'values': ['V', 'C']}),
+    m_loop_variable('x', {'type': 'interval', 'first': '01', 'last': '02'}),
+    ]
+formula = {
+    'type': 'formula',
+    'name': 'Ai',
+    'expression': {'type': 'sum', 'operands': [m_symbol('Bxi'), {'type': 'negate', 'operand': m_symbol('CST')}]},
+    }
+
+
+def test_unlooped_nodes():
+    template = unloop_helpers.UnloopTemplate(formula, loop_variables_nodes, unloop_keys=['name'])
+    nodes = list(template.iter_unlooped_views())
+    assert_equal(
+        [(node['name'], node['expression']['operands'][0]['value']) for node in nodes],
+        [('AV', 'B01V'), ('AV', 'B02V'), ('AC', 'B01C'), ('AC', 'B02C')],
+        )
+    # The subtrees without loop variables are shared with the template, which is not modified.
+    assert_is(nodes[0]['expression']['operands'][1], formula['expression']['operands'][1])
+    assert_equal(formula['expression']['operands'][0]['value'], 'Bxi')
+    assert_equal(template.contains_loops, False)
+
+    assert_equal(
+        list(template.iter_substituted_names(['Bxi', 'CST'])),
+        [['B01V', 'CST'], ['B02V', 'CST'], ['B01C', 'CST'], ['B02C', 'CST']],
+        )
+    assert_equal(unloop_helpers.unlooped(m_symbol('Xii'), {'i': 'V'}), m_symbol('XVi'))
+
+
+def test_unlooped_copies():
+    shared_symbol = m_symbol('Bi')
+    node = {'type': 'sum', 'operands': [shared_symbol, shared_symbol, m_symbol('CST')]}
+    nodes = list(unloop_helpers.iter_unlooped_nodes(node, loop_variables_nodes[:1]))
+    assert_equal([[operand['value'] for operand in node['operands']] for node in nodes],
+                 [['BV', 'BV', 'CST'], ['BC', 'BC', 'CST']])
+    nodes[0]['operands'][2]['value'] = 'X'
+    assert_equal(nodes[1]['operands'][2]['value'], 'CST')
+    assert_equal(node['operands'][2]['value'], 'CST')
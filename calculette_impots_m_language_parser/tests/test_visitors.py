@@ -1,29 +1,29 @@
 # -*- coding: utf-8 -*-
 
+import json
 import os
-import pkg_resources
+import tempfile
 
 from arpeggio import visit_parse_tree
-from arpeggio.cleanpeg import ParserPEG
-from nose.tools import assert_equal
+from nose.tools import assert_equal, raises
 
-from calculette_impots_m_language_parser.scripts import m_to_ast
+from calculette_impots_m_language_parser import m_to_ast
 
 
 script_dir_path = os.path.dirname(os.path.abspath(__file__))
-distribution_dir_path = pkg_resources.get_distribution('calculette_impots_m_language_parser').location
-m_grammar_file_path = os.path.join(distribution_dir_path, 'm_language.cleanpeg')
 
-with open(m_grammar_file_path) as m_grammar_file:
+m_parser = m_to_ast.get_m_parser()
+with open(m_to_ast.m_grammar_file_path) as m_grammar_file:
     m_grammar = m_grammar_file.read()
-m_parser = m_to_ast.m_parser = ParserPEG(m_grammar, 'm_source_file', reduce_tree=False)
 
 
-class args(object):
-    debug = False
-    no_order = False
+def visitor(source_code):
+    return m_to_ast.MLanguageVisitor(line_index=m_to_ast.LineIndex(source_code))
 
-m_to_ast.args = args
+
+@raises(ValueError)
+def test_visitor_without_line_index():
+    m_to_ast.MLanguageVisitor()
 
 
 def test_smoke():
@@ -33,7 +33,7 @@ def test_smoke():
         source_code = smoke_m_file.read()
 
     parse_tree = m_parser.parse(source_code)
-    nodes = visit_parse_tree(parse_tree, m_to_ast.MLanguageVisitor())
+    nodes = visit_parse_tree(parse_tree, visitor(source_code))
     assert_equal(isinstance(nodes, list), True)
 
 
@@ -45,10 +45,11 @@ application : iliad , batch  ;
 a = 1;
 '''
     parse_tree = m_parser.parse(source_code)
-    nodes = visit_parse_tree(parse_tree, m_to_ast.MLanguageVisitor())
+    nodes = visit_parse_tree(parse_tree, visitor(source_code))
     assert_equal(len(nodes), 1)
     assert_equal(nodes[0]['type'], 'regle')
     assert_equal(nodes[0]['name'], '007')
+    assert_equal(nodes[0]['linecol'], ((2, 1), (4, 1)))
 
 
 def test_assign():
@@ -59,7 +60,7 @@ application : iliad , batch  ;
 a = 1;
 '''
     parse_tree = m_parser.parse(source_code)
-    nodes = visit_parse_tree(parse_tree, m_to_ast.MLanguageVisitor())
+    nodes = visit_parse_tree(parse_tree, visitor(source_code))
     assert_equal(len(nodes), 1)
     assert_equal(nodes[0]['type'], 'regle')
     assert_equal(nodes[0]['name'], '999')
@@ -82,7 +83,7 @@ application : iliad, batch  ;
 apple = 1 - 3 + a;
 '''
     parse_tree = m_parser.parse(source_code)
-    nodes = visit_parse_tree(parse_tree, m_to_ast.MLanguageVisitor())
+    nodes = visit_parse_tree(parse_tree, visitor(source_code))
     assert_equal(len(nodes), 1)
     assert_equal(nodes[0]['type'], 'regle')
     assert_equal(nodes[0]['name'], '123')
@@ -112,7 +113,7 @@ application : iliad, batch;
 apple = 3* a * b /c;
 '''
     parse_tree = m_parser.parse(source_code)
-    nodes = visit_parse_tree(parse_tree, m_to_ast.MLanguageVisitor())
+    nodes = visit_parse_tree(parse_tree, visitor(source_code))
     assert_equal(len(nodes), 1)
     assert_equal(nodes[0]['type'], 'regle')
     assert_equal(nodes[0]['name'], '123')
@@ -143,7 +144,7 @@ application : iliad, batch;
 apple = 3.14*a / (b + 3) - 4;
 '''
     parse_tree = m_parser.parse(source_code)
-    nodes = visit_parse_tree(parse_tree, m_to_ast.MLanguageVisitor())
+    nodes = visit_parse_tree(parse_tree, visitor(source_code))
     assert_equal(len(nodes), 1)
     assert_equal(nodes[0]['type'], 'regle')
     assert_equal(nodes[0]['name'], '123')
@@ -168,3 +169,56 @@ apple = 3.14*a / (b + 3) - 4;
     assert_equal(nodes[0]['formulas'][0]['expression']['operands'][1]['type'], 'negate')
     assert_equal(nodes[0]['formulas'][0]['expression']['operands'][1]['operand']['type'], 'integer')
     assert_equal(nodes[0]['formulas'][0]['expression']['operands'][1]['operand']['value'], 4)
+
+
+def test_saved_parser():
+    '''Test that a parser saved to a file parses like the compiled one'''
+    source_code = '''
+regle 999:
+application : iliad , batch  ;
+a = 1;
+'''
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        parser_file_path = os.path.join(temporary_dir, 'm_parser.pickle')
+        m_to_ast.save_m_parser(m_parser, parser_file_path, m_grammar)
+        saved_parser = m_to_ast.load_m_parser(parser_file_path, m_grammar)
+        assert_equal(m_to_ast.load_m_parser(parser_file_path, m_grammar + '\n'), None)
+
+    m_to_ast.m_parser = saved_parser
+    try:
+        nodes = visit_parse_tree(saved_parser.parse(source_code), visitor(source_code))
+    finally:
+        m_to_ast.m_parser = m_parser
+    assert_equal(nodes, visit_parse_tree(m_parser.parse(source_code), visitor(source_code)))
+
+
+def test_parse_by_declaration():
+    '''Test that parsing declaration by declaration gives the same AST as parsing the whole file'''
+    smoke_m_file_path = os.path.join(script_dir_path, 'valid_formulas.m')
+
+    with open(smoke_m_file_path) as smoke_m_file:
+        source_code = smoke_m_file.read()
+
+    ast, errors = m_to_ast.parse_m_file_by_declaration(source_code)
+    assert_equal(errors, [])
+    assert_equal(ast, m_to_ast.parse_m_file(source_code))
+
+
+def test_parse_by_declaration_error():
+    '''Test that a syntax error only drops the declaration containing it'''
+    source_code = '''
+regle 1:
+application : iliad , batch  ;
+a = 1;
+regle 2:
+application : iliad , batch  ;
+b = 2 +;
+A : calculee : "variable A" ;
+'''
+    ast, errors = m_to_ast.parse_m_file_by_declaration(source_code)
+    nodes = json.loads(ast)
+    assert_equal([node['name'] for node in nodes], ['1', 'A'])
+    assert_equal(len(errors), 1)
+    assert_equal(errors[0]['first_line'], 5)
+    assert_equal(errors[0]['line'], 7)
+    assert_equal(nodes[1]['linecol'], [[8, 1], [8, 29]])
@@ -4,10 +4,12 @@
 """
 Unloop helpers are functions which deal with M language loops.
 They take a node containing a loop and return as many "unlooped" nodes as the number of combination of loop variables.
+
+`unlooped` and `iter_unlooped_nodes` return independent copies. The views of `UnloopTemplate` share their subtrees
+without loop variables with the template, which is faster, and must not be modified.
 """
 
 
-import copy
 import itertools
 
 from toolz import mapcat
@@ -29,51 +31,54 @@ def enumeration_node_to_sequence(enumeration_node):
 
 
 def iter_unlooped_nodes(node, loop_variables_nodes, unloop_keys=None):
-    loop_variables_names, sequences = zip(*map(
-        lambda loop_variable_node: (
-            loop_variable_node['name'],
-            mapcat(
-                enumeration_node_to_sequence,
-                loop_variable_node['enumerations'],
-                ),
-            ),
-        loop_variables_nodes,
-        ))
-    loop_variables_values_list = itertools.product(*sequences)
-    for loop_variables_values in loop_variables_values_list:
-        value_by_loop_variable_name = dict(zip(loop_variables_names, loop_variables_values))
-        yield unlooped(
-            node=node,
-            unloop_keys=unloop_keys,
-            value_by_loop_variable_name=value_by_loop_variable_name,
-            )
+    template = UnloopTemplate(node, loop_variables_nodes, unloop_keys)
+    for value_by_loop_variable_name in template.iter_value_dicts():
+        yield unlooped(node, value_by_loop_variable_name, unloop_keys)
 
 
 def unlooped(node, value_by_loop_variable_name, unloop_keys=None):
     """
     Replace loop variables names by values given by `value_by_loop_variable_name` in symbols recursively found
-    in `node`.
+    in a copy of `node`.
     """
-    new_node = copy.deepcopy(node)
+    new_node = unshared_copy(node)
     update_symbols(
         node=new_node,
         value_by_loop_variable_name=value_by_loop_variable_name,
         )
     if unloop_keys is not None:
         for key in unloop_keys:
-            for loop_variable_name, loop_variable_value in value_by_loop_variable_name.items():
-                new_node[key] = new_node[key].replace(loop_variable_name, str(loop_variable_value), 1)
+            new_node[key] = substitute(new_node[key], value_by_loop_variable_name)
     return new_node
 
 
+def substitute(name, value_by_loop_variable_name):
+    """Replace the first occurrence of each loop variable name in `name`, in the order of the loop variables."""
+    for loop_variable_name, loop_variable_value in value_by_loop_variable_name.items():
+        name = name.replace(loop_variable_name, str(loop_variable_value), 1)
+    return name
+
+
+def unshared_copy(node):
+    """
+    Copy the dicts and lists of `node`. Unlike `copy.deepcopy`, a subtree found twice in `node` (see `binary_dump`) is
+    copied twice, so that `update_symbols` substitutes it once.
+    """
+    if isinstance(node, dict):
+        return {key: unshared_copy(value) for key, value in node.items()}
+    elif isinstance(node, list):
+        return [unshared_copy(child_node) for child_node in node]
+    else:
+        return node
+
+
 def update_symbols(node, value_by_loop_variable_name):
     """
     This function mutates `node` and returns nothing. Better use the `unlooped` function.
     """
     if isinstance(node, dict):
         if node['type'] == 'symbol':
-            for loop_variable_name, loop_variable_value in value_by_loop_variable_name.items():
-                node['value'] = node['value'].replace(loop_variable_name, str(loop_variable_value), 1)
+            node['value'] = substitute(node['value'], value_by_loop_variable_name)
         else:
             update_symbols(
                 node=list(node.values()),
@@ -85,3 +90,90 @@ def update_symbols(node, value_by_loop_variable_name):
                 node=child_node,
                 value_by_loop_variable_name=value_by_loop_variable_name,
                 )
+
+
+class UnloopTemplate(object):
+    """
+    Substitution of the loop variables of a node, prepared once for all the combinations of their values.
+
+    The paths from the node to the symbols containing a loop variable name are recorded when the template is built.
+    An unlooped view only copies the dicts and lists along these paths, and shares the other subtrees with the
+    template: it must not be modified, use `unlooped` to get a copy. When only the symbol names are needed,
+    `iter_substituted_names` substitutes a list of names without building any node.
+    """
+
+    def __init__(self, node, loop_variables_nodes, unloop_keys=None):
+        self.node = node
+        self.loop_variables_nodes = loop_variables_nodes
+        self.loop_variables_names = [loop_variable_node['name'] for loop_variable_node in loop_variables_nodes]
+        self.unloop_keys = unloop_keys
+        self.contains_loops = False
+        self.paths_tree = self.compile_paths(node)
+
+    def compile_paths(self, node):
+        """
+        Return the tree of the paths to the symbols to substitute: a dict of the keys or indexes leading to them,
+        `True` for such a symbol, or None when `node` contains none.
+        """
+        if isinstance(node, dict):
+            node_type = node.get('type')
+            if node_type == 'symbol':
+                name = node['value']
+                return True if any(loop_variable_name in name for loop_variable_name in self.loop_variables_names) \
+                    else None
+            if node_type in ('loop_expression', 'pour_formula'):
+                self.contains_loops = True
+            items = node.items()
+        elif isinstance(node, list):
+            items = enumerate(node)
+        else:
+            return None
+        paths_tree = {}
+        for key, child_node in items:
+            child_paths_tree = self.compile_paths(child_node)
+            if child_paths_tree is not None:
+                paths_tree[key] = child_paths_tree
+        return paths_tree or None
+
+    def iter_value_dicts(self):
+        sequences = [
+            list(mapcat(enumeration_node_to_sequence, loop_variable_node['enumerations']))
+            for loop_variable_node in self.loop_variables_nodes
+            ]
+        for loop_variables_values in itertools.product(*sequences):
+            yield dict(zip(self.loop_variables_names, loop_variables_values))
+
+    def iter_unlooped_views(self):
+        for value_by_loop_variable_name in self.iter_value_dicts():
+            yield self.unlooped_view(value_by_loop_variable_name)
+
+    def iter_substituted_names(self, names):
+        """
+        For each combination of the values of the loop variables, yield `names` substituted like the symbols of the
+        unlooped views.
+        """
+        for value_by_loop_variable_name in self.iter_value_dicts():
+            yield [substitute(name, value_by_loop_variable_name) for name in names]
+
+    def unlooped_view(self, value_by_loop_variable_name):
+        if self.paths_tree is None:
+            new_node = self.node
+        else:
+            new_node = copy_along_paths(self.node, self.paths_tree, value_by_loop_variable_name)
+        if self.unloop_keys is not None:
+            if new_node is self.node:
+                new_node = dict(new_node)
+            for key in self.unloop_keys:
+                new_node[key] = substitute(new_node[key], value_by_loop_variable_name)
+        return new_node
+
+
+def copy_along_paths(node, paths_tree, value_by_loop_variable_name):
+    if paths_tree is True:
+        new_node = dict(node)
+        new_node['value'] = substitute(node['value'], value_by_loop_variable_name)
+        return new_node
+    new_node = dict(node) if isinstance(node, dict) else list(node)
+    for key, child_paths_tree in paths_tree.items():
+        new_node[key] = copy_along_paths(node[key], child_paths_tree, value_by_loop_variable_name)
+    return new_node